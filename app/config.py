@@ -1,10 +1,10 @@
 from __future__ import annotations
 
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Optional
 
-import torch
 from dotenv import load_dotenv, find_dotenv
 from loguru import logger
 
@@ -18,30 +18,180 @@ RESULTS_DIR: Path = (BASE_DIR / "results").resolve()
 RESULTS_DIR.mkdir(parents=True, exist_ok=True)
 
 # ===== Models =====
+MODEL_SUFFIXES = (".pt",)  # mở rộng thêm nếu hỗ trợ loader khác
+# Bản INT8 do app.services.quantization tạo: MODELS_DIR/<model>-int8.onnx, chọn được như model thường (<model>-int8)
+INT8_SUFFIX = "-int8"
+INT8_GLOB = f"*{INT8_SUFFIX}.onnx"
+# Ảnh chụp lúc start; lúc chạy dùng app.services.registry.model_registry (theo dõi MODELS_DIR, hot-reload)
 AVAILABLE_MODELS: Dict[str, Path] = {
     p.stem: p.resolve()
     for p in MODELS_DIR.glob("*.*")
-    if p.suffix.lower() in (".pt",)  # mở rộng thêm nếu hỗ trợ loader khác
+    if p.suffix.lower() in MODEL_SUFFIXES or p.match(INT8_GLOB)
 }
 if not AVAILABLE_MODELS:
     logger.warning("No model files found in ./models directory")
 
-_env_model = os.getenv("MODEL_NAME")
+# MODEL_NAME; DEFAULT_MODEL là tên cũ (helm chart cũ), vẫn nhận
+_env_model = os.getenv("MODEL_NAME") or os.getenv("DEFAULT_MODEL")
+if _env_model and _env_model not in AVAILABLE_MODELS:
+    logger.warning(f"MODEL_NAME '{_env_model}' not found in ./models, falling back")
 if _env_model and _env_model in AVAILABLE_MODELS:
     DEFAULT_MODEL_NAME: Optional[str] = _env_model
 elif "yolo12m" in AVAILABLE_MODELS:
     DEFAULT_MODEL_NAME = "yolo12m"
 else:
-    DEFAULT_MODEL_NAME = next(iter(AVAILABLE_MODELS), None)
+    DEFAULT_MODEL_NAME = next((n for n, p in sorted(AVAILABLE_MODELS.items()) if p.suffix in MODEL_SUFFIXES), None)
 
 if DEFAULT_MODEL_NAME is None:
     raise RuntimeError("No models available. Put at least one .pt in ./models/")
 
+# ===== Inference backend =====
+# torch | onnx (ONNX Runtime, export .pt -> .onnx 1 lần, cache cạnh weights)
+# | mmap (torch, weights đã fuse/fp32 convert 1 lần vào MODELS_DIR/.mmap/, load bằng mmap: trang đọc khi cần,
+#   dùng chung page cache giữa các process trên node)
+INFERENCE_BACKEND: str = os.getenv("INFERENCE_BACKEND", "torch").lower()
+# Override theo từng model, vd: "yolo12m=onnx,yolov8s=torch"
+MODEL_BACKENDS: Dict[str, str] = {
+    k.strip(): v.strip().lower()
+    for k, _, v in (item.partition("=") for item in os.getenv("MODEL_BACKENDS", "").split(","))
+    if k.strip() and v.strip()
+}
+ONNX_OPSET: int = int(os.getenv("ONNX_OPSET", "0"))  # 0 = để ultralytics tự chọn
+MMAP_DIR: Path = Path(os.getenv("MMAP_DIR", str(MODELS_DIR / ".mmap"))).resolve()
+
+# ===== INT8 quantization (python -m app.services.quantization) =====
+QUANT_MODE: str = os.getenv("QUANT_MODE", "static").lower()  # static (calibrate, QDQ) | dynamic (không cần ảnh)
+QUANT_CALIB_IMAGES: int = int(os.getenv("QUANT_CALIB_IMAGES", "64"))  # số ảnh calibrate cho static
+QUANT_EXCLUDE_HEAD: bool = os.getenv("QUANT_EXCLUDE_HEAD", "true").lower() == "true"  # giữ Detect head ở FP32
+QUANT_REPORT_CSV: Path = Path(
+    os.getenv("QUANT_REPORT_CSV", str(BASE_DIR.parent / "train_progress" / "evaluation" / "model_comparison_int8.csv"))
+)
+
+# ===== Model registry (hot-reload: thêm/sửa/xoá .pt trong MODELS_DIR không cần restart) =====
+# File mới/sửa chỉ được nhận khi stat không đổi qua 2 lần quét liên tiếp (nên copy vào rồi rename cho chắc)
+MODEL_WATCH_INTERVAL: float = float(os.getenv("MODEL_WATCH_INTERVAL", "10"))  # giây giữa 2 lần quét, 0 = tắt
+
+# ===== Model pool (giữ nhiều model cùng lúc, LRU) =====
+MODEL_POOL_MAX_MODELS: int = int(os.getenv("MODEL_POOL_MAX_MODELS", "2"))
+MODEL_POOL_MEM_MB: float = float(os.getenv("MODEL_POOL_MEM_MB", "1024"))  # 0 = không giới hạn
+
 # ===== Inference params =====
 CONF: float = float(os.getenv("CONF", "0.25"))
 IOU: float = float(os.getenv("IOU", "0.45"))
 IMG_SIZE: int = int(os.getenv("IMG_SIZE", "640"))
-DEVICE: str = "cuda" if torch.cuda.is_available() else "cpu"
+# Input chữ nhật theo tỉ lệ ảnh (cạnh dài = IMG_SIZE, làm tròn lên bội số stride) thay vì letterbox vuông
+INFER_RECT: bool = os.getenv("INFER_RECT", "false").lower() == "true"
+MODEL_STRIDE: int = int(os.getenv("MODEL_STRIDE", "32"))  # stride lớn nhất của model (YOLO: 32)
+# auto|cpu|cuda. auto hỏi torch lần đầu cần tới (get_device), import config không kéo theo torch
+DEVICE_SETTING: str = os.getenv("DEVICE", "auto").lower()
+
+
+@lru_cache(maxsize=1)
+def get_device() -> str:
+    if DEVICE_SETTING != "auto":
+        return DEVICE_SETTING
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+# ===== Image intake =====
+INTAKE_DRAFT: bool = os.getenv("INTAKE_DRAFT", "true").lower() == "true"  # JPEG decode thẳng ở ~IMG_SIZE
+INTAKE_MAX_PIXELS: int = int(os.getenv("INTAKE_MAX_PIXELS", "50000000"))  # w*h tối đa của ảnh upload, 0 = không giới hạn
+
+# ===== URL fetch (/predict/url, /predict/urls) =====
+URL_FETCH_MAX_BYTES: int = int(os.getenv("URL_FETCH_MAX_BYTES", str(20 * 2**20)))
+URL_FETCH_TIMEOUT: float = float(os.getenv("URL_FETCH_TIMEOUT", "20"))
+URL_FETCH_MAX_CONNECTIONS: int = int(os.getenv("URL_FETCH_MAX_CONNECTIONS", "64"))
+URL_FETCH_PER_HOST: int = int(os.getenv("URL_FETCH_PER_HOST", "8"))  # request song song tối đa tới 1 host
+URL_BATCH_MAX: int = int(os.getenv("URL_BATCH_MAX", "64"))  # số URL tối đa mỗi request /predict/urls
+
+# ===== Batching (gom request 1 ảnh thành batch) =====
+BATCH_MAX_SIZE: int = int(os.getenv("BATCH_MAX_SIZE", "8"))  # <= 1 để tắt
+BATCH_MAX_WAIT_MS: float = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+# Số ảnh mỗi batch predict của /predict/images
+PREDICT_IMAGES_CHUNK: int = int(os.getenv("PREDICT_IMAGES_CHUNK", str(max(BATCH_MAX_SIZE, 1))))
+
+# ===== Video (/predict/video) =====
+ALLOWED_VIDEO_EXT = {"mp4", "mov", "avi", "mkv", "webm"}
+VIDEO_BATCH_SIZE: int = int(os.getenv("VIDEO_BATCH_SIZE", str(max(BATCH_MAX_SIZE, 1))))  # frame mỗi lần predict
+VIDEO_DEFAULT_STRIDE: int = int(os.getenv("VIDEO_DEFAULT_STRIDE", "1"))  # lấy 1 frame mỗi N frame
+VIDEO_MAX_FRAMES: int = int(os.getenv("VIDEO_MAX_FRAMES", "0"))  # số frame infer tối đa mỗi video, 0 = không giới hạn
+
+# ===== Keyframe + tracker mode (mode=track cho video/stream) =====
+TRACK_KEYFRAME_INTERVAL: int = int(os.getenv("TRACK_KEYFRAME_INTERVAL", "10"))  # chạy detector ít nhất mỗi N frame
+TRACK_SCENE_THRESHOLD: float = float(os.getenv("TRACK_SCENE_THRESHOLD", "0.15"))  # chênh lệch thumbnail (0-1), 0 = tắt
+TRACK_MIN_CONF: float = float(os.getenv("TRACK_MIN_CONF", "0.3"))  # conf trung bình track dưới ngưỡng -> detect lại
+TRACK_CONF_DECAY: float = float(os.getenv("TRACK_CONF_DECAY", "0.9"))  # conf track nhân thêm mỗi frame propagate
+TRACK_IOU_MATCH: float = float(os.getenv("TRACK_IOU_MATCH", "0.3"))
+
+# ===== Camera stream (WebSocket /predict/stream) =====
+STREAM_MAX_FRAME_BYTES: int = int(os.getenv("STREAM_MAX_FRAME_BYTES", str(5 * 2**20)))  # 1 frame đã encode (JPEG/PNG)
+STREAM_PERSIST: bool = os.getenv("STREAM_PERSIST", "false").lower() == "true"  # mặc định không lưu kết quả từng frame
+STREAM_LATENCY_WINDOW: int = int(os.getenv("STREAM_LATENCY_WINDOW", "256"))  # số frame gần nhất để tính p50/p95
+
+# ===== Bulk GCS prefix (/predict/gcs/bulk, python -m app.services.bulk) =====
+BULK_DOWNLOAD_WORKERS: int = int(os.getenv("BULK_DOWNLOAD_WORKERS", "16"))
+BULK_DECODE_WORKERS: int = int(os.getenv("BULK_DECODE_WORKERS", "4"))
+BULK_UPLOAD_WORKERS: int = int(os.getenv("BULK_UPLOAD_WORKERS", "8"))
+BULK_BATCH_SIZE: int = int(os.getenv("BULK_BATCH_SIZE", str(max(BATCH_MAX_SIZE, 1))))
+BULK_PREFETCH: int = int(os.getenv("BULK_PREFETCH", "64"))  # số ảnh đã tải chờ decode
+BULK_MAX_JOBS: int = int(os.getenv("BULK_MAX_JOBS", "1"))  # job chạy song song tối đa
+BULK_UPLOAD_RETRIES: int = int(os.getenv("BULK_UPLOAD_RETRIES", "2"))  # thử lại upload GCS trước khi tính object lỗi
+BULK_JOB_TTL: float = float(os.getenv("BULK_JOB_TTL", "3600"))  # giây giữ job đã kết thúc để GET status/events
+BULK_MAX_FINISHED_JOBS: int = int(os.getenv("BULK_MAX_FINISHED_JOBS", "50"))  # giữ tối đa N job đã kết thúc
+
+# ===== Result cache (theo hash ảnh + model + CONF/IOU/IMG_SIZE) =====
+RESULT_CACHE_SIZE: int = int(os.getenv("RESULT_CACHE_SIZE", "1024"))  # 0 = tắt tier RAM
+RESULT_CACHE_DISK: bool = os.getenv("RESULT_CACHE_DISK", "false").lower() == "true"  # tier disk dưới RESULTS_DIR/_cache
+RESULT_CACHE_DIR: Path = RESULTS_DIR / "_cache"  # nội bộ, không serve qua /results
+RESULT_CACHE_DISK_MAX_ENTRIES: int = int(os.getenv("RESULT_CACHE_DISK_MAX_ENTRIES", "100000"))
+
+# ===== Annotation =====
+# lazy: chỉ lưu ảnh gốc + detections, vẽ khi URL annotate được fetch lần đầu (rồi cache); eager: vẽ PNG ngay trong request
+ANNOTATION_MODE: str = os.getenv("ANNOTATION_MODE", "lazy").lower()
+ANNOTATION_FORMAT: str = os.getenv("ANNOTATION_FORMAT", "jpeg").lower()  # png|jpeg|webp|svg|json
+ANNOTATION_QUALITY: int = int(os.getenv("ANNOTATION_QUALITY", "85"))
+ANNOTATION_MAX_SIZE: int = int(os.getenv("ANNOTATION_MAX_SIZE", "0"))  # cạnh dài tối đa, 0 = giữ nguyên
+
+# ===== Result persistence (write-behind) =====
+PERSIST_MODE: str = os.getenv("PERSIST_MODE", "async").lower()  # async: ghi nền; sync: ghi trong request
+PERSIST_QUEUE_SIZE: int = int(os.getenv("PERSIST_QUEUE_SIZE", "1024"))  # đầy thì ghi luôn trong request
+PERSIST_WORKERS: int = int(os.getenv("PERSIST_WORKERS", "2"))
+PERSIST_BATCH_SIZE: int = int(os.getenv("PERSIST_BATCH_SIZE", "32"))
+
+# ===== Startup preload + warmup (readiness /readyz chỉ ready sau bước này) =====
+PRELOAD_ON_STARTUP: bool = os.getenv("PRELOAD_ON_STARTUP", "true").lower() == "true"
+# Model load sẵn khi start, mặc định chỉ model mặc định. Vd: "yolo12m,yolov8s"
+PRELOAD_MODELS = [m.strip() for m in os.getenv("PRELOAD_MODELS", DEFAULT_MODEL_NAME).split(",") if m.strip()]
+# Shape (HxW) chạy warmup, nên khớp shape thật (INFER_RECT: vd "256x640,640x640")
+WARMUP_SHAPES = [
+    tuple(int(v) for v in shape.lower().split("x"))
+    for shape in os.getenv("WARMUP_SHAPES", f"{IMG_SIZE}x{IMG_SIZE}").split(",")
+    if shape.strip()
+]
+WARMUP_BATCH_SIZES = [int(b) for b in os.getenv("WARMUP_BATCH_SIZES", "1").split(",") if b.strip()]
+WARMUP_RUNS: int = int(os.getenv("WARMUP_RUNS", "2"))  # số lần predict mỗi shape/batch size
+
+# ===== Torch threads (theo CPU quota của container, chia cho số worker) =====
+TORCH_THREADS: str = os.getenv("TORCH_THREADS", "auto").lower()  # auto: đo thử lúc start | số cố định | off
+if TORCH_THREADS not in ("auto", "off") and not TORCH_THREADS.isdigit():
+    logger.warning(f"Invalid TORCH_THREADS='{TORCH_THREADS}', using 'auto'")
+    TORCH_THREADS = "auto"
+TORCH_INTEROP_THREADS: int = int(os.getenv("TORCH_INTEROP_THREADS", "1"))  # chỉ set được 1 lần, trước khi torch chạy
+TORCH_AUTOTUNE_RUNS: int = int(os.getenv("TORCH_AUTOTUNE_RUNS", "3"))  # số lần predict mỗi cấu hình thử
+WEB_WORKERS: int = int(os.getenv("WEB_CONCURRENCY", "1"))  # số worker uvicorn trong cùng container
+
+# ===== Pre-fork serving (python -m app.serve: master load model 1 lần rồi fork worker dùng chung weights) =====
+SERVE_HOST: str = os.getenv("HOST", "0.0.0.0")
+SERVE_PORT: int = int(os.getenv("PORT", "5000"))
+PREFORK_REPORT_AFTER: float = float(os.getenv("PREFORK_REPORT_AFTER", "15"))  # log bảng bộ nhớ sau N giây, 0 = tắt
+PREFORK_MAX_RESPAWNS: int = int(os.getenv("PREFORK_MAX_RESPAWNS", "10"))  # worker chết quá số này thì master thoát
+
+# ===== Inference executor (pool riêng cho việc blocking, có giới hạn hàng đợi) =====
+INFER_WORKERS: int = int(os.getenv("INFER_WORKERS", str(max(BATCH_MAX_SIZE, 4))))
+INFER_QUEUE_SIZE: int = int(os.getenv("INFER_QUEUE_SIZE", "32"))
+INFER_REJECT_STATUS: int = int(os.getenv("INFER_REJECT_STATUS", "503"))  # 503|429
 
 # ===== Tracing / Metrics =====
 JAEGER_HOST: str = os.getenv(
@@ -50,6 +200,7 @@ JAEGER_HOST: str = os.getenv(
 JAEGER_PORT: int = int(os.getenv("JAEGER_PORT", "6831"))
 PROM_PORT: int = int(os.getenv("PROM_PORT", "8097"))
 TRACING_MODE: str = os.getenv("TRACING", "auto").lower()  # auto|on|off
+TRACING_RESOLVE_TIMEOUT: float = float(os.getenv("TRACING_RESOLVE_TIMEOUT", "0.2"))  # chờ DNS Jaeger (auto) lúc start
 
 # ===== Storage =====
 STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "local").lower()  # local|gcs|both
@@ -57,3 +208,10 @@ SIGNED_URL_EXP_HOURS: int = int(os.getenv("SIGNED_URL_EXP_HOURS", "24"))
 RESULTS_PREFIX: str = os.getenv("RESULTS_PREFIX", "results")
 
 SERVICE_NAME_STR: str = "inference-service"
+
+
+def __getattr__(name: str):
+    # `from app.config import DEVICE` (code cũ) vẫn chạy, chỉ resolve (import torch) khi thật sự đọc
+    if name == "DEVICE":
+        return get_device()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
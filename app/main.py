@@ -5,14 +5,21 @@ import os
 import uvicorn
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException
 from loguru import logger
 from prometheus_client import Gauge, Summary, start_http_server
 
-from app.config import PROM_PORT, RESULTS_DIR
+from app.config import PROM_PORT, RESULT_CACHE_DIR, RESULTS_DIR
 from app.routers.health import router as health_router
 from app.routers.model import router as model_router
 from app.routers.predict import router as predict_router
+from app.routers.stream import router as stream_router
 from app.services.inference import set_prom_client
+from app.services.fetcher import url_fetcher
+from app.services.persistence import persist_queue
+from app.services.tracing import setup_telemetry
+from app.services.registry import model_registry
+from app.services.warmup import start_model_watcher, start_warmup
 
 app = FastAPI(
     title="Detection Inference Service",
@@ -20,19 +27,47 @@ app = FastAPI(
     openapi_url="/detection/openapi.json",
 )
 
+
+class ResultsStaticFiles(StaticFiles):
+    """Static kết quả dưới RESULTS_DIR, trừ thư mục nội bộ (tier disk của result cache)."""
+
+    _private = {RESULT_CACHE_DIR.relative_to(RESULTS_DIR).parts[0]}
+
+    async def get_response(self, path: str, scope):
+        if path.split(os.sep, 1)[0] in self._private:
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+
 # Static kết quả
-app.mount("/results", StaticFiles(directory=str(RESULTS_DIR)), name="results")
+app.mount("/results", ResultsStaticFiles(directory=str(RESULTS_DIR)), name="results")
 
 # Routers
 app.include_router(health_router)
 app.include_router(model_router)
 app.include_router(predict_router)
+app.include_router(stream_router)
+
+
+# Metrics + tracing (SDK, exporter, resolve Jaeger) bật ở startup thay vì lúc import
+app.add_event_handler("startup", setup_telemetry)
+
+# Load + warmup model ở nền ngay khi start, /readyz chỉ ready sau bước này
+app.add_event_handler("startup", start_warmup)
+
+# Theo dõi MODELS_DIR: checkpoint mới được load + warmup ở nền rồi swap, không cần restart pod
+app.add_event_handler("startup", start_model_watcher)
+
+# Ghi nốt kết quả còn trong hàng đợi write-behind trước khi process thoát
+app.add_event_handler("shutdown", persist_queue.close)
+app.add_event_handler("shutdown", url_fetcher.aclose)
+app.add_event_handler("shutdown", model_registry.stop)
 
 
-def _start_prom_server():
+def _start_prom_server(port: int = PROM_PORT):
     try:
-        start_http_server(port=PROM_PORT, addr="0.0.0.0")
-        logger.info(f"Prometheus metrics server started on :{PROM_PORT}")
+        start_http_server(port=port, addr="0.0.0.0")
+        logger.info(f"Prometheus metrics server started on :{port}")
     except OSError as e:
         logger.warning(f"Prometheus port busy, skip starting metrics server: {e}")
 
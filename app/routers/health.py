@@ -1,8 +1,14 @@
 from __future__ import annotations
 
+import os
+
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 
-from app.services.inference import _loaded_model
+from app.services.executor import inference_executor
+from app.services.memory import smaps_rollup
+from app.services.threads import thread_tuner
+from app.services.warmup import readiness
 
 router = APIRouter()
 
@@ -14,4 +20,31 @@ def read_root():
 
 @router.get("/healthz")
 def health_check():
+    """Liveness: process còn sống (không nói gì về model)."""
     return {"status": "healthy"}
+
+
+@router.get("/readyz")
+def readiness_check():
+    """
+    Readiness: 200 chỉ khi model đã preload + warmup xong và hàng đợi inference chưa đầy.
+    503 khi đang load/warmup, warmup lỗi, hoặc đang bão hoà (để load balancer tạm bỏ pod ra).
+    """
+    body = readiness.to_dict()
+    body["inflight"] = inference_executor.inflight
+    body["capacity"] = inference_executor.capacity
+    if readiness.ready and inference_executor.saturated():
+        body["status"] = "saturated"
+    return JSONResponse(body, status_code=200 if body["status"] == "ready" else 503)
+
+
+@router.get("/info")
+def runtime_info():
+    """Cấu hình runtime của worker này: CPU quota, số thread torch đã chọn, kết quả autotune, bộ nhớ process."""
+    return {
+        "threads": thread_tuner.info(),
+        "memory": smaps_rollup(),
+        "parent_pid": os.getppid(),
+        "inflight": inference_executor.inflight,
+        "capacity": inference_executor.capacity,
+    }
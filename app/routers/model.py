@@ -2,8 +2,10 @@ from __future__ import annotations
 
 from fastapi import APIRouter, HTTPException, Query
 
-from app.config import AVAILABLE_MODELS, CONF, IOU, IMG_SIZE
-from app.services.inference import load_model, _loaded_model_name, current_model_path, _class_names
+from app.config import CONF, IOU, IMG_SIZE, get_device
+from app.services.backends import backend_name_for
+from app.services.inference import select_model, current_model_path, class_names, model_pool
+from app.services.registry import model_registry
 from app.schemas.model import ModelInfo
 
 router = APIRouter(prefix="/model", tags=["model"])
@@ -11,17 +13,37 @@ router = APIRouter(prefix="/model", tags=["model"])
 
 @router.post("/select", response_model=ModelInfo)
 def model_select(
-    name: str = Query(..., description="Chọn model", enum=sorted(AVAILABLE_MODELS.keys()))
+    name: str = Query(..., description="Chọn model (danh sách hiện tại: GET /model/registry)")
 ):
-    if name not in AVAILABLE_MODELS:
+    if name not in model_registry:
         raise HTTPException(status_code=404, detail=f"Model '{name}' không tồn tại")
-    load_model(name)
+    name = select_model(name)
     return ModelInfo(
-        name=_loaded_model_name,
-        path=str(current_model_path()),
-        device="cuda" if name else "cpu",
+        name=name,
+        path=str(current_model_path(name)),
+        device=get_device(),
+        backend=backend_name_for(name),
         conf=CONF,
         iou=IOU,
         img_size=IMG_SIZE,
-        class_names=_class_names or [],
+        class_names=class_names(name),
     )
+
+
+@router.get("/pool")
+def model_pool_stats():
+    """Model đang resident, refcount và hit/miss/load-time của pool."""
+    return model_pool.stats()
+
+
+@router.get("/registry")
+def model_registry_info():
+    """Model trên đĩa (version = sha256 file), version đang phục vụ, load time và lần hot-reload gần nhất."""
+    info = model_registry.info()
+    serving = {m["name"]: m for m in model_pool.stats()["models"]}
+    for name, rec in info["models"].items():
+        entry = serving.get(name)
+        rec["resident"] = entry is not None
+        rec["serving_version"] = entry["version"] if entry else None
+        rec["load_seconds"] = entry["load_seconds"] if entry else None
+    return info
@@ -1,17 +1,25 @@
 from __future__ import annotations
 
+import asyncio
 import json
-from io import BytesIO
+import os
+import tempfile
 from pathlib import Path
-from time import time
-from typing import List
+from time import monotonic, time
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+from urllib.parse import urlsplit
 
-import requests
-from fastapi import APIRouter, Body, File, Form, HTTPException, Request, UploadFile
-from PIL import Image, UnidentifiedImageError
+from fastapi import APIRouter, Body, Depends, File, Form, HTTPException, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from loguru import logger
+from PIL import UnidentifiedImageError
+from starlette.background import BackgroundTask
 
 from app.schemas.predict import (
+    BulkGcsIn,
     UrlPredictIn,
+    UrlsPredictIn,
     GCSPredictIn,
     PredictOut,
     ImageInfo,
@@ -23,84 +31,255 @@ from app.services.inference import (
     load_model,
     current_model_path,
     infer_pil,
+    infer_batch,
+    result_cache,
+    to_columnar,
     annotate_image,
     parse_result,
     record_metrics,
     save_prediction_payload,
+    save_source_image,
 )
-from app.config import CONF, IOU, IMG_SIZE
-from app.utils import parse_gcs_input, download_bytes  # giữ utils của bạn
+from app.services.annotation import (
+    ANNOTATION_FORMATS,
+    RASTER_FORMATS,
+    VECTOR_FORMATS,
+    annotation_url,
+    cached_name,
+    normalize_format,
+    render_annotation,
+)
+from app.services.bulk import BulkJob, active_bulk_jobs, bulk_jobs, parse_bulk_source, start_bulk_job
+from app.services.executor import inference_executor, inference_slot, run_blocking
+from app.services.fetcher import url_fetcher
+from app.services.intake import DecodedImage, decode_image
+from app.services.result_cache import content_digest
+from app.services.persistence import persist_queue
+from app.services.storage import local_result_path
+from app.services.tracking import KeyframeTracker
+from app.services.video import FrameReader, check_video_ext, spool_to_tempfile, video_fps_hist, video_frames
+from app.config import (
+    CONF,
+    IOU,
+    IMG_SIZE,
+    get_device,
+    PREDICT_IMAGES_CHUNK,
+    ANNOTATION_MODE,
+    ANNOTATION_QUALITY,
+    ANNOTATION_MAX_SIZE,
+    URL_BATCH_MAX,
+    BULK_MAX_JOBS,
+    VIDEO_BATCH_SIZE,
+    VIDEO_DEFAULT_STRIDE,
+    VIDEO_MAX_FRAMES,
+    TRACK_KEYFRAME_INTERVAL,
+    TRACK_SCENE_THRESHOLD,
+    TRACK_MIN_CONF,
+)
+from app.utils import parse_gcs_input, download_bytes, download_to_file  # giữ utils của bạn
 
 router = APIRouter(prefix="/predict", tags=["predict"])
 
 
+FORMAT_QUERY = Query(
+    "rows",
+    enum=["rows", "columnar"],
+    description="rows: list detection; columnar: mảng song song boxes/scores/class_ids (không validate từng detection)",
+)
+
+
+def _respond(out: dict, fmt: str):
+    """format=columnar: trả JSONResponse thẳng, bỏ qua validate List[Detection] của response_model."""
+    if fmt != "columnar":
+        return out
+    out["detections"] = to_columnar(out["detections"])
+    return JSONResponse(out)
+
+
+def _intake(data: bytes) -> Tuple[DecodedImage, str]:
+    """Decode ảnh (draft ~IMG_SIZE, chặn ảnh quá lớn) + hash nội dung (key cho result cache)."""
+    return decode_image(data), content_digest(data)
+
+
+def _annotation_opts(
+    annotation_format: Optional[str] = Query(None, enum=sorted(ANNOTATION_FORMATS), description="Format ảnh annotate (lazy)"),
+    annotation_quality: Optional[int] = Query(None, ge=1, le=100),
+    annotation_max_size: Optional[int] = Query(None, ge=0, description="Cạnh dài tối đa, 0 = giữ nguyên"),
+) -> dict:
+    try:
+        fmt = normalize_format(annotation_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"fmt": fmt, "quality": annotation_quality, "max_size": annotation_max_size}
+
+
+DURABLE_QUERY = Query(False, description="Chờ kết quả ghi xong (local/GCS) rồi mới trả response")
+
+
+def _save_outputs(
+    stem: str, payload: dict, res0, source: bytes, annotated: bool, model_name: str, ann: dict, durable: bool = False
+):
+    """
+    Lưu result.json + ảnh annotate.
+    eager: vẽ PNG ngay; lazy: chỉ lưu ảnh gốc, trả URL /predict/annotated/... để vẽ khi được fetch.
+    """
+    ts = int(time() * 1000)
+    lazy = annotated and ANNOTATION_MODE != "eager"
+    png_bytes = annotate_image(res0) if annotated and not lazy else None
+    json_meta, png_meta, base_dir = save_prediction_payload(stem, ts, payload, png_bytes, model_name, durable=durable)
+    if lazy:
+        save_source_image(base_dir, source, durable=durable)
+        png_meta = {"web_path": annotation_url(base_dir, **ann), "gcs": None}
+    return json_meta, png_meta
+
+
 @router.post("/image", response_model=PredictOut)
 async def predict_image(
     request: Request,
     file: UploadFile = File(...),
     annotated: bool = True,
+    format: str = FORMAT_QUERY,
+    ann: dict = Depends(_annotation_opts),
+    durable: bool = DURABLE_QUERY,
 ):
     req_model = resolve_requested_model(request)
-    load_model(req_model)
 
     data = await file.read()
-    try:
-        pil = Image.open(BytesIO(data)).convert("RGB")
-    except UnidentifiedImageError:
-        raise HTTPException(status_code=400, detail="Uploaded file is not a valid image.")
-
-    w, h, elapsed, dets, res0 = infer_pil(pil)
-    record_metrics("/predict/image", elapsed, len(dets))
-
-    ts = int(time() * 1000)
-    stem = Path(file.filename).stem if file.filename else "image"
-
-    resp = {
-        "model": {
-            "name": req_model,
-            "path": str(current_model_path()),
-            "device": "cuda" if req_model else "cpu",
-            "params": {"imgsz": IMG_SIZE, "conf": CONF, "iou": IOU},
-        },
-        "image": {"width": w, "height": h},
-        "inference": {"time_seconds": elapsed, "detections": len(dets)},
-        "detections": dets,
-        "web_path": None,
-        "gcs": None,
-    }
-
-    png_bytes = annotate_image(res0) if annotated else None
-    json_meta, png_meta, _ = save_prediction_payload(stem, ts, resp, png_bytes)
+    async with inference_slot():
+        req_model = await run_blocking(load_model, req_model)
+        try:
+            pil, digest = await run_blocking(_intake, data)
+        except UnidentifiedImageError:
+            raise HTTPException(status_code=400, detail="Uploaded file is not a valid image.")
+
+        w, h, elapsed, dets, res0 = await run_blocking(infer_pil, pil, req_model, digest)
+        record_metrics("/predict/image", elapsed, len(dets), req_model)
+
+        stem = Path(file.filename).stem if file.filename else "image"
+
+        resp = {
+            "model": {
+                "name": req_model,
+                "path": str(current_model_path(req_model)),
+                "device": get_device(),
+                "params": {"imgsz": IMG_SIZE, "conf": CONF, "iou": IOU},
+            },
+            "image": {"width": w, "height": h},
+            "inference": {"time_seconds": elapsed, "detections": len(dets)},
+            "detections": dets,
+            "web_path": None,
+            "gcs": None,
+        }
+
+        json_meta, png_meta = await run_blocking(
+            _save_outputs, stem, resp, res0, data, annotated, req_model, ann, durable
+        )
 
     out = resp.copy()
     out["result_json"] = json_meta
     if png_meta:
         out["web_path"] = png_meta.get("web_path")
         out["gcs"] = png_meta.get("gcs")
-    return out
+    return _respond(out, format)
 
 
-@router.post("/images")
-async def predict_images(
-    request: Request,
-    files: List[UploadFile] = File(...),
-    annotated: bool = True,
-):
-    req_model = resolve_requested_model(request)
-    load_model(req_model)
 
-    results = []
-    for f in files:
+def _infer_chunk(pils: List[DecodedImage], model_name: str, digests: List[str]) -> list:
+    """1 batch predict cho cả chunk; lỗi thì chạy lại từng ảnh để cô lập ảnh hỏng."""
+    try:
+        return infer_batch(pils, model_name, digests)
+    except Exception:
+        out = []
+        for pil, digest in zip(pils, digests):
+            try:
+                out.append(infer_batch([pil], model_name, [digest])[0])
+            except Exception as e:
+                out.append(e)
+        return out
+
+
+def _finish_item(
+    item: dict, stem: str, res0, source: bytes, annotated: bool, model_name: str, ann: dict, durable: bool = False
+) -> dict:
+    """Annotate + lưu kết quả cho 1 ảnh (chạy song song trong executor)."""
+    json_meta, png_meta = _save_outputs(stem, item, res0, source, annotated, model_name, ann, durable)
+    item["result_json"] = json_meta
+    if png_meta:
+        item["web_path"] = png_meta.get("web_path")
+        item["gcs"] = png_meta.get("gcs")
+    return item
+
+
+def _error_item(name: Optional[str], e: BaseException, key: str = "filename") -> dict:
+    if isinstance(e, UnidentifiedImageError):
+        return {key: name, "ok": False, "error": "Invalid image file"}
+    if isinstance(e, HTTPException):
+        return {key: name, "ok": False, "error": e.detail}
+    return {key: name, "ok": False, "error": str(e)}
+
+
+def _ndjson(obj: dict) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+async def _iter_predict_many(
+    api_label: str,
+    key: str,
+    names: List[Optional[str]],
+    stems: List[str],
+    blobs: List[object],
+    model_name: str,
+    annotated: bool,
+    format: str,
+    ann: dict,
+    durable: bool,
+) -> AsyncIterator[Tuple[int, dict]]:
+    """
+    Pipeline nhiều ảnh (gọi bên trong inference_slot): decode song song -> infer theo chunk
+    -> annotate + lưu song song. `blobs[i]` là bytes, hoặc Exception nếu tải ảnh đã lỗi.
+    Yield (index, item) theo thứ tự xong (không theo thứ tự input).
+    """
+    def _done(i: int, task: asyncio.Future) -> Tuple[int, dict]:
         try:
-            b = await f.read()
-            pil = Image.open(BytesIO(b)).convert("RGB")
-            w, h, elapsed, dets, res0 = infer_pil(pil)
-            record_metrics("/predict/images", elapsed, len(dets))
-
-            ts = int(time() * 1000)
-            stem = Path(f.filename).stem if f.filename else "image"
+            item = task.result()
+        except Exception as e:
+            return i, _error_item(names[i], e, key)
+        if format == "columnar":
+            item = {**item, "detections": to_columnar(item["detections"])}
+        return i, item
+
+    # 1) Decode song song
+    pending = [i for i, b in enumerate(blobs) if not isinstance(b, BaseException)]
+    for i, b in enumerate(blobs):
+        if isinstance(b, BaseException):
+            yield i, _error_item(names[i], b, key)
+    intake = await asyncio.gather(*(run_blocking(_intake, blobs[i]) for i in pending), return_exceptions=True)
+    decoded: List[Optional[DecodedImage]] = [None] * len(blobs)
+    digests: List[Optional[str]] = [None] * len(blobs)
+    ok_idx = []
+    for i, got in zip(pending, intake):
+        if isinstance(got, BaseException):
+            yield i, _error_item(names[i], got, key)
+        else:
+            decoded[i], digests[i] = got
+            ok_idx.append(i)
+    del intake
+
+    # 2) Infer theo chunk, mỗi chunk 1 batch predict
+    finishing = {}
+    for c in range(0, len(ok_idx), PREDICT_IMAGES_CHUNK):
+        idx = ok_idx[c : c + PREDICT_IMAGES_CHUNK]
+        outs = await run_blocking(_infer_chunk, [decoded[i] for i in idx], model_name, [digests[i] for i in idx])
+        for i, out in zip(idx, outs):
+            decoded[i] = None
+            source, blobs[i] = blobs[i], None
+            if isinstance(out, BaseException):
+                yield i, _error_item(names[i], out, key)
+                continue
+            w, h, elapsed, dets, res0 = out
+            record_metrics(api_label, elapsed, len(dets), model_name)
             item = {
-                "filename": f.filename,
+                key: names[i],
                 "ok": True,
                 "image": {"width": w, "height": h},
                 "inference": {"time_seconds": elapsed, "detections": len(dets)},
@@ -108,67 +287,199 @@ async def predict_images(
                 "web_path": None,
                 "gcs": None,
             }
+            # 3) Annotate + lưu song song, chồng lên chunk infer tiếp theo
+            task = asyncio.ensure_future(
+                run_blocking(_finish_item, item, stems[i], res0, source, annotated, model_name, ann, durable)
+            )
+            finishing[task] = i
+
+        # Item nào đã lưu xong thì trả luôn, không chờ chunk sau
+        for task in [t for t in finishing if t.done()]:
+            yield _done(finishing.pop(task), task)
+
+    while finishing:
+        done, _ = await asyncio.wait(finishing, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield _done(finishing.pop(task), task)
+
+
+async def _predict_many(api_label: str, key: str, names: List[Optional[str]], *args) -> List[dict]:
+    """Như `_iter_predict_many` nhưng gom lại theo thứ tự input."""
+    results: List[Optional[dict]] = [None] * len(names)
+    async for i, item in _iter_predict_many(api_label, key, names, *args):
+        results[i] = item
+    return results
+
+
+async def _stream_many(
+    api_label: str,
+    key: str,
+    names: List[Optional[str]],
+    stems: List[str],
+    blobs: List[object],
+    model_name: Optional[str],
+    *opts,
+):
+    """
+    NDJSON: mỗi item 1 dòng ngay khi xong (kèm `index` theo input), cuối cùng 1 dòng summary.
+    Suất inference được giữ trong lúc stream (response bắt đầu trước khi handler trả về).
+    """
+    t0 = monotonic()
+    count = ok = 0
+    first = None
+    try:
+        async with inference_slot():
+            model_name = await run_blocking(load_model, model_name)
+            async for i, item in _iter_predict_many(api_label, key, names, stems, blobs, model_name, *opts):
+                if first is None:
+                    first = monotonic() - t0
+                count += 1
+                ok += bool(item.get("ok"))
+                yield _ndjson({"type": "item", "index": i, **item})
+        yield _ndjson(
+            {
+                "type": "summary",
+                "model": model_name,
+                "count": count,
+                "ok": ok,
+                "failed": count - ok,
+                "first_result_seconds": round(first or 0.0, 3),
+                "elapsed_seconds": round(monotonic() - t0, 3),
+            }
+        )
+    except HTTPException as e:
+        yield _ndjson({"type": "error", "status": e.status_code, "error": e.detail})
+    except Exception as e:
+        logger.exception("Streaming multi-image prediction failed")
+        yield _ndjson({"type": "error", "status": 500, "error": str(e)})
 
-            png_bytes = annotate_image(res0) if annotated else None
-            json_meta, png_meta, _ = save_prediction_payload(stem, ts, item, png_bytes)
-            item["result_json"] = json_meta
-            if png_meta:
-                item["web_path"] = png_meta.get("web_path")
-                item["gcs"] = png_meta.get("gcs")
 
-            results.append(item)
-        except UnidentifiedImageError:
-            results.append({"filename": f.filename, "ok": False, "error": "Invalid image file"})
-        except Exception as e:
-            results.append({"filename": f.filename, "ok": False, "error": str(e)})
+def _ndjson_response(gen, background: Optional[BackgroundTask] = None) -> StreamingResponse:
+    return StreamingResponse(gen, media_type="application/x-ndjson", background=background)
+
+
+STREAM_QUERY = Query(False, description="true: trả NDJSON, mỗi ảnh 1 dòng ngay khi xong (có thể không theo thứ tự)")
+
+
+@router.post("/images")
+async def predict_images(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    annotated: bool = True,
+    format: str = FORMAT_QUERY,
+    ann: dict = Depends(_annotation_opts),
+    durable: bool = DURABLE_QUERY,
+    stream: bool = STREAM_QUERY,
+):
+    req_model = resolve_requested_model(request)
+    names = [f.filename for f in files]
+    stems = [Path(n).stem if n else "image" for n in names]
+
+    if stream:
+        inference_executor.check_capacity()
+        blobs = [await f.read() for f in files]
+        return _ndjson_response(
+            _stream_many("/predict/images", "filename", names, stems, blobs, req_model, annotated, format, ann, durable)
+        )
+
+    async with inference_slot():
+        req_model = await run_blocking(load_model, req_model)
+        blobs = [await f.read() for f in files]
+        results = await _predict_many(
+            "/predict/images", "filename", names, stems, blobs, req_model, annotated, format, ann, durable
+        )
 
     return {"count": len(results), "results": results}
 
 
+def _url_stem(url: str) -> str:
+    return Path(urlsplit(url).path).stem or "image"
+
+
 # --- URL ➜ nhận form-data ---
 @router.post("/url", response_model=PredictOut)
 async def predict_url_form(
     request: Request,
     annotated: bool = Form(False, description="Return annotated PNG"),
     url: str = Form(..., description="Public image URL"),
-    
+    format: str = FORMAT_QUERY,
+    ann: dict = Depends(_annotation_opts),
+    durable: bool = DURABLE_QUERY,
 ):
     req_model = resolve_requested_model(request)
-    load_model(req_model)
 
-    r = requests.get(url, timeout=20)
-    if r.status_code != 200:
-        raise HTTPException(status_code=400, detail=f"Download failed: HTTP {r.status_code}")
+    # Download async (httpx, stream + giới hạn size), không chiếm thread lẫn suất inference
+    content, _ = await url_fetcher.fetch(url)
 
-    try:
-        pil = Image.open(BytesIO(r.content)).convert("RGB")
-    except UnidentifiedImageError:
-        raise HTTPException(status_code=400, detail="Downloaded file is not a valid image.")
+    async with inference_slot():
+        req_model = await run_blocking(load_model, req_model)
+        try:
+            pil, digest = await run_blocking(_intake, content)
+        except UnidentifiedImageError:
+            raise HTTPException(status_code=400, detail="Downloaded file is not a valid image.")
 
-    w, h, elapsed, dets, res0 = infer_pil(pil)
-    record_metrics("/predict/url", elapsed, len(dets))
+        w, h, elapsed, dets, res0 = await run_blocking(infer_pil, pil, req_model, digest)
+        record_metrics("/predict/url", elapsed, len(dets), req_model)
 
-    ts = int(time() * 1000)
-    stem = Path(url).stem or "image"
-
-    resp = {
-        "source": url,
-        "image": {"width": w, "height": h},
-        "inference": {"time_seconds": elapsed, "detections": len(dets)},
-        "detections": dets,
-        "web_path": None,
-        "gcs": None,
-    }
+        stem = _url_stem(url)
 
-    png_bytes = annotate_image(res0) if annotated else None
-    json_meta, png_meta, _ = save_prediction_payload(stem, ts, resp, png_bytes)
+        resp = {
+            "source": url,
+            "image": {"width": w, "height": h},
+            "inference": {"time_seconds": elapsed, "detections": len(dets)},
+            "detections": dets,
+            "web_path": None,
+            "gcs": None,
+        }
+
+        json_meta, png_meta = await run_blocking(
+            _save_outputs, stem, resp, res0, content, annotated, req_model, ann, durable
+        )
 
     out = resp.copy()
     out["result_json"] = json_meta
     if png_meta:
         out["web_path"] = png_meta.get("web_path")
         out["gcs"] = png_meta.get("gcs")
-    return out
+    return _respond(out, format)
+
+
+@router.post("/urls")
+async def predict_urls(
+    request: Request,
+    body: UrlsPredictIn,
+    format: str = FORMAT_QUERY,
+    ann: dict = Depends(_annotation_opts),
+    durable: bool = DURABLE_QUERY,
+    stream: bool = STREAM_QUERY,
+):
+    """Nhiều URL 1 request: tải song song (giới hạn theo host), infer theo batch như /predict/images."""
+    if len(body.urls) > URL_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Too many URLs (max {URL_BATCH_MAX})")
+    req_model = resolve_requested_model(request)
+    if stream:
+        inference_executor.check_capacity()
+
+    # Tải xong hết rồi mới xin suất inference
+    fetched = await asyncio.gather(*(url_fetcher.fetch(u) for u in body.urls), return_exceptions=True)
+    blobs = [f if isinstance(f, BaseException) else f[0] for f in fetched]
+    del fetched
+    stems = [_url_stem(u) for u in body.urls]
+
+    if stream:
+        return _ndjson_response(
+            _stream_many(
+                "/predict/urls", "source", list(body.urls), stems, blobs, req_model, body.annotated, format, ann, durable
+            )
+        )
+
+    async with inference_slot():
+        req_model = await run_blocking(load_model, req_model)
+        results = await _predict_many(
+            "/predict/urls", "source", list(body.urls), stems, blobs, req_model, body.annotated, format, ann, durable
+        )
+
+    return {"count": len(results), "results": results}
 
 
 # --- GCS ➜ nhận form-data ---
@@ -177,43 +488,45 @@ async def predict_gcs_form(
     request: Request,
     annotated: bool = Form(False, description="Return annotated PNG"),
     source: str = Form(..., description="gs://bucket/path/to/img.jpg hoặc URL GCS"),
-    
+    ann: dict = Depends(_annotation_opts),
+    durable: bool = DURABLE_QUERY,
 ):
     req_model = resolve_requested_model(request)
-    load_model(req_model)
 
     bucket, obj_path = parse_gcs_input(source)
     try:
-        image_bytes = download_bytes(bucket, obj_path)
+        image_bytes = await run_in_threadpool(download_bytes, bucket, obj_path)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Cannot read from GCS: {e}")
 
-    try:
-        pil = Image.open(BytesIO(image_bytes)).convert("RGB")
-    except UnidentifiedImageError:
-        raise HTTPException(status_code=400, detail="Object is not a valid image.")
-
-    w, h, elapsed, dets, res0 = infer_pil(pil)
-    record_metrics("/predict/gcs", elapsed, len(dets))
-
-    ts = int(time() * 1000)
-    stem = Path(obj_path).stem or "image"
-
-    resp = {
-        "source": {"bucket": bucket, "path": obj_path},
-        "model": {
-            "name": req_model,
-            "path": str(current_model_path()),
-            "device": "cuda" if req_model else "cpu",
-            "params": {"imgsz": IMG_SIZE, "conf": CONF, "iou": IOU},
-        },
-        "image": {"width": w, "height": h},
-        "inference": {"time_seconds": elapsed, "detections": len(dets)},
-        "detections": dets,
-    }
-
-    png_bytes = annotate_image(res0) if annotated else None
-    json_meta, png_meta, _ = save_prediction_payload(stem, ts, resp, png_bytes)
+    async with inference_slot():
+        req_model = await run_blocking(load_model, req_model)
+        try:
+            pil, digest = await run_blocking(_intake, image_bytes)
+        except UnidentifiedImageError:
+            raise HTTPException(status_code=400, detail="Object is not a valid image.")
+
+        w, h, elapsed, dets, res0 = await run_blocking(infer_pil, pil, req_model, digest)
+        record_metrics("/predict/gcs", elapsed, len(dets), req_model)
+
+        stem = Path(obj_path).stem or "image"
+
+        resp = {
+            "source": {"bucket": bucket, "path": obj_path},
+            "model": {
+                "name": req_model,
+                "path": str(current_model_path(req_model)),
+                "device": get_device(),
+                "params": {"imgsz": IMG_SIZE, "conf": CONF, "iou": IOU},
+            },
+            "image": {"width": w, "height": h},
+            "inference": {"time_seconds": elapsed, "detections": len(dets)},
+            "detections": dets,
+        }
+
+        json_meta, png_meta = await run_blocking(
+            _save_outputs, stem, resp, res0, image_bytes, annotated, req_model, ann, durable
+        )
 
     return {
         "ok": True,
@@ -221,3 +534,304 @@ async def predict_gcs_form(
         "json_result": json_meta,
         "annotated_result": png_meta,
     }
+
+
+def _bulk_listener(job: BulkJob) -> Tuple[asyncio.Queue, Callable[[], None]]:
+    """Đăng ký nhận event của job (từ thread worker) vào 1 asyncio.Queue của event loop hiện tại."""
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    return events, job.subscribe(lambda ev: loop.call_soon_threadsafe(events.put_nowait, ev))
+
+
+async def _stream_bulk(job: BulkJob, events: asyncio.Queue, unsubscribe: Callable[[], None]):
+    """NDJSON: 1 dòng meta, mỗi object 1 dòng ngay khi xong, cuối cùng summary. Client ngắt không huỷ job."""
+    try:
+        yield _ndjson({"type": "meta", "id": job.id, "source": f"gs://{job.bucket}/{job.prefix}"})
+        if job.finished.is_set():
+            # Job xong trước khi đăng ký: không còn event nào nữa
+            yield _ndjson({"type": "summary", **job.status_dict()})
+            return
+        while True:
+            ev = await events.get()
+            yield _ndjson(ev)
+            if ev["type"] == "summary":
+                return
+    finally:
+        unsubscribe()
+
+
+@router.post("/gcs/bulk", status_code=202)
+async def predict_gcs_bulk(request: Request, body: BulkGcsIn, stream: bool = STREAM_QUERY):
+    """
+    Predict mọi ảnh dưới 1 prefix GCS (job nền). Chạy lại cùng prefix sẽ bỏ qua object đã có kết quả.
+    Theo dõi qua GET /predict/gcs/bulk/{job_id}, hoặc stream=true để nhận NDJSON từng object ngay khi xong.
+    """
+    if len(active_bulk_jobs()) >= BULK_MAX_JOBS:
+        raise HTTPException(status_code=409, detail="A bulk job is already running")
+    try:
+        bucket, prefix = parse_bulk_source(body.source)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid GCS source: {body.source}")
+
+    knobs = body.model_dump(include={"download_workers", "decode_workers", "upload_workers", "batch_size", "prefetch"})
+    job = BulkJob(
+        bucket,
+        prefix,
+        model_name=resolve_requested_model(request),
+        limit=body.limit,
+        overwrite=body.overwrite,
+        **{k: v for k, v in knobs.items() if v is not None},
+    )
+    if stream:
+        # Đăng ký trước khi job chạy để không sót object nào
+        events, unsubscribe = _bulk_listener(job)
+        start_bulk_job(job)
+        return _ndjson_response(_stream_bulk(job, events, unsubscribe))
+    return start_bulk_job(job).status_dict()
+
+
+@router.get("/gcs/bulk/{job_id}")
+def predict_gcs_bulk_status(job_id: str):
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    return job.status_dict()
+
+
+@router.get("/gcs/bulk/{job_id}/events")
+async def predict_gcs_bulk_events(job_id: str):
+    """NDJSON các object xong kể từ lúc kết nối (job đã xong thì chỉ có summary)."""
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    events, unsubscribe = _bulk_listener(job)
+    return _ndjson_response(_stream_bulk(job, events, unsubscribe))
+
+
+@router.delete("/gcs/bulk/{job_id}")
+def predict_gcs_bulk_cancel(job_id: str):
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    job.cancel()
+    return job.status_dict()
+
+
+def _render_annotated(item_path: str, fmt: str, quality: int, max_size: int) -> bytes:
+    """Vẽ ảnh annotate từ result.json + ảnh gốc đã lưu, cache bản raster cạnh kết quả."""
+    name = cached_name(fmt, quality, max_size)
+    if fmt in RASTER_FORMATS:
+        cached = persist_queue.read(f"{item_path}/{name}")
+        if cached is not None:
+            return cached
+
+    raw = persist_queue.read(f"{item_path}/result.json")
+    if raw is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    payload = json.loads(raw)
+    source = persist_queue.read(f"{item_path}/source") if fmt in RASTER_FORMATS else None
+    try:
+        body = render_annotation(payload, source, fmt, quality, max_size)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    if fmt in RASTER_FORMATS:
+        persist_queue.write(f"{item_path}/{name}", body, RASTER_FORMATS[fmt])
+    return body
+
+
+@router.get("/annotated/{item_path:path}")
+async def predict_annotated(
+    item_path: str,
+    fmt: Optional[str] = Query(None, enum=sorted(ANNOTATION_FORMATS)),
+    quality: int = Query(ANNOTATION_QUALITY, ge=1, le=100),
+    max_size: int = Query(ANNOTATION_MAX_SIZE, ge=0),
+):
+    """Ảnh annotate theo yêu cầu: lần đầu vẽ + cache, các lần sau trả file đã cache."""
+    try:
+        fmt = normalize_format(fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    item_path = item_path.strip("/")
+    if not item_path or ".." in item_path.split("/"):
+        raise HTTPException(status_code=400, detail="Invalid result path")
+
+    media_type = ANNOTATION_FORMATS[fmt]
+    if fmt in RASTER_FORMATS:
+        cached = local_result_path(f"{item_path}/{cached_name(fmt, quality, max_size)}")
+        if cached is not None:
+            return FileResponse(cached, media_type=media_type)
+        async with inference_slot():
+            body = await run_blocking(_render_annotated, item_path, fmt, quality, max_size)
+    else:
+        body = await run_in_threadpool(_render_annotated, item_path, fmt, quality, max_size)
+    return Response(body, media_type=media_type)
+
+
+def _unlink(path: str) -> None:
+    Path(path).unlink(missing_ok=True)
+
+
+def _track_frames(tracker: KeyframeTracker, frames: list, model_name: str) -> List[Tuple[list, bool]]:
+    """mode=track: detector chỉ chạy ở keyframe (qua batch scheduler, gom với request khác), còn lại propagate."""
+    return [
+        tracker.step(f.image.array, lambda f=f: infer_pil(f.image, model_name)[3])
+        for f in frames
+    ]
+
+
+async def _stream_video(
+    path: str,
+    model_name: Optional[str],
+    stride: int,
+    max_frames: int,
+    fmt: str,
+    tracker: Optional[KeyframeTracker] = None,
+):
+    """
+    NDJSON: 1 dòng meta, mỗi frame đã infer 1 dòng (theo batch, frame nào xong gửi ngay), cuối cùng 1 dòng summary.
+    Decode batch kế tiếp chạy song song với infer batch hiện tại.
+    Có `tracker` (mode=track): chỉ keyframe chạy model, summary báo số lần infer tiết kiệm được.
+    """
+    t0 = monotonic()
+    reader: Optional[FrameReader] = None
+    try:
+        async with inference_slot():
+            model_name = await run_blocking(load_model, model_name)
+            reader = await run_blocking(FrameReader, path, stride, max_frames)
+            yield _ndjson(
+                {"type": "meta", "model": model_name, "mode": "track" if tracker else "detect", **reader.meta()}
+            )
+
+            infer_seconds = 0.0
+            inferred = 0
+            pending = asyncio.ensure_future(run_blocking(reader.read_batch, VIDEO_BATCH_SIZE))
+            while True:
+                frames = await pending
+                if not frames:
+                    break
+                pending = asyncio.ensure_future(run_blocking(reader.read_batch, VIDEO_BATCH_SIZE))
+
+                t = monotonic()
+                if tracker is None:
+                    outs = await run_blocking(infer_batch, [f.image for f in frames], model_name)
+                    per_frame = [(dets, None) for _, _, _, dets, _ in outs]
+                    video_frames.add(len(frames), {"model": model_name})
+                else:
+                    keys_before = tracker.keyframes
+                    per_frame = await run_blocking(_track_frames, tracker, frames, model_name)
+                    video_frames.add(tracker.keyframes - keys_before, {"model": model_name})
+                infer_seconds += monotonic() - t
+                inferred += len(frames)
+
+                lines = []
+                for f, (dets, keyframe) in zip(frames, per_frame):
+                    line = {
+                        "type": "frame",
+                        "frame": f.index,
+                        "time_seconds": round(f.time_seconds, 3),
+                        "detections": to_columnar(dets) if fmt == "columnar" else dets,
+                    }
+                    if keyframe is not None:
+                        line["keyframe"] = keyframe
+                    lines.append(_ndjson(line))
+                yield "".join(lines)
+
+            elapsed = monotonic() - t0
+            fps = inferred / elapsed if elapsed > 0 else 0.0
+            video_fps_hist.record(fps, {"model": model_name})
+            duration = reader.position / reader.fps if reader.fps else 0.0
+            yield _ndjson(
+                {
+                    "type": "summary",
+                    "frames_read": reader.position,
+                    "frames_inferred": inferred,
+                    "elapsed_seconds": round(elapsed, 3),
+                    "decode_seconds": round(reader.decode_seconds, 3),
+                    "infer_seconds": round(infer_seconds, 3),
+                    "frames_per_second": round(fps, 2),
+                    "video_seconds_per_second": round(duration / elapsed, 2) if elapsed > 0 else 0.0,
+                    "model_invocations": tracker.keyframes if tracker else inferred,
+                    "invocations_saved": tracker.saved if tracker else 0,
+                }
+            )
+    except HTTPException as e:
+        yield _ndjson({"type": "error", "status": e.status_code, "error": e.detail})
+    except Exception as e:
+        logger.exception("Video inference failed")
+        yield _ndjson({"type": "error", "status": 500, "error": str(e)})
+    finally:
+        if reader is not None:
+            reader.close()
+        _unlink(path)
+
+
+def _video_response(path: str, model_name: Optional[str], stride: int, max_frames: int, fmt: str, track: dict):
+    tracker = KeyframeTracker(**track["params"]) if track["mode"] == "track" else None
+    return _ndjson_response(
+        _stream_video(path, model_name, stride, max_frames, fmt, tracker),
+        background=BackgroundTask(_unlink, path),  # phòng khi client ngắt trước khi stream bắt đầu
+    )
+
+
+def _track_opts(
+    mode: str = Query("detect", enum=["detect", "track"], description="track: detector chỉ chạy ở keyframe, giữa các keyframe propagate box"),
+    keyframe_interval: int = Query(TRACK_KEYFRAME_INTERVAL, ge=1),
+    scene_threshold: float = Query(TRACK_SCENE_THRESHOLD, ge=0, le=1),
+    min_track_conf: float = Query(TRACK_MIN_CONF, ge=0, le=1),
+) -> dict:
+    return {
+        "mode": mode,
+        "params": {"interval": keyframe_interval, "scene_threshold": scene_threshold, "min_conf": min_track_conf},
+    }
+
+
+STRIDE_QUERY = Query(VIDEO_DEFAULT_STRIDE, ge=1, description="Lấy 1 frame mỗi N frame")
+MAX_FRAMES_QUERY = Query(VIDEO_MAX_FRAMES, ge=0, description="Số frame infer tối đa, 0 = hết video")
+
+
+@router.post("/video")
+async def predict_video(
+    request: Request,
+    file: UploadFile = File(...),
+    stride: int = STRIDE_QUERY,
+    max_frames: int = MAX_FRAMES_QUERY,
+    format: str = FORMAT_QUERY,
+    track: dict = Depends(_track_opts),
+):
+    """Video upload -> NDJSON stream kết quả từng frame."""
+    ext = check_video_ext(file.filename)
+    inference_executor.check_capacity()
+    req_model = resolve_requested_model(request)
+    path = await run_in_threadpool(spool_to_tempfile, file.file, ext)
+    return _video_response(path, req_model, stride, max_frames, format, track)
+
+
+@router.post("/video/gcs")
+async def predict_video_gcs(
+    request: Request,
+    source: str = Form(..., description="gs://bucket/videos/api/clip.mp4"),
+    stride: int = STRIDE_QUERY,
+    max_frames: int = MAX_FRAMES_QUERY,
+    format: str = FORMAT_QUERY,
+    track: dict = Depends(_track_opts),
+):
+    bucket, obj_path = parse_gcs_input(source)
+    ext = check_video_ext(obj_path)
+    inference_executor.check_capacity()
+    req_model = resolve_requested_model(request)
+
+    fd, path = tempfile.mkstemp(suffix=f".{ext}", prefix="video_")
+    os.close(fd)
+    try:
+        await run_in_threadpool(download_to_file, bucket, obj_path, path)
+    except Exception as e:
+        _unlink(path)
+        raise HTTPException(status_code=400, detail=f"Cannot read from GCS: {e}")
+    return _video_response(path, req_model, stride, max_frames, format, track)
+
+
+@router.get("/cache")
+def predict_cache_stats():
+    """Hit ratio và thời gian infer tiết kiệm được của result cache."""
+    return result_cache.stats()
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import uuid
+from time import monotonic, time
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from loguru import logger
+from starlette.websockets import WebSocketDisconnect
+
+from app.config import (
+    STREAM_MAX_FRAME_BYTES,
+    STREAM_PERSIST,
+    TRACK_KEYFRAME_INTERVAL,
+)
+from app.services.camera import LatestFrame, StreamStats
+from app.services.executor import inference_executor, inference_slot, run_blocking
+from app.services.inference import (
+    infer_pil,
+    load_model,
+    resolve_requested_model,
+    save_prediction_payload,
+    to_columnar,
+)
+from app.services.intake import decode_image
+from app.services.tracking import KeyframeTracker
+
+router = APIRouter(prefix="/predict", tags=["stream"])
+
+
+def _process_frame(data: bytes, model_name: str, tracker: Optional[KeyframeTracker]):
+    """Decode + infer 1 frame (chạy trong executor). Trả (w, h, dets, keyframe|None)."""
+    img = decode_image(data)
+    if tracker is None:
+        _, _, _, dets, _ = infer_pil(img, model_name)
+        return img.orig_width, img.orig_height, dets, None
+    dets, keyframe = tracker.step(img.array, lambda: infer_pil(img, model_name)[3])
+    return img.orig_width, img.orig_height, dets, keyframe
+
+
+@router.websocket("/stream")
+async def predict_stream(
+    ws: WebSocket,
+    mode: str = Query("detect", enum=["detect", "track"]),
+    keyframe_interval: int = Query(TRACK_KEYFRAME_INTERVAL, ge=1),
+    format: str = Query("rows", enum=["rows", "columnar"]),
+    persist: bool = Query(STREAM_PERSIST, description="Lưu result.json từng frame (mặc định tắt)"),
+):
+    """
+    Camera realtime: client gửi liên tục frame đã encode (JPEG/PNG, message binary), server trả 1 message JSON
+    cho mỗi frame đã infer. Infer chậm hơn camera thì frame cũ bị bỏ, luôn xử lý frame mới nhất.
+    Gửi text {"type": "stats"} để lấy số liệu của kết nối.
+    """
+    await ws.accept()
+    conn_id = uuid.uuid4().hex[:12]
+    try:
+        model_name = await run_blocking(load_model, resolve_requested_model(ws))
+    except Exception as e:
+        await ws.send_json({"type": "error", "error": f"Cannot load model: {e}"})
+        await ws.close(code=1011)
+        return
+
+    tracker = KeyframeTracker(interval=keyframe_interval) if mode == "track" else None
+    stats = StreamStats(conn_id, model_name, mode)
+    latest = LatestFrame()
+    send_lock = asyncio.Lock()
+
+    async def send(obj: dict) -> None:
+        async with send_lock:
+            await ws.send_text(json.dumps(obj, ensure_ascii=False, separators=(",", ":")))
+
+    async def receive() -> None:
+        seq = 0
+        try:
+            while True:
+                msg = await ws.receive()
+                if msg["type"] == "websocket.disconnect":
+                    break
+                data = msg.get("bytes")
+                if data is not None:
+                    stats.receive()
+                    if len(data) > STREAM_MAX_FRAME_BYTES:
+                        stats.errors += 1
+                        await send({"type": "error", "seq": seq, "error": f"Frame exceeds {STREAM_MAX_FRAME_BYTES} bytes"})
+                    elif latest.put((seq, monotonic(), data)):
+                        stats.drop("stale")
+                    seq += 1
+                elif msg.get("text"):
+                    try:
+                        cmd = json.loads(msg["text"])
+                    except ValueError:
+                        cmd = {}
+                    if cmd.get("type") == "stats":
+                        await send({"type": "stats", **stats.to_dict()})
+        finally:
+            latest.close()
+
+    async def process() -> None:
+        while (item := await latest.get()) is not None:
+            seq, received_at, data = item
+            if inference_executor.saturated():
+                stats.drop("busy")
+                continue
+            try:
+                async with inference_slot():
+                    w, h, dets, keyframe = await run_blocking(_process_frame, data, model_name, tracker)
+            except HTTPException as e:
+                if e.status_code == inference_executor.reject_status:
+                    stats.drop("busy")
+                    continue
+                stats.errors += 1
+                await send({"type": "error", "seq": seq, "error": e.detail})
+                continue
+            except Exception as e:
+                logger.warning(f"Camera stream {conn_id}: frame {seq} failed: {e}")
+                stats.errors += 1
+                await send({"type": "error", "seq": seq, "error": str(e)})
+                continue
+
+            payload = {"image": {"width": w, "height": h}, "detections": dets}
+            if persist:
+                # I/O lưu kết quả chạy ngoài event loop (không chiếm worker infer), như các route HTTP
+                await run_in_threadpool(
+                    save_prediction_payload, f"stream_{conn_id}_{seq:06d}", int(time() * 1000), payload, None, model_name
+                )
+            latency = monotonic() - received_at
+            stats.done(latency)
+            out = {
+                "type": "frame",
+                "seq": seq,
+                **payload,
+                "latency_ms": round(latency * 1000, 2),
+                "dropped": stats.dropped_total,
+            }
+            if format == "columnar":
+                out["detections"] = to_columnar(dets)
+            if keyframe is not None:
+                out["keyframe"] = keyframe
+            await send(out)
+
+    await send({"type": "ready", "id": conn_id, "model": model_name, "mode": mode})
+    receiver = asyncio.ensure_future(receive())
+    try:
+        await process()
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # client ngắt trong lúc gửi
+    finally:
+        receiver.cancel()
+        stats.close()
@@ -9,6 +9,7 @@ class ModelInfo(BaseModel):
     name: Optional[str]
     path: str
     device: str
+    backend: str = "torch"
     conf: float
     iou: float
     img_size: int
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import List, Optional
+from typing import List, Optional, Union
 
 from pydantic import BaseModel, Field, HttpUrl
 
@@ -10,11 +10,27 @@ class UrlPredictIn(BaseModel):
     annotated: bool = True
 
 
+class UrlsPredictIn(BaseModel):
+    urls: List[str] = Field(..., min_length=1, description="Image URLs", examples=[["https://example.com/a.jpg"]])
+    annotated: bool = False
+
+
 class GCSPredictIn(BaseModel):
     source: str = Field(..., description="gs://... or GCS URL", examples=["gs://bucket/path/to/img.jpg"])
     annotated: bool = True
 
 
+class BulkGcsIn(BaseModel):
+    source: str = Field(..., description="gs://bucket/prefix/", examples=["gs://bucket/images/api/"])
+    limit: int = Field(0, ge=0, description="Chỉ xử lý tối đa N object chưa có kết quả (0 = tất cả)")
+    overwrite: bool = False
+    download_workers: Optional[int] = Field(None, ge=1)
+    decode_workers: Optional[int] = Field(None, ge=1)
+    upload_workers: Optional[int] = Field(None, ge=1)
+    batch_size: Optional[int] = Field(None, ge=1)
+    prefetch: Optional[int] = Field(None, ge=1)
+
+
 class Detection(BaseModel):
     class_id: int
     class_name: str
@@ -22,6 +38,14 @@ class Detection(BaseModel):
     bbox_xyxy: List[float]
 
 
+class ColumnarDetections(BaseModel):
+    """format=columnar: các mảng song song, phần tử thứ i là detection thứ i."""
+    boxes: List[List[float]] = []
+    scores: List[float] = []
+    class_ids: List[int] = []
+    class_names: List[str] = []
+
+
 class ImageInfo(BaseModel):
     width: int
     height: int
@@ -36,7 +60,7 @@ class PredictOut(BaseModel):
     model: Optional[dict] = None
     image: Optional[ImageInfo] = None
     inference: Optional[InferenceInfo] = None
-    detections: List[Detection] = []
+    detections: Union[List[Detection], ColumnarDetections] = []
     web_path: Optional[str] = None
     gcs: Optional[dict] = None
     result_json: Optional[dict] = None
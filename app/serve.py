@@ -0,0 +1,174 @@
+"""
+Pre-fork server: `python -m app.serve --workers 3`
+
+Khác với `uvicorn --workers N` (mỗi worker tự import + load model riêng), master ở đây:
+  1. load + warmup mọi model PRELOAD_MODELS 1 lần (1 thread torch, để không có thread pool OpenMP trước fork)
+  2. gc.freeze() để GC của worker không ghi vào object header của master (giữ trang copy-on-write)
+  3. fork N worker dùng chung socket; weights chỉ đọc khi infer nên các trang tensor dùng chung giữa mọi worker
+  4. giám sát worker: chết thì fork lại (model vẫn nằm sẵn trong master), SIGTERM/SIGINT thì tắt hết
+Mỗi worker tự giới hạn thread torch theo CPU quota / số worker (app.services.threads) ở startup hook.
+Gửi SIGUSR1 cho master để log bảng bộ nhớ (Rss/Pss/private) theo worker.
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+from typing import Dict, Optional
+
+import uvicorn
+from loguru import logger
+
+from app.config import (
+    PREFORK_MAX_RESPAWNS,
+    PREFORK_REPORT_AFTER,
+    PRELOAD_MODELS,
+    PROM_PORT,
+    SERVE_HOST,
+    SERVE_PORT,
+    WEB_WORKERS,
+)
+from app.main import _setup_prom_client_metrics, _start_prom_server, app
+from app.services.memory import memory_report
+from app.services.threads import thread_tuner
+from app.services.warmup import preload_and_warmup, readiness
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _format_report(report: dict) -> str:
+    mb = lambda b: f"{b / 2**20:8.1f}"  # noqa: E731
+    lines = [f"{'process':<10} {'pid':>7} {'rss MB':>8} {'pss MB':>8} {'shared':>8} {'private':>8}"]
+    for label, p in report["processes"].items():
+        shared = p["Shared_Clean"] + p["Shared_Dirty"]
+        private = p["Private_Clean"] + p["Private_Dirty"]
+        lines.append(f"{label:<10} {p['pid']:>7} {mb(p['Rss'])} {mb(p['Pss'])} {mb(shared)} {mb(private)}")
+    lines.append(
+        f"sum rss {report['sum_rss_bytes'] / 2**20:.1f} MB (≈ workers không chia sẻ), "
+        f"sum pss {report['sum_pss_bytes'] / 2**20:.1f} MB (thật), saved {report['saved_bytes'] / 2**20:.1f} MB"
+    )
+    return "\n".join(lines)
+
+
+class PreforkMaster:
+    def __init__(self, workers: int, host: str = SERVE_HOST, port: int = SERVE_PORT, metrics_port: Optional[int] = None):
+        self.workers = max(1, workers)
+        self.host, self.port = host, port
+        self.metrics_port = metrics_port
+        self.children: Dict[int, int] = {}  # pid -> worker index
+        self.respawns = 0
+        self.stopping = False
+        self.sock: Optional[socket.socket] = None
+
+    # ----- master -----
+    def preload(self) -> None:
+        """Load + warmup ở master. Thread budget chia theo số worker, áp dụng lại trong từng worker."""
+        import torch
+
+        thread_tuner.workers = self.workers
+        thread_tuner.apply_budget()  # inter-op chỉ set được 1 lần -> set ở master, worker kế thừa
+        torch.set_num_threads(1)
+        if not preload_and_warmup(tune_threads=False):
+            raise SystemExit(f"Preload failed: {readiness.error}")
+
+    def report(self) -> dict:
+        pids = {"master": os.getpid(), **{f"worker-{i}": pid for pid, i in sorted(self.children.items(), key=lambda x: x[1])}}
+        return memory_report(pids)
+
+    def run(self) -> int:
+        self.preload()
+        self.sock = _bind(self.host, self.port)
+        gc.collect()
+        gc.freeze()  # object của master chuyển sang permanent generation, GC worker không quét (không ghi) nữa
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGUSR1, lambda *_: logger.info("Memory per process:\n" + _format_report(self.report())))
+        signal.signal(signal.SIGALRM, lambda *_: logger.info("Memory per process:\n" + _format_report(self.report())))
+
+        for i in range(self.workers):
+            self._spawn(i)
+        logger.info(f"Pre-fork master {os.getpid()} serving {self.host}:{self.port} with {self.workers} worker(s)")
+        if PREFORK_REPORT_AFTER > 0:
+            signal.setitimer(signal.ITIMER_REAL, PREFORK_REPORT_AFTER)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            logger.warning(f"Worker {index} (pid {pid}) exited with status {status}")
+            self.respawns += 1
+            if self.respawns > PREFORK_MAX_RESPAWNS:
+                logger.error("Too many worker restarts, shutting down")
+                self._on_stop()
+                continue
+            self._spawn(index)
+        self.sock.close()
+        return 0
+
+    def _on_stop(self, *_) -> None:
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._worker(index)
+                code = 0
+            except BaseException:
+                logger.exception(f"Worker {index} crashed")
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+
+    # ----- worker -----
+    def _worker(self, index: int) -> None:
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1, signal.SIGALRM):
+            signal.signal(sig, signal.SIG_DFL)
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+        if self.metrics_port:
+            _start_prom_server(self.metrics_port + index)  # registry Prometheus là riêng từng process
+            _setup_prom_client_metrics()
+
+        # startup hook: readiness đã ready (preload ở master) -> chỉ áp thread budget của worker
+        server = uvicorn.Server(uvicorn.Config(app, log_config=None, access_log=False))
+        server.run(sockets=[self.sock])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-fork inference server (weights dùng chung copy-on-write)")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--metrics-port", type=int, default=PROM_PORT, help="worker i dùng port + i; 0 = tắt")
+    args = parser.parse_args(argv)
+    if not PRELOAD_MODELS:
+        logger.warning("PRELOAD_MODELS is empty: workers will load models lazily and share nothing")
+    return PreforkMaster(args.workers, args.host, args.port, args.metrics_port or None).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
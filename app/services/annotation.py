@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import json
+from io import BytesIO
+from typing import List, Optional, Tuple
+from urllib.parse import urlencode
+from xml.sax.saxutils import escape
+
+import numpy as np
+from PIL import Image
+
+from app.config import ANNOTATION_FORMAT, ANNOTATION_QUALITY, ANNOTATION_MAX_SIZE
+
+RASTER_FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+VECTOR_FORMATS = {"svg": "image/svg+xml", "json": "application/json"}
+ANNOTATION_FORMATS = {**RASTER_FORMATS, **VECTOR_FORMATS}
+
+_PIL_FORMAT = {"png": "PNG", "jpeg": "JPEG", "webp": "WEBP"}
+_EXT = {"png": "png", "jpeg": "jpg", "webp": "webp", "svg": "svg", "json": "json"}
+
+
+def normalize_format(fmt: Optional[str]) -> str:
+    fmt = (fmt or ANNOTATION_FORMAT).lower()
+    fmt = "jpeg" if fmt == "jpg" else fmt
+    if fmt not in ANNOTATION_FORMATS:
+        raise ValueError(f"Unsupported annotation format '{fmt}'. Use one of {sorted(ANNOTATION_FORMATS)}")
+    return fmt
+
+
+def annotation_url(
+    base_dir: str,
+    fmt: Optional[str] = None,
+    quality: Optional[int] = None,
+    max_size: Optional[int] = None,
+) -> str:
+    """URL render ảnh annotate theo yêu cầu (lần fetch đầu mới vẽ)."""
+    params = {"fmt": normalize_format(fmt)}
+    if quality:
+        params["quality"] = int(quality)
+    if max_size:
+        params["max_size"] = int(max_size)
+    return f"/predict/annotated/{base_dir}?{urlencode(params)}"
+
+
+def cached_name(fmt: str, quality: int, max_size: int) -> str:
+    """Tên file cache của bản render (khác nhau theo format/quality/size)."""
+    q = quality if fmt in ("jpeg", "webp") else 0
+    return f"annotated_{max_size}_{q}.{_EXT[fmt]}"
+
+
+def sniff_ext(data: bytes) -> str:
+    """Đuôi file theo nội dung (chỉ đọc header)."""
+    try:
+        fmt = (Image.open(BytesIO(data)).format or "").lower()
+    except Exception:
+        fmt = ""
+    return {"jpeg": "jpg", "": "bin"}.get(fmt, fmt)
+
+
+def detections_from_payload(payload: dict) -> List[dict]:
+    """Đọc detections từ result.json (row hoặc columnar)."""
+    dets = payload.get("detections") or []
+    if isinstance(dets, dict):
+        return [
+            {"class_id": c, "class_name": n, "confidence": s, "bbox_xyxy": b}
+            for b, s, c, n in zip(dets["boxes"], dets["scores"], dets["class_ids"], dets["class_names"])
+        ]
+    return dets
+
+
+def draw_detections(im_bgr: np.ndarray, dets: List[dict], scale: float = 1.0) -> np.ndarray:
+    """Vẽ box + label lên ảnh BGR (cùng style với result.plot() của ultralytics)."""
+    from ultralytics.utils.plotting import Annotator, colors
+
+    annotator = Annotator(np.ascontiguousarray(im_bgr))
+    for d in dets:
+        box = [v * scale for v in d["bbox_xyxy"]]
+        annotator.box_label(box, f"{d['class_name']} {d['confidence']:.2f}", color=colors(d["class_id"], True))
+    return annotator.result()
+
+
+def render_raster(source: bytes, dets: List[dict], fmt: str, quality: int, max_size: int) -> bytes:
+    img = Image.open(BytesIO(source))
+    orig_w, orig_h = img.size
+    if max_size and max(orig_w, orig_h) > max_size:
+        img.draft("RGB", (max_size, max_size))  # JPEG: decode thẳng ở độ phân giải thấp
+        img = img.convert("RGB")
+        img.thumbnail((max_size, max_size))
+    else:
+        img = img.convert("RGB")
+    scale = img.width / orig_w
+
+    im_bgr = np.asarray(img)[:, :, ::-1]
+    drawn = draw_detections(im_bgr, dets, scale)
+    out = Image.fromarray(np.ascontiguousarray(drawn[:, :, ::-1]))
+
+    buf = BytesIO()
+    if fmt == "png":
+        out.save(buf, format="PNG")
+    else:
+        out.save(buf, format=_PIL_FORMAT[fmt], quality=int(quality))
+    return buf.getvalue()
+
+
+def _overlay_shapes(dets: List[dict]) -> List[dict]:
+    from ultralytics.utils.plotting import colors
+
+    shapes = []
+    for d in dets:
+        r, g, b = colors(d["class_id"], False)
+        shapes.append(
+            {
+                "type": "rect",
+                "bbox_xyxy": d["bbox_xyxy"],
+                "label": f"{d['class_name']} {d['confidence']:.2f}",
+                "class_id": d["class_id"],
+                "color": f"#{int(r):02x}{int(g):02x}{int(b):02x}",
+            }
+        )
+    return shapes
+
+
+def render_vector(size: Tuple[int, int], dets: List[dict], fmt: str) -> bytes:
+    """Overlay dạng vector (SVG/JSON) để client tự vẽ lên ảnh gốc, server không raster gì."""
+    w, h = size
+    shapes = _overlay_shapes(dets)
+    if fmt == "json":
+        return json.dumps({"width": w, "height": h, "shapes": shapes}, ensure_ascii=False).encode("utf-8")
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {w} {h}">',
+    ]
+    for s in shapes:
+        x1, y1, x2, y2 = s["bbox_xyxy"]
+        parts.append(
+            f'<g><rect x="{x1:.1f}" y="{y1:.1f}" width="{x2 - x1:.1f}" height="{y2 - y1:.1f}" '
+            f'fill="none" stroke="{s["color"]}" stroke-width="2"/>'
+            f'<text x="{x1:.1f}" y="{max(y1 - 4, 10):.1f}" fill="{s["color"]}" '
+            f'font-family="sans-serif" font-size="14">{escape(s["label"])}</text></g>'
+        )
+    parts.append("</svg>")
+    return "".join(parts).encode("utf-8")
+
+
+def render_annotation(
+    payload: dict,
+    source: Optional[bytes],
+    fmt: str,
+    quality: int = ANNOTATION_QUALITY,
+    max_size: int = ANNOTATION_MAX_SIZE,
+) -> bytes:
+    dets = detections_from_payload(payload)
+    if fmt in VECTOR_FORMATS:
+        image = payload.get("image") or {}
+        return render_vector((int(image.get("width", 0)), int(image.get("height", 0))), dets, fmt)
+    if source is None:
+        raise FileNotFoundError("Source image is not stored for this result")
+    return render_raster(source, dets, fmt, quality, max_size)
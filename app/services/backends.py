@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict
+
+from loguru import logger
+
+from app.config import IMG_SIZE, INFERENCE_BACKEND, INT8_SUFFIX, MMAP_DIR, MODEL_BACKENDS, ONNX_OPSET, get_device
+from app.services.model_pool import estimate_model_bytes
+
+if TYPE_CHECKING:
+    from ultralytics import YOLO
+
+
+def _yolo(*args, **kwargs) -> YOLO:
+    # ultralytics (kéo theo torch) chỉ import khi load model thật, không phải lúc import app
+    from ultralytics import YOLO
+
+    return YOLO(*args, **kwargs)
+
+
+class InferenceBackend:
+    """
+    Cách load 1 checkpoint trong MODELS_DIR thành object có `.predict()` + `.names`
+    (YOLO của ultralytics), để `parse_result` dùng chung cho mọi backend.
+    """
+
+    name = "base"
+
+    def load(self, weights: Path) -> YOLO:
+        raise NotImplementedError
+
+
+class TorchBackend(InferenceBackend):
+    """PyTorch eager, load thẳng file .pt."""
+
+    name = "torch"
+
+    def load(self, weights: Path) -> YOLO:
+        model = _yolo(str(weights))
+        try:
+            model.to(get_device())
+        except Exception as e:
+            logger.warning(f"Could not move model to device {get_device()}: {e}")
+        return model
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """Lock liên tiến trình (nhiều worker/pod dùng chung MODELS_DIR)."""
+    with open(path, "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _source_record(artifact: Path) -> Path:
+    return artifact.with_name(artifact.name + ".source.json")
+
+
+def _write_source_record(artifact: Path, record: dict) -> None:
+    path = _source_record(artifact)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(record))
+    os.replace(tmp, path)
+
+
+def _artifact_stale(weights: Path, artifact: Path) -> bool:
+    """
+    Artifact convert từ `weights` còn dùng được không: so với sha256/size/mtime của .pt ghi lúc convert.
+    Không so mtime "mới hơn" vì rollback, `cp -p`, `rsync -a` có thể đưa về .pt khác nhưng mtime cũ hơn artifact.
+    (size, mtime) khớp -> không cần hash lại; lệch -> hash nội dung mới quyết định (touch không làm export lại).
+    """
+    record = _source_record(artifact)
+    if not artifact.exists() or not record.exists():
+        return True
+    try:
+        saved = json.loads(record.read_text())
+    except (OSError, ValueError):
+        return True
+    st = weights.stat()
+    if (saved.get("size"), saved.get("mtime_ns")) == (st.st_size, st.st_mtime_ns):
+        return False
+    if saved.get("size") != st.st_size or saved.get("sha256") != _sha256(weights):
+        return True
+    _write_source_record(artifact, {**saved, "mtime_ns": st.st_mtime_ns})  # cùng nội dung, chỉ đổi mtime
+    return False
+
+
+def _stamp_source(weights: Path) -> dict:
+    """Ghi nhận .pt ngay trước khi convert (file đổi trong lúc convert -> lần sau thấy lệch, convert lại)."""
+    st = weights.stat()
+    return {"source": weights.name, "sha256": _sha256(weights), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    ONNX Runtime (CPU). Export .pt -> .onnx 1 lần, cache ngay cạnh weights (<stem>.onnx),
+    export lại nếu nội dung .pt khác lúc export (<stem>.onnx.source.json). Batch/kích thước ảnh động để vẫn gom batch được.
+    """
+
+    name = "onnx"
+
+    def artifact_path(self, weights: Path) -> Path:
+        return weights.with_suffix(".onnx")
+
+    def is_stale(self, weights: Path) -> bool:
+        return _artifact_stale(weights, self.artifact_path(weights))
+
+    def export(self, weights: Path) -> Path:
+        onnx_path = self.artifact_path(weights)
+        with _file_lock(weights.with_suffix(".onnx.lock")):
+            if not self.is_stale(weights):
+                return onnx_path
+            logger.info(f"Exporting {weights.name} -> ONNX (imgsz={IMG_SIZE}, opset={ONNX_OPSET or 'auto'})")
+            source = _stamp_source(weights)
+            exported = _yolo(str(weights)).export(
+                format="onnx",
+                imgsz=IMG_SIZE,
+                dynamic=True,
+                simplify=True,
+                opset=ONNX_OPSET or None,
+                device="cpu",
+            )
+            exported = Path(exported)
+            if exported.resolve() != onnx_path.resolve():
+                os.replace(exported, onnx_path)
+            _write_source_record(onnx_path, source)
+        return onnx_path
+
+    def load(self, weights: Path) -> YOLO:
+        if weights.suffix.lower() != ".onnx":
+            weights = self.export(weights)
+        return _yolo(str(weights), task="detect")
+
+    @staticmethod
+    def artifact_bytes(onnx_path: Path) -> int:
+        """Kích thước .onnx + weights tách riêng (.onnx.data) trên đĩa."""
+        return sum(p.stat().st_size for p in (onnx_path, onnx_path.with_name(onnx_path.name + ".data")) if p.exists())
+
+
+# torch.load đọc cờ mmap từ config global -> bật/tắt quanh từng lần load, không để lẫn với load khác
+_mmap_lock = threading.Lock()
+
+
+@contextmanager
+def _mmap_loads():
+    import torch.utils.serialization
+
+    cfg = torch.utils.serialization.config.load
+    with _mmap_lock:
+        prev, cfg.mmap = cfg.mmap, True
+        try:
+            yield
+        finally:
+            cfg.mmap = prev
+
+
+class MmapBackend(TorchBackend):
+    """
+    PyTorch eager, weights memory-mapped. Convert .pt 1 lần -> MMAP_DIR/<stem>.pt (fuse Conv+BN, fp32, bỏ
+    optimizer/EMA) để lúc load không phải copy/biến đổi tensor nào: torch.load(mmap=True) chỉ map file,
+    trang weights được đọc khi predict chạm tới và nằm trong page cache dùng chung giữa các process/pod trên node.
+    Convert lại nếu nội dung .pt khác lúc convert (MMAP_DIR/<stem>.pt.source.json).
+    """
+
+    name = "mmap"
+
+    def artifact_path(self, weights: Path) -> Path:
+        return MMAP_DIR / weights.name
+
+    def is_stale(self, weights: Path) -> bool:
+        return _artifact_stale(weights, self.artifact_path(weights))
+
+    def export(self, weights: Path) -> Path:
+        path = self.artifact_path(weights)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with _file_lock(path.with_suffix(".lock")):
+            if not self.is_stale(weights):
+                return path
+            import torch
+            from ultralytics.nn.tasks import torch_safe_load
+
+            logger.info(f"Converting {weights.name} -> {path} (fused fp32, mmap-able)")
+            source = _stamp_source(weights)
+            ckpt, _ = torch_safe_load(str(weights))
+            model = (ckpt.get("ema") or ckpt["model"]).float()
+            if hasattr(model, "fuse"):
+                with torch.no_grad():
+                    model = model.fuse(verbose=False)  # fuse lúc load sẽ tạo tensor mới (private) -> làm sẵn ở đây
+            model.eval()
+            out = {k: v for k, v in ckpt.items() if k not in ("model", "ema", "optimizer", "updates")}
+            tmp = path.with_suffix(".tmp")
+            torch.save({**out, "model": model}, tmp)
+            os.replace(tmp, path)
+            _write_source_record(path, source)
+        return path
+
+    def load(self, weights: Path) -> YOLO:
+        if weights.parent != MMAP_DIR:
+            weights = self.export(weights)
+        if get_device() != "cpu":
+            logger.warning(f"mmap backend on {get_device()}: weights are copied to the device, no page sharing")
+        with _mmap_loads():
+            return super().load(weights)
+
+
+BACKENDS: Dict[str, InferenceBackend] = {b.name: b for b in (TorchBackend(), OnnxBackend(), MmapBackend())}
+
+
+def model_bytes(model: Any) -> int:
+    """
+    Ước lượng bộ nhớ 1 model resident cho budget của ModelPool. Torch/mmap: params + buffers;
+    ONNX Runtime không có module torch (`model.model` là path .onnx) -> dùng kích thước artifact trên đĩa.
+    """
+    src = getattr(model, "model", None)
+    if isinstance(src, (str, Path)) and str(src).lower().endswith(".onnx"):
+        return OnnxBackend.artifact_bytes(Path(src))
+    return estimate_model_bytes(model)
+
+
+def backend_name_for(model_name: str) -> str:
+    """MODEL_BACKENDS (theo từng model) > INFERENCE_BACKEND (mặc định cho tất cả). Bản INT8 luôn chạy ONNX Runtime."""
+    if model_name.endswith(INT8_SUFFIX):
+        return "onnx"
+    name = MODEL_BACKENDS.get(model_name, INFERENCE_BACKEND)
+    if name not in BACKENDS:
+        logger.warning(f"Unknown inference backend '{name}' for '{model_name}', using torch")
+        return "torch"
+    return name
+
+
+def get_backend(model_name: str) -> InferenceBackend:
+    return BACKENDS[backend_name_for(model_name)]
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Any, Callable, List, Optional
+
+from loguru import logger
+from opentelemetry import metrics
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+batch_queue_depth = meter.create_up_down_counter(
+    name="inference_batch_queue_depth",
+    description="Number of images waiting for the batching scheduler",
+)
+batch_size_hist = meter.create_histogram(
+    name="inference_batch_size",
+    description="Number of images per batched predict call",
+)
+batch_wait_hist = meter.create_histogram(
+    name="inference_batch_wait_seconds",
+    description="Time an image waited in the batching queue",
+    unit="s",
+)
+
+
+@dataclass
+class _Pending:
+    item: Any
+    future: Future
+    key: Any = None
+    enqueued_at: float = field(default_factory=monotonic)
+
+
+class BatchScheduler:
+    """
+    Gom các request 1 ảnh đồng thời thành batch.
+    Worker thread lấy tối đa `max_batch_size` item, chờ thêm tối đa `max_wait_ms`
+    kể từ item đầu tiên, rồi gọi `run_batch(items)` đúng 1 lần; output thứ i trả về caller thứ i.
+    Item có `key` (vd tên model) chỉ được gom với item cùng key, khi đó gọi `run_batch(items, key)`.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        name: str = "inference-batcher",
+    ):
+        self._run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[Optional[_Pending]]" = queue.Queue()
+        self._deferred: "deque[_Pending]" = deque()  # khác key, chỉ worker thread đụng tới
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: Any, key: Any = None) -> Future:
+        """Đưa 1 item vào hàng đợi, trả Future của kết quả riêng item đó."""
+        self._ensure_started()
+        fut: Future = Future()
+        self._queue.put(_Pending(item, fut, key))
+        batch_queue_depth.add(1)
+        return fut
+
+    def qsize(self) -> int:
+        return self._queue.qsize() + len(self._deferred)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Dừng worker sau khi xử lý hết các item đã nhận."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self, first: _Pending) -> tuple[List[_Pending], bool]:
+        batch = [first]
+        # Ưu tiên item cùng key đã bị hoãn từ vòng trước
+        for p in list(self._deferred):
+            if len(batch) >= self.max_batch_size:
+                break
+            if p.key == first.key:
+                self._deferred.remove(p)
+                batch.append(p)
+
+        deadline = monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - monotonic()
+            try:
+                nxt = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if nxt is None:
+                return batch, True
+            if nxt.key != first.key:
+                self._deferred.append(nxt)
+                continue
+            batch.append(nxt)
+        return batch, False
+
+    def _loop(self) -> None:
+        stop = False
+        while True:
+            if self._deferred:
+                first = self._deferred.popleft()
+            elif stop:
+                return
+            else:
+                first = self._queue.get()
+                if first is None:
+                    return
+            batch, got_stop = self._collect(first)
+            stop = stop or got_stop
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[_Pending]) -> None:
+        now = monotonic()
+        batch_queue_depth.add(-len(batch))
+        for p in batch:
+            batch_wait_hist.record(now - p.enqueued_at)
+
+        live = [p for p in batch if p.future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        batch_size_hist.record(len(live))
+
+        try:
+            items = [p.item for p in live]
+            key = live[0].key
+            outputs = self._run_batch(items) if key is None else self._run_batch(items, key)
+            if len(outputs) != len(live):
+                raise RuntimeError(f"Batch returned {len(outputs)} outputs for {len(live)} inputs")
+        except BaseException as e:  # noqa: BLE001 - trả lỗi cho từng caller
+            logger.error(f"Batched predict failed ({len(live)} items): {e}")
+            for p in live:
+                p.future.set_exception(e)
+            return
+
+        for p, out in zip(live, outputs):
+            p.future.set_result(out)
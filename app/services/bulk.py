@@ -0,0 +1,465 @@
+"""
+Predict hàng loạt mọi ảnh dưới 1 prefix GCS.
+
+Pipeline nhiều tầng chạy chồng lên nhau, mỗi tầng có số worker riêng và nối với nhau bằng hàng đợi có giới hạn:
+  download (prefetch) -> decode -> infer (gom batch) -> upload result.json
+Kết quả ghi ở vị trí cố định theo object nên chạy lại sẽ bỏ qua object đã có kết quả (resume).
+
+CLI:
+  python -m app.services.bulk gs://bucket/images/api/ --model best --download-workers 32
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import queue
+import threading
+import uuid
+from dataclasses import dataclass, field
+from time import monotonic, time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import (
+    BULK_BATCH_SIZE,
+    BULK_DECODE_WORKERS,
+    BULK_DOWNLOAD_WORKERS,
+    BULK_JOB_TTL,
+    BULK_MAX_FINISHED_JOBS,
+    BULK_PREFETCH,
+    BULK_UPLOAD_RETRIES,
+    BULK_UPLOAD_WORKERS,
+    CONF,
+    get_device,
+    IMG_SIZE,
+    IOU,
+    STORAGE_BACKEND,
+)
+from app.services.executor import inference_executor
+from app.services.inference import current_model_path, infer_batch, load_model, record_metrics
+from app.services.intake import decode_image
+from app.services.result_cache import content_digest
+from app.services.storage import delete_local_result, list_result_files, save_results_many
+from app.services.tracing import setup_telemetry
+from app.utils import download_bytes, list_blob_names, parse_gcs_input
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+_DONE = object()  # sentinel giữa các tầng
+
+
+def bulk_item_dir(model_name: str, bucket: str, obj_path: str) -> str:
+    """Folder kết quả cố định theo object (khác make_item_dir: không có timestamp) để resume được."""
+    return f"{model_name}/bulk/{bucket}/{obj_path}"
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    done: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, seconds: float, n: int = 1, ok: bool = True) -> None:
+        with self._lock:
+            self.busy_seconds += seconds
+            if ok:
+                self.done += n
+            else:
+                self.failed += n
+
+    def to_dict(self, elapsed: float) -> dict:
+        return {
+            "workers": self.workers,
+            "done": self.done,
+            "failed": self.failed,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "per_second": round(self.done / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+class BulkJob:
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str,
+        model_name: Optional[str] = None,
+        download_workers: int = BULK_DOWNLOAD_WORKERS,
+        decode_workers: int = BULK_DECODE_WORKERS,
+        upload_workers: int = BULK_UPLOAD_WORKERS,
+        batch_size: int = BULK_BATCH_SIZE,
+        prefetch: int = BULK_PREFETCH,
+        limit: int = 0,
+        overwrite: bool = False,
+    ):
+        self.id = uuid.uuid4().hex[:12]
+        self.bucket = bucket
+        self.prefix = prefix
+        self.model_name = model_name
+        self.batch_size = max(1, int(batch_size))
+        self.prefetch = max(1, int(prefetch))
+        self.limit = max(0, int(limit))
+        self.overwrite = overwrite
+        self.status = "pending"  # pending|listing|running|done|failed|cancelled
+        self.error: Optional[str] = None
+        self.listed = 0
+        self.skipped = 0
+        self.total = 0
+        self.errors: List[dict] = []
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._t0: Optional[float] = None
+        self._t_end: Optional[float] = None
+        self._cancel = threading.Event()
+        self.finished = threading.Event()
+        self._index: Dict[str, int] = {}
+        self._listeners: List[Callable[[dict], None]] = []
+        self._listeners_lock = threading.Lock()
+        self.stages: Dict[str, StageStats] = {
+            "download": StageStats("download", max(1, int(download_workers))),
+            "decode": StageStats("decode", max(1, int(decode_workers))),
+            "infer": StageStats("infer", 1),
+            "upload": StageStats("upload", max(1, int(upload_workers))),
+        }
+
+    # ----- public API -----
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def subscribe(self, fn: Callable[[dict], None]) -> Callable[[], None]:
+        """
+        Nhận event ngay khi từng object xong ({"type": "item", "index", "object", "ok", ...}),
+        cuối job 1 event {"type": "summary", ...}. `fn` được gọi từ thread worker. Trả hàm huỷ đăng ký.
+        """
+        with self._listeners_lock:
+            if not self.finished.is_set():
+                self._listeners.append(fn)
+
+        def unsubscribe() -> None:
+            with self._listeners_lock:
+                if fn in self._listeners:
+                    self._listeners.remove(fn)
+
+        return unsubscribe
+
+    def status_dict(self) -> dict:
+        elapsed = self._elapsed()
+        uploaded = self.stages["upload"].done
+        return {
+            "id": self.id,
+            "status": self.status,
+            "source": f"gs://{self.bucket}/{self.prefix}",
+            "model": self.model_name,
+            "listed": self.listed,
+            "skipped": self.skipped,
+            "total": self.total,
+            "completed": uploaded,
+            "failed": sum(s.failed for s in self.stages.values()),
+            "elapsed_seconds": round(elapsed, 3),
+            "images_per_second": round(uploaded / elapsed, 2) if elapsed > 0 else 0.0,
+            "stages": {name: s.to_dict(elapsed) for name, s in self.stages.items()},
+            "errors": self.errors[-20:],
+            "error": self.error,
+        }
+
+    def run(self) -> dict:
+        """Chạy đồng bộ tới khi xong (thread nền của endpoint hoặc CLI)."""
+        self.started_at = time()
+        self._t0 = monotonic()
+        try:
+            self.model_name = load_model(self.model_name)
+            todo = self._plan()
+            self.status = "running"
+            self._run_pipeline(todo)
+            self.status = "cancelled" if self._cancel.is_set() else "done"
+        except Exception as e:
+            logger.exception(f"Bulk job {self.id} failed")
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self._t_end = monotonic()
+            self.finished_at = time()
+            summary = {"type": "summary", **self.status_dict()}
+            with self._listeners_lock:
+                listeners, self._listeners = self._listeners, []
+                self.finished.set()
+            self._emit(summary, listeners)
+        return self.status_dict()
+
+    # ----- internals -----
+    def _elapsed(self) -> float:
+        if self._t0 is None:
+            return 0.0
+        return (self._t_end or monotonic()) - self._t0
+
+    def _emit(self, event: dict, listeners: Optional[List[Callable[[dict], None]]] = None) -> None:
+        if listeners is None:
+            with self._listeners_lock:
+                listeners = list(self._listeners)
+        for fn in listeners:
+            try:
+                fn(event)
+            except Exception as e:
+                logger.debug(f"Bulk job {self.id} listener failed: {e}")
+
+    def _item_event(self, obj_path: str, ok: bool, **extra) -> dict:
+        return {"type": "item", "index": self._index.get(obj_path), "object": obj_path, "ok": ok, **extra}
+
+    def _result_rel(self, obj_path: str) -> str:
+        return f"{bulk_item_dir(self.model_name, self.bucket, obj_path)}/result.json"
+
+    def _plan(self) -> List[str]:
+        self.status = "listing"
+        names = list_blob_names(self.bucket, self.prefix, IMAGE_SUFFIXES)
+        self.listed = len(names)
+        if not self.overwrite:
+            # 1 lần list kết quả đã có dưới cùng folder prefix thay vì hỏi từng object
+            prefix_dir = self.prefix.rsplit("/", 1)[0] if "/" in self.prefix else ""
+            existing = list_result_files(bulk_item_dir(self.model_name, self.bucket, prefix_dir).rstrip("/"))
+            todo = [n for n in names if self._result_rel(n) not in existing]
+            self.skipped = len(names) - len(todo)
+        else:
+            todo = names
+        if self.limit:
+            todo = todo[: self.limit]
+        self.total = len(todo)
+        self._index = {n: i for i, n in enumerate(todo)}
+        logger.info(
+            f"Bulk job {self.id}: {self.listed} objects under gs://{self.bucket}/{self.prefix}, "
+            f"{self.skipped} already done, {self.total} to process"
+        )
+        return todo
+
+    def _fail(self, stage: str, obj_path: str, e: BaseException, seconds: float) -> None:
+        self.stages[stage].record(seconds, ok=False)
+        if len(self.errors) < 1000:
+            self.errors.append({"object": obj_path, "stage": stage, "error": str(e)})
+        self._emit(self._item_event(obj_path, False, stage=stage, error=str(e)))
+
+    def _run_pipeline(self, todo: List[str]) -> None:
+        q_names: "queue.Queue" = queue.Queue()
+        q_raw: "queue.Queue" = queue.Queue(maxsize=self.prefetch)
+        q_decoded: "queue.Queue" = queue.Queue(maxsize=self.batch_size * 2)
+        q_results: "queue.Queue" = queue.Queue(maxsize=self.batch_size * 2)
+        for n in todo:
+            q_names.put(n)
+
+        threads = (
+            self._spawn("download", q_names, q_raw, self._download)
+            + self._spawn("decode", q_raw, q_decoded, self._decode)
+            + [threading.Thread(target=self._infer_loop, args=(q_decoded, q_results), name="bulk-infer", daemon=True)]
+            + self._spawn("upload", q_results, None, self._upload)
+        )
+        for _ in range(self.stages["download"].workers):
+            q_names.put(_DONE)
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def _spawn(self, stage: str, q_in: queue.Queue, q_out: Optional[queue.Queue], fn: Callable) -> List[threading.Thread]:
+        """N worker cho 1 tầng; worker cuối cùng thoát thì đẩy sentinel cho tầng sau."""
+        stats = self.stages[stage]
+        remaining = [stats.workers]
+        lock = threading.Lock()
+        downstream = {"download": "decode", "decode": "infer", "upload": None}[stage]
+
+        def worker():
+            while True:
+                item = q_in.get()
+                if item is _DONE:
+                    break
+                if self._cancel.is_set():
+                    continue  # rút cạn hàng đợi, không xử lý tiếp
+                obj_path = item if isinstance(item, str) else item[0]
+                start = monotonic()
+                try:
+                    out = fn(item)
+                except Exception as e:
+                    self._fail(stage, obj_path, e, monotonic() - start)
+                    continue
+                stats.record(monotonic() - start)
+                if q_out is not None:
+                    q_out.put(out)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and q_out is not None:
+                for _ in range(self.stages[downstream].workers):
+                    q_out.put(_DONE)
+
+        return [threading.Thread(target=worker, name=f"bulk-{stage}-{i}", daemon=True) for i in range(stats.workers)]
+
+    def _download(self, obj_path: str) -> Tuple[str, bytes]:
+        return obj_path, download_bytes(self.bucket, obj_path)
+
+    def _decode(self, item: Tuple[str, bytes]) -> tuple:
+        obj_path, data = item
+        return obj_path, decode_image(data), content_digest(data)
+
+    def _infer_loop(self, q_in: queue.Queue, q_out: queue.Queue) -> None:
+        """1 thread: gom tối đa batch_size ảnh đã decode rồi predict 1 lần."""
+        stats = self.stages["infer"]
+        try:
+            self._infer_batches(q_in, q_out, stats)
+        finally:
+            for _ in range(self.stages["upload"].workers):
+                q_out.put(_DONE)
+
+    def _infer_batches(self, q_in: queue.Queue, q_out: queue.Queue, stats: StageStats) -> None:
+        finished = False
+        while not finished:
+            batch = []
+            item = q_in.get()
+            while True:
+                if item is _DONE:
+                    finished = True
+                    break
+                if not self._cancel.is_set():
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = q_in.get(timeout=0.02)
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+
+            # Mỗi batch đi qua inference_executor: chung worker + admission với /predict/*, được tính vào saturated
+            run = inference_executor.run_background
+            start = monotonic()
+            try:
+                outs = run(infer_batch, [b[1] for b in batch], self.model_name, [b[2] for b in batch])
+            except Exception:
+                # Cô lập ảnh lỗi: chạy lại từng ảnh
+                outs = []
+                for b in batch:
+                    try:
+                        outs.append(run(infer_batch, [b[1]], self.model_name, [b[2]])[0])
+                    except Exception as e:
+                        outs.append(e)
+            elapsed = monotonic() - start
+            for (obj_path, _, _), out in zip(batch, outs):
+                if isinstance(out, BaseException):
+                    self._fail("infer", obj_path, out, 0.0)
+                    continue
+                record_metrics("/predict/gcs/bulk", out[2], len(out[3]), self.model_name)
+                q_out.put((obj_path, out))
+            stats.record(elapsed, n=len(batch) - sum(isinstance(o, BaseException) for o in outs))
+
+    def _upload(self, item: tuple) -> None:
+        obj_path, (w, h, elapsed, dets, _) = item
+        payload = {
+            "source": {"bucket": self.bucket, "path": obj_path},
+            "model": {
+                "name": self.model_name,
+                "path": str(current_model_path(self.model_name)),
+                "device": get_device(),
+                "params": {"imgsz": IMG_SIZE, "conf": CONF, "iou": IOU},
+            },
+            "image": {"width": w, "height": h},
+            "inference": {"time_seconds": elapsed, "detections": len(dets)},
+            "detections": dets,
+        }
+        data = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+        rel = self._result_rel(obj_path)
+        for attempt in range(max(0, BULK_UPLOAD_RETRIES) + 1):
+            meta = save_results_many([(rel, data, "application/json")])[0]
+            # save_results_many chỉ log lỗi GCS -> tự kiểm tra, không thì object bị tính là xong
+            if STORAGE_BACKEND not in ("gcs", "both") or meta.get("gcs") is not None:
+                break
+            logger.warning(f"Bulk job {self.id}: GCS upload failed for {rel} (attempt {attempt + 1})")
+        else:
+            # Với `both`, result.json local còn lại sẽ làm lần chạy sau bỏ qua object này mãi
+            delete_local_result(rel)
+            raise RuntimeError(f"GCS upload failed for {rel}")
+        self._emit(self._item_event(obj_path, True, detections=len(dets), result=meta))
+
+
+# ===== Job registry (cho endpoint) =====
+bulk_jobs: Dict[str, BulkJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def parse_bulk_source(source: str) -> Tuple[str, str]:
+    """gs://bucket/prefix (prefix có thể rỗng) -> (bucket, prefix)."""
+    s = source.strip()
+    if s.startswith("gs://") and "/" not in s[5:]:
+        return s[5:], ""
+    return parse_gcs_input(s)
+
+
+def _prune_jobs_locked(now: float) -> None:
+    """Bỏ job đã kết thúc quá BULK_JOB_TTL giây, và job cũ nhất khi số job đã kết thúc vượt BULK_MAX_FINISHED_JOBS."""
+    ended = sorted((j for j in bulk_jobs.values() if j.finished_at is not None), key=lambda j: j.finished_at)
+    excess = len(ended) - max(0, BULK_MAX_FINISHED_JOBS)
+    for i, job in enumerate(ended):
+        if i < excess or now - job.finished_at > BULK_JOB_TTL:
+            del bulk_jobs[job.id]
+
+
+def start_bulk_job(job: BulkJob) -> BulkJob:
+    with _jobs_lock:
+        _prune_jobs_locked(time())
+        bulk_jobs[job.id] = job
+    threading.Thread(target=job.run, name=f"bulk-{job.id}", daemon=True).start()
+    return job
+
+
+def active_bulk_jobs() -> List[BulkJob]:
+    with _jobs_lock:
+        _prune_jobs_locked(time())
+        return [j for j in bulk_jobs.values() if j.status in ("pending", "listing", "running")]
+
+
+# ===== CLI =====
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk predict every image under a GCS prefix")
+    parser.add_argument("source", help="gs://bucket/prefix/")
+    parser.add_argument("--model", default=None, help="model name (default: DEFAULT_MODEL)")
+    parser.add_argument("--download-workers", type=int, default=BULK_DOWNLOAD_WORKERS)
+    parser.add_argument("--decode-workers", type=int, default=BULK_DECODE_WORKERS)
+    parser.add_argument("--upload-workers", type=int, default=BULK_UPLOAD_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument("--prefetch", type=int, default=BULK_PREFETCH)
+    parser.add_argument("--limit", type=int, default=0, help="process at most N pending objects")
+    parser.add_argument("--overwrite", action="store_true", help="re-run objects that already have results")
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+    setup_telemetry()
+
+    bucket, prefix = parse_bulk_source(args.source)
+    job = BulkJob(
+        bucket,
+        prefix,
+        model_name=args.model,
+        download_workers=args.download_workers,
+        decode_workers=args.decode_workers,
+        upload_workers=args.upload_workers,
+        batch_size=args.batch_size,
+        prefetch=args.prefetch,
+        limit=args.limit,
+        overwrite=args.overwrite,
+    )
+    runner = threading.Thread(target=job.run, daemon=True)
+    runner.start()
+    try:
+        while runner.is_alive():
+            runner.join(args.report_every)
+            st = job.status_dict()
+            rates = ", ".join(f"{k} {v['per_second']}/s" for k, v in st["stages"].items())
+            logger.info(f"[{st['status']}] {st['completed']}/{st['total']} done, {st['failed']} failed | {rates}")
+    except KeyboardInterrupt:
+        logger.warning("Cancelling, waiting for in-flight items...")
+        job.cancel()
+        runner.join()
+
+    print(json.dumps(job.status_dict(), indent=2))
+    return 0 if job.status == "done" else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
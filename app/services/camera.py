@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from time import monotonic
+from typing import Any, Optional
+
+from loguru import logger
+from opentelemetry import metrics
+
+from app.config import STREAM_LATENCY_WINDOW
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+stream_connections = meter.create_up_down_counter(
+    name="stream_connections_active",
+    description="Open WebSocket camera streams",
+)
+stream_frames = meter.create_counter(
+    name="stream_frames_received_total",
+    description="Frames received on WebSocket camera streams",
+)
+stream_dropped = meter.create_counter(
+    name="stream_frames_dropped_total",
+    description="Frames dropped on camera streams (stale: replaced by a newer frame, busy: no inference slot)",
+)
+stream_latency = meter.create_histogram(
+    name="stream_e2e_latency_seconds",
+    description="Time from receiving a frame to sending its detections",
+    unit="s",
+)
+
+
+class LatestFrame:
+    """
+    Ô chứa đúng 1 frame chờ xử lý: frame mới đè frame cũ chưa kịp infer (latest-frame-wins),
+    nên khi infer chậm hơn camera thì bỏ frame cũ thay vì xếp hàng và trễ dần.
+    """
+
+    def __init__(self):
+        self._item: Any = None
+        self._ready = asyncio.Event()
+        self.closed = False
+
+    def put(self, item: Any) -> bool:
+        """Đặt frame mới, trả True nếu đã đè 1 frame chưa xử lý."""
+        replaced = self._item is not None
+        self._item = item
+        self._ready.set()
+        return replaced
+
+    async def get(self) -> Optional[Any]:
+        """Chờ frame mới nhất; None khi đã đóng và không còn frame."""
+        while self._item is None:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        item, self._item = self._item, None
+        return item
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+
+class StreamStats:
+    """Số liệu theo từng kết nối, đồng thời đẩy ra metric OTel chung."""
+
+    def __init__(self, conn_id: str, model_name: str, mode: str):
+        self.conn_id = conn_id
+        self.attrs = {"model": model_name, "mode": mode}
+        self.started = monotonic()
+        self.received = 0
+        self.processed = 0
+        self.errors = 0
+        self.dropped = {"stale": 0, "busy": 0}
+        self._latencies: deque = deque(maxlen=max(1, STREAM_LATENCY_WINDOW))
+        stream_connections.add(1, self.attrs)
+
+    @property
+    def dropped_total(self) -> int:
+        return sum(self.dropped.values())
+
+    def receive(self) -> None:
+        self.received += 1
+        stream_frames.add(1, self.attrs)
+
+    def drop(self, reason: str) -> None:
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+        stream_dropped.add(1, {**self.attrs, "reason": reason})
+
+    def done(self, latency: float) -> None:
+        self.processed += 1
+        self._latencies.append(latency)
+        stream_latency.record(latency, self.attrs)
+
+    def to_dict(self) -> dict:
+        elapsed = monotonic() - self.started
+        lat = sorted(self._latencies)
+
+        def pct(q: float) -> float:
+            return round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 2) if lat else 0.0
+
+        return {
+            "id": self.conn_id,
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": dict(self.dropped),
+            "errors": self.errors,
+            "elapsed_seconds": round(elapsed, 3),
+            "processed_per_second": round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+            "latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)},
+        }
+
+    def close(self) -> dict:
+        stream_connections.add(-1, self.attrs)
+        summary = self.to_dict()
+        logger.info(f"Camera stream {self.conn_id} closed: {summary}")
+        return summary
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+from fastapi import HTTPException
+from opentelemetry import metrics
+
+from app.config import INFER_WORKERS, INFER_QUEUE_SIZE, INFER_REJECT_STATUS
+
+T = TypeVar("T")
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+inflight_counter = meter.create_up_down_counter(
+    name="inference_executor_inflight",
+    description="Requests admitted to the inference executor (running + queued)",
+)
+rejected_counter = meter.create_counter(
+    name="inference_executor_rejected_total",
+    description="Requests rejected because the inference queue was full",
+)
+
+
+class InferenceExecutor:
+    """
+    Thread pool riêng cho việc nặng CPU/blocking (PIL, torch, ghi kết quả).
+    Admission: tối đa `max_workers + max_queue` request cùng lúc, vượt quá thì trả 429/503 ngay.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, reject_status: int = 503):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.reject_status = reject_status
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._freed = threading.Condition(self._lock)
+        self._inflight = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def saturated(self) -> bool:
+        return self._inflight >= self.capacity
+
+    def _try_acquire(self) -> bool:
+        with self._lock:
+            if self._inflight >= self.capacity:
+                return False
+            self._inflight += 1
+        inflight_counter.add(1)
+        return True
+
+    def _release(self) -> None:
+        with self._freed:
+            self._inflight -= 1
+            self._freed.notify()
+        inflight_counter.add(-1)
+
+    def _reject(self) -> HTTPException:
+        rejected_counter.add(1)
+        return HTTPException(
+            status_code=self.reject_status,
+            detail="Inference queue is full, retry later.",
+            headers={"Retry-After": "1"},
+        )
+
+    def check_capacity(self) -> None:
+        """Từ chối sớm (trước khi bắt đầu stream response) nếu đã hết suất."""
+        if self.saturated():
+            raise self._reject()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Giữ 1 suất admission cho cả request; hết suất thì raise HTTPException."""
+        if not self._try_acquire():
+            raise self._reject()
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Chạy hàm blocking trong pool (giữ contextvars, vd span tracing)."""
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._pool, partial(ctx.run, fn, *args, **kwargs))
+
+    def run_background(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Cho thread nền không có event loop (bulk job): chờ tới khi có suất admission (không reject), chạy `fn`
+        trong pool và chặn tới khi xong. Suất này tính vào inflight/saturated như request HTTP.
+        """
+        with self._freed:
+            while self._inflight >= self.capacity:
+                self._freed.wait()
+            self._inflight += 1
+        inflight_counter.add(1)
+        try:
+            ctx = contextvars.copy_context()
+            return self._pool.submit(ctx.run, fn, *args, **kwargs).result()
+        finally:
+            self._release()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+inference_executor = InferenceExecutor(INFER_WORKERS, INFER_QUEUE_SIZE, INFER_REJECT_STATUS)
+
+
+def inference_slot():
+    return inference_executor.slot()
+
+
+async def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    return await inference_executor.run(fn, *args, **kwargs)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from fastapi import HTTPException
+from opentelemetry import metrics
+
+from app.config import (
+    URL_FETCH_MAX_BYTES,
+    URL_FETCH_TIMEOUT,
+    URL_FETCH_MAX_CONNECTIONS,
+    URL_FETCH_PER_HOST,
+)
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+fetch_hist = meter.create_histogram(
+    name="url_fetch_seconds",
+    description="Time to download an image URL",
+    unit="s",
+)
+fetch_bytes = meter.create_histogram(
+    name="url_fetch_bytes",
+    description="Size of downloaded image bodies",
+    unit="By",
+)
+fetch_rejected = meter.create_counter(
+    name="url_fetch_rejected_total",
+    description="URL downloads rejected (status, content type, size, timeout)",
+)
+
+# Một số server trả ảnh với type chung chung
+_GENERIC_TYPES = ("application/octet-stream", "binary/octet-stream", "")
+
+
+class UrlFetcher:
+    """
+    Tải ảnh từ URL bất đồng bộ (httpx), không chiếm thread:
+    - 1 connection pool dùng chung, tối đa `per_host` request song song tới cùng 1 host.
+    - Stream body, cắt ngay khi vượt `max_bytes` hoặc Content-Type không phải ảnh.
+    - `timeout` vừa là timeout từng thao tác của httpx vừa là hạn tổng cho cả lần tải (chặn server nhỏ giọt).
+    Client gắn với event loop nên được tạo lại nếu loop đổi (test, reload).
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 20 * 2**20,
+        timeout: float = 20.0,
+        max_connections: int = 64,
+        per_host: int = 8,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.max_bytes = max(1, int(max_bytes))
+        self.timeout = timeout
+        self.max_connections = max(1, int(max_connections))
+        self.per_host = max(1, int(per_host))
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._hosts: Dict[str, List] = {}  # host -> [semaphore, số request đang giữ/chờ], bỏ khi về 0
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                follow_redirects=True,
+                transport=self._transport,
+            )
+            self._loop = loop
+            self._hosts = {}
+        return self._client
+
+    @asynccontextmanager
+    async def _host_slot(self, host: str) -> AsyncIterator[None]:
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = [asyncio.Semaphore(self.per_host), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._hosts.get(host) is entry:
+                del self._hosts[host]  # không giữ semaphore cho mọi host từng gặp
+
+    def _reject(self, status: int, detail: str, reason: str) -> HTTPException:
+        fetch_rejected.add(1, {"reason": reason})
+        return HTTPException(status_code=status, detail=detail)
+
+    async def fetch(self, url: str) -> Tuple[bytes, str]:
+        """Trả (body, content_type). Lỗi -> HTTPException (400/413/415)."""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise self._reject(400, f"Unsupported URL: {url}", "scheme")
+
+        client = self._ensure_client()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            async with self._host_slot(parts.hostname):
+                buf, ctype = await asyncio.wait_for(self._download(client, url), self.timeout)
+        except (httpx.TimeoutException, asyncio.TimeoutError):
+            raise self._reject(400, "Download failed: timed out", "timeout")
+        except httpx.HTTPError as e:
+            raise self._reject(400, f"Download failed: {e}", "error")
+
+        fetch_hist.record(loop.time() - start)
+        fetch_bytes.record(len(buf))
+        return bytes(buf), ctype
+
+    async def _download(self, client: httpx.AsyncClient, url: str) -> Tuple[bytearray, str]:
+        async with client.stream("GET", url) as r:
+            if r.status_code != 200:
+                raise self._reject(400, f"Download failed: HTTP {r.status_code}", "status")
+
+            ctype = r.headers.get("content-type", "").split(";")[0].strip().lower()
+            if not ctype.startswith("image/") and ctype not in _GENERIC_TYPES:
+                raise self._reject(415, f"URL is not an image (Content-Type: {ctype})", "content_type")
+
+            length = r.headers.get("content-length")
+            if length and length.isdigit() and int(length) > self.max_bytes:
+                raise self._reject(413, f"Image exceeds {self.max_bytes} bytes", "size")
+
+            buf = bytearray()
+            async for chunk in r.aiter_bytes():
+                buf += chunk
+                if len(buf) > self.max_bytes:
+                    raise self._reject(413, f"Image exceeds {self.max_bytes} bytes", "size")
+        return buf, ctype
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+url_fetcher = UrlFetcher(
+    max_bytes=URL_FETCH_MAX_BYTES,
+    timeout=URL_FETCH_TIMEOUT,
+    max_connections=URL_FETCH_MAX_CONNECTIONS,
+    per_host=URL_FETCH_PER_HOST,
+)
@@ -3,48 +3,54 @@ from __future__ import annotations
 from io import BytesIO
 from pathlib import Path
 from time import time
-from typing import List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 from fastapi import HTTPException, Request
 from loguru import logger
 from PIL import Image, UnidentifiedImageError
-from ultralytics import YOLO
 
-from opentelemetry import metrics
-from opentelemetry.exporter.prometheus import PrometheusMetricReader
-from opentelemetry.metrics import set_meter_provider
-from opentelemetry.sdk.metrics import MeterProvider as SDKMeterProvider
-from opentelemetry.sdk.resources import Resource, SERVICE_NAME
+from opentelemetry import metrics, trace
 
 from app.config import (
-    AVAILABLE_MODELS,
     DEFAULT_MODEL_NAME,
     CONF,
     IOU,
     IMG_SIZE,
-    DEVICE,
-    SERVICE_NAME_STR,
+    INFER_RECT,
+    MODEL_STRIDE,
+    get_device,
+    BATCH_MAX_SIZE,
+    BATCH_MAX_WAIT_MS,
+    MODEL_POOL_MAX_MODELS,
+    MODEL_POOL_MEM_MB,
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_DISK,
+    RESULT_CACHE_DISK_MAX_ENTRIES,
 )
-from app.services.storage import save_result_bytes, make_item_dir
+from app.services.annotation import draw_detections, sniff_ext
+from app.services.backends import backend_name_for, get_backend, model_bytes
+from app.services.batching import BatchScheduler
+from app.services.intake import DecodedImage, to_decoded
+from app.services.model_pool import ModelPool
+from app.services.result_cache import ResultCache
+from app.services.persistence import PendingWrite, persist_queue
+from app.services.registry import model_registry
+from app.services.storage import make_item_dir
+
+if TYPE_CHECKING:
+    from ultralytics import YOLO
 
 # ===== Runtime model state =====
-_loaded_model: Optional[YOLO] = None
+# Model "active" mặc định cho request không chỉ định model (đổi qua /model/select)
 _loaded_model_name: Optional[str] = None
-_class_names: List[str] = []
 
 # ===== Tracing =====
-from app.services.tracing import setup_tracing
-tracer = setup_tracing()
+# Provider thật được gắn ở startup (app.services.tracing.setup_telemetry), tracer proxy tự chuyển theo
+tracer = trace.get_tracer("inference", "0.1.0")
 
 # ===== Metrics (OTel) =====
-otel_resource = Resource(attributes={SERVICE_NAME: SERVICE_NAME_STR})
-reader = PrometheusMetricReader()
-current_mp = metrics.get_meter_provider()
-if not isinstance(current_mp, SDKMeterProvider):
-    provider_metrics = SDKMeterProvider(resource=otel_resource, metric_readers=[reader])
-    set_meter_provider(provider_metrics)
-
 meter = metrics.get_meter("inference", "0.1.0")
 inference_counter = meter.create_counter(
     name="inference_requests_total",
@@ -55,6 +61,10 @@ inference_hist = meter.create_histogram(
     description="Latency for inference",
     unit="s",
 )
+input_pixels_hist = meter.create_histogram(
+    name="inference_input_pixels",
+    description="Pixels of the model input tensor per image (including letterbox padding)",
+)
 
 # ===== Optional Prometheus client metrics (plain) =====
 _det_gauge = None
@@ -81,67 +91,132 @@ def resolve_requested_model(request: Optional[Request]) -> Optional[str]:
     return None
 
 
-def load_model(name: Optional[str] = None) -> None:
-    """Lazy-load/hot-swap YOLO model."""
-    global _loaded_model, _loaded_model_name, _class_names
+def _load_weights(name: str) -> YOLO:
+    model_path = model_registry.path(name)
+    if not model_path.exists():
+        raise RuntimeError(f"Model file not found at {model_path}")
+
+    backend = get_backend(name)
+    logger.info(f"Loading model: {model_path} (backend={backend.name}, device={get_device()})")
+    model = backend.load(model_path)
+    logger.info(f"Model loaded: '{name}' → {model_path}. Classes: {getattr(model, 'names', None) or 'unknown'}")
+    return model
+
 
+# ===== Model pool (nhiều model resident, LRU + refcount) =====
+model_pool = ModelPool(
+    _load_weights,
+    max_models=MODEL_POOL_MAX_MODELS,
+    mem_budget_bytes=int(MODEL_POOL_MEM_MB * 2**20),
+    sizeof=model_bytes,
+    version_of=model_registry.version,
+)
+
+
+def resolve_model_name(name: Optional[str] = None) -> str:
+    """Tên model cho request: name > model active > DEFAULT_MODEL_NAME."""
     req_name = name or _loaded_model_name or DEFAULT_MODEL_NAME
-    if req_name not in AVAILABLE_MODELS:
+    if req_name not in model_registry:
         raise HTTPException(
             status_code=400,
-            detail=f"Unknown model '{req_name}'. Available: {list(AVAILABLE_MODELS.keys())}",
+            detail=f"Unknown model '{req_name}'. Available: {model_registry.names()}",
         )
+    return req_name
 
-    if _loaded_model is not None and _loaded_model_name == req_name:
-        return
 
-    model_path = AVAILABLE_MODELS[req_name]
-    if not model_path.exists():
-        raise RuntimeError(f"Model file not found at {model_path}")
+def load_model(name: Optional[str] = None) -> str:
+    """Đảm bảo model đã nằm trong pool (load nếu chưa), trả tên model đã resolve."""
+    req_name = resolve_model_name(name)
+    model_pool.get(req_name)
+    return req_name
 
-    logger.info(f"Loading model: {model_path} (device={DEVICE})")
-    model = YOLO(str(model_path))
-    try:
-        model.to(DEVICE)
-    except Exception as e:
-        logger.warning(f"Could not move model to device {DEVICE}: {e}")
 
-    _loaded_model = model
+def select_model(name: str) -> str:
+    """Đổi model active mặc định; request đang chạy vẫn giữ model của nó."""
+    global _loaded_model_name
+    req_name = load_model(name)
     _loaded_model_name = req_name
-    _class_names = getattr(model, "names", [])
-    logger.info(f"Model loaded: '{req_name}' → {model_path}. Classes: {_class_names or 'unknown'}")
-
-
-def current_model_path() -> Path:
-    name = _loaded_model_name or DEFAULT_MODEL_NAME
-    return AVAILABLE_MODELS[name]
-
-
-def parse_result(result) -> List[dict]:
+    return req_name
+
+
+def class_names(name: Optional[str] = None) -> List[str]:
+    names = model_pool.get(resolve_model_name(name)).class_names
+    return list(names.values()) if isinstance(names, dict) else list(names)
+
+
+def current_model_path(name: Optional[str] = None) -> Path:
+    return model_registry.path(name or _loaded_model_name or DEFAULT_MODEL_NAME)
+
+
+# Bảng tên class dạng numpy theo từng dict `names` của model (tra vectorized)
+_name_tables: Dict[int, tuple] = {}
+
+
+def _name_table(names) -> np.ndarray:
+    if not names:
+        return np.empty(0, dtype=object)
+    cached = _name_tables.get(id(names))
+    if cached is not None and cached[0] is names:
+        return cached[1]
+    if isinstance(names, dict):
+        size = max(names) + 1 if names else 0
+        table = np.array([str(names.get(i, i)) for i in range(size)], dtype=object)
+    else:
+        table = np.array([str(n) for n in names], dtype=object)
+    _name_tables[id(names)] = (names, table)
+    return table
+
+
+def parse_result_columnar(result, scale: Tuple[float, float] = (1.0, 1.0)) -> dict:
+    """
+    Ultralytics result -> mảng song song {boxes, scores, class_ids, class_names}.
+    `scale` (sx, sy) map bbox từ ảnh đưa vào model (có thể đã thu nhỏ lúc decode) về ảnh gốc.
+    """
+    cols = {"boxes": [], "scores": [], "class_ids": [], "class_names": []}
+    boxes = getattr(result, "boxes", None)
+    if boxes is None or len(boxes) == 0:
+        return cols
+
+    # 1 lần copy về CPU: [x1, y1, x2, y2, (track_id), conf, cls]
+    data = boxes.data.cpu().numpy()
+    cls = data[:, -1].astype(np.int64)
+    table = _name_table(getattr(result, "names", None))
+    known = (cls >= 0) & (cls < len(table))
+    if known.all():
+        names = table[cls]
+    else:
+        names = np.array([table[c] if k else str(c) for c, k in zip(cls.tolist(), known.tolist())], dtype=object)
+
+    boxes_xyxy = data[:, :4]
+    if scale != (1.0, 1.0):
+        boxes_xyxy = boxes_xyxy * np.array([scale[0], scale[1], scale[0], scale[1]], dtype=boxes_xyxy.dtype)
+    cols["boxes"] = boxes_xyxy.tolist()
+    cols["scores"] = data[:, -2].tolist()
+    cols["class_ids"] = cls.tolist()
+    cols["class_names"] = names.tolist()
+    return cols
+
+
+def to_columnar(dets: List[dict]) -> dict:
+    """list[dict] (row) -> mảng song song, dùng cho format=columnar. Có thêm `track_ids` khi detection mang track_id."""
+    cols = {
+        "boxes": [d["bbox_xyxy"] for d in dets],
+        "scores": [d["confidence"] for d in dets],
+        "class_ids": [d["class_id"] for d in dets],
+        "class_names": [d["class_name"] for d in dets],
+    }
+    if any("track_id" in d for d in dets):
+        cols["track_ids"] = [d.get("track_id") for d in dets]
+    return cols
+
+
+def parse_result(result, scale: Tuple[float, float] = (1.0, 1.0)) -> List[dict]:
     """Ultralytics result -> list[dict]."""
-    dets: List[dict] = []
-    if getattr(result, "boxes", None) is None:
-        return dets
-
-    boxes_xyxy = result.boxes.xyxy.cpu().numpy()
-    confs = result.boxes.conf.cpu().numpy()
-    clss = result.boxes.cls.cpu().numpy()
-
-    for i in range(len(confs)):
-        cls_id = int(clss[i])
-        dets.append(
-            {
-                "class_id": cls_id,
-                "class_name": (
-                    _class_names[cls_id]
-                    if _class_names and 0 <= cls_id < len(_class_names)
-                    else str(cls_id)
-                ),
-                "confidence": float(confs[i]),
-                "bbox_xyxy": [float(x) for x in boxes_xyxy[i].tolist()],
-            }
-        )
-    return dets
+    cols = parse_result_columnar(result, scale)
+    return [
+        {"class_id": c, "class_name": n, "confidence": s, "bbox_xyxy": b}
+        for b, s, c, n in zip(cols["boxes"], cols["scores"], cols["class_ids"], cols["class_names"])
+    ]
 
 
 def annotate_image(result) -> bytes:
@@ -155,27 +230,183 @@ def annotate_image(result) -> bytes:
     return buf.read()
 
 
-def infer_pil(pil_img: Image.Image):
-    """Infer 1 ảnh PIL, trả (w, h, elapsed, dets, res0)."""
-    with tracer.start_as_current_span("infer_image"):
-        start = time()
-        results = _loaded_model.predict(
-            pil_img,
-            imgsz=IMG_SIZE,
-            conf=CONF,
-            iou=IOU,
-            device=DEVICE if DEVICE == "cuda" else None,
-            verbose=False,
-        )
-        elapsed = time() - start
-        res0 = results[0]
-        w, h = res0.orig_shape[1], res0.orig_shape[0]
-        dets = parse_result(res0)
-        return w, h, elapsed, dets, res0
+ModelInput = Union[Image.Image, DecodedImage]
+
+
+def rect_shape(width: int, height: int, imgsz: int = IMG_SIZE, stride: int = MODEL_STRIDE) -> Tuple[int, int]:
+    """(h, w) giữ tỉ lệ ảnh: cạnh dài = imgsz, mỗi cạnh làm tròn lên bội số stride (vd 1622x626 -> 256x640)."""
+    stride = max(1, int(stride))
+    side = -(-imgsz // stride) * stride
+    r = imgsz / max(width, height, 1)
+    h = min(side, max(stride, -(-round(height * r) // stride) * stride))
+    w = min(side, max(stride, -(-round(width * r) // stride) * stride))
+    return h, w
+
+
+def input_shape(image: DecodedImage) -> Tuple[int, int]:
+    """(h, w) của tensor đưa vào model cho 1 ảnh; ảnh cùng shape mới được gom chung 1 batch."""
+    if not INFER_RECT:
+        return IMG_SIZE, IMG_SIZE
+    h, w = image.array.shape[:2]
+    return rect_shape(w, h)
+
+
+def run_model(model: YOLO, arrays: List[np.ndarray], shape: Tuple[int, int]) -> list:
+    """1 lần predict thô trên 1 model object, mọi ảnh cùng input shape (h, w)."""
+    return model.predict(
+        arrays,
+        imgsz=IMG_SIZE if shape == (IMG_SIZE, IMG_SIZE) else list(shape),
+        conf=CONF,
+        iou=IOU,
+        device="cuda" if get_device() == "cuda" else None,
+        verbose=False,
+    )
+
+
+def _predict_batch(images: Sequence[ModelInput], model_name: Optional[str] = None) -> List[tuple]:
+    """
+    1 lần predict cho mỗi nhóm ảnh cùng input shape, trả list (w, h, elapsed, dets, res0) theo thứ tự `images`.
+    w, h và bbox trong dets luôn theo ảnh gốc; res0 là kết quả trên ảnh đã decode.
+    """
+    if not images:
+        return []
+    name = resolve_model_name(model_name)
+    decoded = [to_decoded(im) for im in images]
+    groups: Dict[Tuple[int, int], List[int]] = {}
+    for i, d in enumerate(decoded):
+        groups.setdefault(input_shape(d), []).append(i)
+
+    out: List[Optional[tuple]] = [None] * len(decoded)
+    with model_pool.acquire(name) as entry, entry.lock:
+        for shape, idx in groups.items():
+            with tracer.start_as_current_span("infer_batch") as span:
+                span.set_attribute("batch.size", len(idx))
+                span.set_attribute("model", name)
+                span.set_attribute("input.shape", f"{shape[0]}x{shape[1]}")
+                start = time()
+                results = run_model(entry.model, [decoded[i].array for i in idx], shape)
+                elapsed = time() - start
+            input_pixels_hist.record(shape[0] * shape[1], {"model": name})
+            for i, res in zip(idx, results):
+                w, h = decoded[i].size
+                out[i] = (w, h, elapsed, parse_result(res, decoded[i].scale), res)
+    return out
+
+
+# ===== Batching scheduler (gom theo từng model) =====
+_batcher: Optional[BatchScheduler] = (
+    # key = (model, input shape): chỉ gom ảnh cùng model và cùng shape
+    BatchScheduler(
+        lambda images, key: _predict_batch(images, key[0]),
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+    )
+    if BATCH_MAX_SIZE > 1
+    else None
+)
+
+
+# ===== Result cache =====
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    disk_dir=RESULT_CACHE_DIR if RESULT_CACHE_DISK else None,
+    disk_max_entries=RESULT_CACHE_DISK_MAX_ENTRIES,
+)
+
+
+class CachedResult:
+    """Thay cho res0 khi kết quả lấy từ cache: đủ `orig_shape` + `plot()` cho annotate_image."""
 
+    def __init__(self, image: ModelInput, dets: List[dict]):
+        self.image = to_decoded(image)
+        self.dets = dets
+        self.orig_shape = self.image.array.shape[:2]
 
-def record_metrics(api_label: str, elapsed: float, det_count: int) -> None:
-    labels = {"api": api_label, "model": _loaded_model_name or ""}
+    def plot(self) -> np.ndarray:
+        sx, _ = self.image.scale
+        return draw_detections(self.image.array, self.dets, 1.0 / sx)
+
+
+def _cache_key(content_hash: str, name: str) -> str:
+    return ResultCache.make_key(
+        content_hash,
+        name,
+        backend=backend_name_for(name),
+        version=model_registry.version(name),  # checkpoint mới -> không dùng lại kết quả của bản cũ
+        conf=CONF,
+        iou=IOU,
+        imgsz=IMG_SIZE,
+        **({"rect": MODEL_STRIDE} if INFER_RECT else {}),
+    )
+
+
+def _to_cache(out: tuple) -> dict:
+    w, h, elapsed, dets, _ = out
+    return {"width": w, "height": h, "elapsed": elapsed, "detections": dets}
+
+
+def _from_cache(value: dict, image: ModelInput) -> tuple:
+    dets = value["detections"]
+    return value["width"], value["height"], 0.0, dets, CachedResult(image, dets)
+
+
+def infer_batch(
+    images: List[ModelInput],
+    model_name: Optional[str] = None,
+    content_hashes: Optional[List[str]] = None,
+) -> List[tuple]:
+    """Infer nhiều ảnh trong 1 lần predict (bỏ qua ảnh đã có trong cache), trả list (w, h, elapsed, dets, res0)."""
+    name = resolve_model_name(model_name)
+    if not content_hashes or not result_cache.enabled:
+        return _predict_batch(images, name)
+
+    keys = [_cache_key(hsh, name) for hsh in content_hashes]
+    out: List[Optional[tuple]] = [None] * len(images)
+    misses = []
+    for i, (image, key) in enumerate(zip(images, keys)):
+        value = result_cache.lookup(key)
+        if value is not None:
+            out[i] = _from_cache(value, image)
+        else:
+            misses.append(i)
+
+    if misses:
+        result_cache.record_miss(len(misses))
+        fresh = _predict_batch([images[i] for i in misses], name)
+        for i, res in zip(misses, fresh):
+            result_cache.store(keys[i], _to_cache(res))
+            out[i] = res
+    return out
+
+
+def _infer_single(image: ModelInput, name: str) -> tuple:
+    if _batcher is not None:
+        image = to_decoded(image)
+        return _batcher.submit(image, key=(name, input_shape(image))).result()
+    return _predict_batch([image], name)[0]
+
+
+def infer_pil(image: ModelInput, model_name: Optional[str] = None, content_hash: Optional[str] = None):
+    """
+    Infer 1 ảnh (PIL hoặc DecodedImage từ intake), trả (w, h, elapsed, dets, res0). Gom batch qua scheduler nếu bật.
+    Có `content_hash` thì dùng result cache; request trùng đang chạy chỉ infer 1 lần.
+    """
+    name = resolve_model_name(model_name)
+    if not content_hash or not result_cache.enabled:
+        return _infer_single(image, name)
+
+    fresh: List[tuple] = []
+
+    def compute() -> dict:
+        fresh.append(_infer_single(image, name))
+        return _to_cache(fresh[0])
+
+    value, _ = result_cache.get_or_compute(_cache_key(content_hash, name), compute)
+    return fresh[0] if fresh else _from_cache(value, image)
+
+
+def record_metrics(api_label: str, elapsed: float, det_count: int, model_name: Optional[str] = None) -> None:
+    labels = {"api": api_label, "model": model_name or _loaded_model_name or ""}
     inference_counter.add(1, labels)
     inference_hist.record(elapsed, labels)
     if _resp_summary:
@@ -189,15 +420,28 @@ def save_prediction_payload(
     ts_ms: int,
     payload: dict,
     annotated_png: bytes | None,
+    model_name: Optional[str] = None,
+    durable: bool = False,
 ):
-    base_dir = make_item_dir(_loaded_model_name, stem, ts_ms)
-
-    # JSON
-    json_bytes = (__import__("json")).dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
-    json_meta = save_result_bytes(f"{base_dir}/result.json", json_bytes, "application/json")
-
-    png_meta = None
+    """
+    Lưu result.json (+ annotated.png) qua hàng đợi write-behind: trả ngay vị trí biết trước.
+    `durable=True` chờ ghi xong rồi mới trả (meta thật, có signed URL).
+    """
+    base_dir = make_item_dir(model_name or _loaded_model_name, stem, ts_ms)
+
+    # Copy nông: request vẫn thêm key vào payload sau khi enqueue, JSON được serialize trong worker
+    writes = [PendingWrite(f"{base_dir}/result.json", dict(payload), "application/json")]
     if annotated_png is not None:
-        png_meta = save_result_bytes(f"{base_dir}/annotated.png", annotated_png, "image/png")
+        writes.append(PendingWrite(f"{base_dir}/annotated.png", annotated_png, "image/png"))
+    metas = persist_queue.write_many(writes, durable=durable)
 
+    json_meta = metas[0]
+    png_meta = metas[1] if annotated_png is not None else None
     return json_meta, png_meta, base_dir
+
+
+def save_source_image(base_dir: str, data: bytes, durable: bool = False) -> dict:
+    """Lưu ảnh gốc cạnh result.json để render annotate lazy."""
+    ext = sniff_ext(data)
+    content_type = "image/jpeg" if ext == "jpg" else f"image/{ext}"
+    return persist_queue.write(f"{base_dir}/source", data, content_type, durable=durable)
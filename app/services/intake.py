@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import math
+from io import BytesIO
+from typing import Tuple, Union
+
+import cv2
+import numpy as np
+from fastapi import HTTPException
+from PIL import Image
+
+from app.config import IMG_SIZE, INTAKE_DRAFT, INTAKE_MAX_PIXELS
+
+
+class DecodedImage:
+    """
+    Ảnh đã decode cho model: mảng BGR uint8 HxWx3 liền bộ nhớ (layout numpy mà ultralytics nhận thẳng,
+    không phải convert/copy thêm) + kích thước ảnh gốc để map bbox về toạ độ gốc.
+    """
+
+    __slots__ = ("array", "orig_width", "orig_height")
+
+    def __init__(self, array: np.ndarray, orig_width: int, orig_height: int):
+        self.array = array
+        self.orig_width = orig_width
+        self.orig_height = orig_height
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(w, h) của ảnh gốc, giống PIL.Image.size."""
+        return self.orig_width, self.orig_height
+
+    @property
+    def scale(self) -> Tuple[float, float]:
+        """Hệ số nhân bbox (toạ độ trên `array`) -> toạ độ ảnh gốc."""
+        h, w = self.array.shape[:2]
+        return self.orig_width / w, self.orig_height / h
+
+
+def _draft_size(w: int, h: int, target: int) -> Tuple[int, int]:
+    r = target / max(w, h)
+    return math.ceil(w * r), math.ceil(h * r)
+
+
+def decode_image(data: bytes, target: int = IMG_SIZE) -> DecodedImage:
+    """
+    bytes -> DecodedImage.
+    - Chặn ảnh quá INTAKE_MAX_PIXELS chỉ từ header (chưa decode).
+    - JPEG: draft mode decode thẳng ở scale 1/2, 1/4, 1/8 sao cho cạnh dài vẫn >= `target`
+      (letterbox của model sẽ thu nhỏ tiếp), đỡ decode + copy ảnh full-res.
+    """
+    img = Image.open(BytesIO(data))
+    orig_w, orig_h = img.size
+    if INTAKE_MAX_PIXELS and orig_w * orig_h > INTAKE_MAX_PIXELS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image too large: {orig_w}x{orig_h} exceeds {INTAKE_MAX_PIXELS} pixels.",
+        )
+    if INTAKE_DRAFT and target and max(orig_w, orig_h) > target:
+        img.draft("RGB", _draft_size(orig_w, orig_h, target))  # chỉ có tác dụng với JPEG
+    return to_decoded(img, orig_w, orig_h)
+
+
+def to_decoded(img: Union[Image.Image, DecodedImage], orig_w: int = 0, orig_h: int = 0) -> DecodedImage:
+    """PIL -> DecodedImage (1 lần copy RGB->BGR). DecodedImage giữ nguyên."""
+    if isinstance(img, DecodedImage):
+        return img
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    arr = cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+    return DecodedImage(arr, orig_w or img.width, orig_h or img.height)
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Dict, List, Union
+
+# Các trường lấy từ /proc/<pid>/smaps_rollup (kB -> bytes)
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+
+def smaps_rollup(pid: Union[int, str] = "self", proc: Path = Path("/proc")) -> Dict[str, int]:
+    """
+    Bộ nhớ 1 process theo kernel. Rss đếm cả trang dùng chung (copy-on-write sau fork),
+    Pss chia đều trang dùng chung cho các process -> tổng Pss mới là RAM thật.
+    """
+    out = {k: 0 for k in SMAPS_FIELDS}
+    try:
+        text = (proc / str(pid) / "smaps_rollup").read_text()
+    except OSError:
+        return out
+    for line in text.splitlines():
+        key, _, rest = line.partition(":")
+        if key in out:
+            out[key] = int(rest.split()[0]) * 1024
+    return out
+
+
+def children(pid: int, proc: Path = Path("/proc")) -> List[int]:
+    """PID các process con trực tiếp (đọc /proc/<pid>/task/*/children)."""
+    out: List[int] = []
+    for task in (proc / str(pid) / "task").glob("*"):
+        try:
+            out += [int(p) for p in (task / "children").read_text().split()]
+        except OSError:
+            continue
+    return out
+
+
+def memory_report(pids: Dict[str, int], proc: Path = Path("/proc")) -> dict:
+    """
+    Bảng bộ nhớ theo process (master + worker). `sum_rss_bytes` ~ RAM nếu mỗi worker tự load model
+    (không chia sẻ gì), `sum_pss_bytes` = RAM thật đang dùng; chênh lệch là phần tiết kiệm nhờ fork.
+    """
+    procs = {label: {"pid": pid, **smaps_rollup(pid, proc)} for label, pid in pids.items()}
+    rss = sum(p["Rss"] for p in procs.values())
+    pss = sum(p["Pss"] for p in procs.values())
+    return {
+        "processes": procs,
+        "sum_rss_bytes": rss,
+        "sum_pss_bytes": pss,
+        "saved_bytes": rss - pss,
+        "pid": os.getpid(),
+    }
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import monotonic, time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from loguru import logger
+from opentelemetry import metrics
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+pool_hits = meter.create_counter(
+    name="model_pool_hits_total",
+    description="Model requests served by an already resident model",
+)
+pool_misses = meter.create_counter(
+    name="model_pool_misses_total",
+    description="Model requests that had to load weights",
+)
+pool_evictions = meter.create_counter(
+    name="model_pool_evictions_total",
+    description="Models evicted from the resident pool",
+)
+pool_load_hist = meter.create_histogram(
+    name="model_pool_load_seconds",
+    description="Time to load a model into the pool",
+    unit="s",
+)
+pool_resident = meter.create_up_down_counter(
+    name="model_pool_resident_models",
+    description="Number of models currently resident",
+)
+
+
+@dataclass
+class PooledModel:
+    name: str
+    model: Any
+    size_bytes: int
+    load_seconds: float
+    loaded_at: float = field(default_factory=time)
+    refs: int = 0
+    hits: int = 0
+    version: Optional[str] = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)  # predictor không thread-safe
+
+    @property
+    def class_names(self):
+        return getattr(self.model, "names", None) or []
+
+
+def estimate_model_bytes(model: Any) -> int:
+    """Ước lượng bộ nhớ weights (params + buffers) của model torch."""
+    module = getattr(model, "model", model)
+    total = 0
+    try:
+        for t in list(module.parameters()) + list(module.buffers()):
+            total += t.numel() * t.element_size()
+    except Exception:
+        return 0
+    return total
+
+
+class ModelPool:
+    """
+    Giữ nhiều model cùng lúc trong RAM, LRU theo lần dùng gần nhất.
+    - `acquire(name)` tăng refcount trong lúc infer, model đang được dùng không bao giờ bị evict.
+    - Evict model rảnh (refs == 0) cũ nhất khi vượt `max_models` hoặc `mem_budget_bytes`.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Any],
+        max_models: int = 2,
+        mem_budget_bytes: int = 0,
+        sizeof: Callable[[Any], int] = estimate_model_bytes,
+        version_of: Callable[[str], Optional[str]] = lambda name: None,
+    ):
+        self._loader = loader
+        self._sizeof = sizeof
+        self._version_of = version_of
+        self.max_models = max(1, int(max_models))
+        self.mem_budget_bytes = max(0, int(mem_budget_bytes))  # 0 = không giới hạn
+        self._entries: "OrderedDict[str, PooledModel]" = OrderedDict()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.swaps = 0
+
+    # ----- public API -----
+    def get(self, name: str) -> PooledModel:
+        """Đảm bảo model đã resident (không giữ ref)."""
+        return self._get_or_load(name, take_ref=False)
+
+    @contextmanager
+    def acquire(self, name: str) -> Iterator[PooledModel]:
+        entry = self._get_or_load(name, take_ref=True)
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.refs -= 1
+                self._evict_locked()
+
+    def reload(self, name: str, prepare: Optional[Callable[[Any], None]] = None) -> PooledModel:
+        """
+        Load lại model (bản mới trên đĩa) + `prepare` (warmup) ngoài lock, xong mới thay entry 1 lần.
+        Request đang giữ entry cũ chạy nốt trên bản cũ; bản cũ được giải phóng khi ref cuối thả ra.
+        """
+        with self._lock:
+            load_lock = self._loading.setdefault(name, threading.Lock())
+        with load_lock:
+            version = self._version_of(name)
+            start = monotonic()
+            model = self._loader(name)
+            if prepare is not None:
+                prepare(model)
+            elapsed = monotonic() - start
+            entry = PooledModel(
+                name=name, model=model, size_bytes=self._sizeof(model), load_seconds=elapsed, version=version
+            )
+            pool_load_hist.record(elapsed, {"model": name})
+            with self._lock:
+                old = self._entries.get(name)
+                self._entries[name] = entry
+                self._entries.move_to_end(name)
+                self.swaps += 1
+                if old is None:
+                    pool_resident.add(1)
+                self._loading.pop(name, None)
+                self._evict_locked()
+        logger.info(f"Model pool: swapped '{name}' -> {version} in {elapsed:.2f}s")
+        return entry
+
+    def is_resident(self, name: str) -> bool:
+        with self._lock:
+            return name in self._entries
+
+    def resident(self) -> List[str]:
+        with self._lock:
+            return list(self._entries.keys())
+
+    def evict(self, name: str) -> bool:
+        """Bỏ model khỏi pool nếu đang rảnh."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry.refs > 0:
+                return False
+            self._drop_locked(name)
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_models": self.max_models,
+                "mem_budget_bytes": self.mem_budget_bytes,
+                "resident_bytes": self._resident_bytes_locked(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "swaps": self.swaps,
+                "models": [
+                    {
+                        "name": e.name,
+                        "size_bytes": e.size_bytes,
+                        "load_seconds": e.load_seconds,
+                        "loaded_at": e.loaded_at,
+                        "refs": e.refs,
+                        "hits": e.hits,
+                        "version": e.version,
+                    }
+                    for e in self._entries.values()
+                ],
+            }
+
+    # ----- internals -----
+    def _lookup_locked(self, name: str, take_ref: bool) -> Optional[PooledModel]:
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        self._entries.move_to_end(name)
+        if take_ref:
+            entry.refs += 1
+        return entry
+
+    def _get_or_load(self, name: str, take_ref: bool) -> PooledModel:
+        with self._lock:
+            entry = self._lookup_locked(name, take_ref)
+            if entry is not None:
+                entry.hits += 1
+                self.hits += 1
+                pool_hits.add(1, {"model": name})
+                return entry
+            load_lock = self._loading.setdefault(name, threading.Lock())
+
+        # Chỉ 1 thread load cho mỗi model, các thread khác chờ rồi dùng chung
+        with load_lock:
+            with self._lock:
+                entry = self._lookup_locked(name, take_ref)
+                if entry is not None:
+                    entry.hits += 1
+                    self.hits += 1
+                    pool_hits.add(1, {"model": name})
+                    return entry
+
+            version = self._version_of(name)
+            start = monotonic()
+            model = self._loader(name)
+            elapsed = monotonic() - start
+            entry = PooledModel(
+                name=name, model=model, size_bytes=self._sizeof(model), load_seconds=elapsed, version=version
+            )
+            pool_load_hist.record(elapsed, {"model": name})
+            pool_misses.add(1, {"model": name})
+
+            with self._lock:
+                self.misses += 1
+                if take_ref:
+                    entry.refs += 1
+                self._entries[name] = entry
+                pool_resident.add(1)
+                self._loading.pop(name, None)
+                self._evict_locked()
+            logger.info(f"Model pool: loaded '{name}' in {elapsed:.2f}s ({entry.size_bytes / 2**20:.1f} MiB)")
+            return entry
+
+    def _resident_bytes_locked(self) -> int:
+        return sum(e.size_bytes for e in self._entries.values())
+
+    def _over_budget_locked(self) -> bool:
+        if len(self._entries) > self.max_models:
+            return True
+        return bool(self.mem_budget_bytes) and self._resident_bytes_locked() > self.mem_budget_bytes
+
+    def _evict_locked(self) -> None:
+        # Luôn giữ model mới dùng nhất (cuối OrderedDict), kể cả khi 1 mình nó vượt budget
+        while self._over_budget_locked():
+            victim = next(
+                (n for n, e in list(self._entries.items())[:-1] if e.refs == 0),
+                None,
+            )
+            if victim is None:
+                return
+            self._drop_locked(victim)
+
+    def _drop_locked(self, name: str) -> None:
+        self._entries.pop(name, None)
+        self.evictions += 1
+        pool_evictions.add(1, {"model": name})
+        pool_resident.add(-1)
+        logger.info(f"Model pool: evicted '{name}'")
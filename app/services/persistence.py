@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import atexit
+import json
+import queue
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from time import monotonic
+from typing import Dict, List, Optional, Union
+
+from loguru import logger
+from opentelemetry import metrics
+
+from app.config import (
+    PERSIST_MODE,
+    PERSIST_QUEUE_SIZE,
+    PERSIST_WORKERS,
+    PERSIST_BATCH_SIZE,
+    RESULTS_PREFIX,
+    STORAGE_BACKEND,
+)
+from app.services.storage import load_result_bytes, save_results_many
+from app.utils import GCS_BUCKET_NAME
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+persist_depth = meter.create_up_down_counter(
+    name="persistence_queue_depth",
+    description="Result writes waiting in the write-behind queue",
+)
+persist_batch_hist = meter.create_histogram(
+    name="persistence_batch_seconds",
+    description="Time to persist one drained batch of result writes",
+    unit="s",
+)
+persist_failures = meter.create_counter(
+    name="persistence_failures_total",
+    description="Result writes that failed in the background",
+)
+persist_sync_fallback = meter.create_counter(
+    name="persistence_sync_fallback_total",
+    description="Result writes done inline because the write-behind queue was full",
+)
+
+
+@dataclass
+class PendingWrite:
+    rel_path: str
+    data: Union[bytes, dict]  # dict = JSON, serialize trong worker
+    content_type: str
+
+    def to_bytes(self) -> bytes:
+        if isinstance(self.data, dict):
+            return json.dumps(self.data, ensure_ascii=False, indent=2).encode("utf-8")
+        return self.data
+
+
+def result_location(rel_path: str) -> Dict[str, Optional[dict | str]]:
+    """
+    Vị trí kết quả biết trước (chưa cần ghi xong), cùng shape với `save_result_bytes`.
+    Signed URL cần gọi GCS nên chỉ có khi ghi durable.
+    """
+    rel_path = rel_path.lstrip("/")
+    web_path = None
+    gcs_meta = None
+    if STORAGE_BACKEND in ("local", "both"):
+        web_path = f"/results/{rel_path.replace(chr(92), '/')}"
+    if STORAGE_BACKEND in ("gcs", "both"):
+        gcs_path = f"{RESULTS_PREFIX}/{rel_path}"
+        gcs_meta = {
+            "bucket": GCS_BUCKET_NAME,
+            "path": gcs_path,
+            "gs_uri": f"gs://{GCS_BUCKET_NAME}/{gcs_path}",
+            "public_url": f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{gcs_path}",
+            "signed_url": None,
+        }
+    return {"web_path": web_path, "gcs": gcs_meta}
+
+
+def _write_all(writes: List[PendingWrite]) -> List[dict]:
+    """Ghi 1 lượt: các file GCS được upload song song."""
+    return save_results_many([(w.rel_path, w.to_bytes(), w.content_type) for w in writes])
+
+
+class PersistenceQueue:
+    """
+    Write-behind cho kết quả predict: request chỉ enqueue rồi trả vị trí biết trước,
+    `workers` thread ghi local/GCS phía sau, mỗi lần rút tối đa `batch_size` job.
+    - Hàng đợi đầy: ghi luôn trong request (không bao giờ bỏ kết quả).
+    - `durable=True`: chờ ghi xong, trả meta thật (kể cả signed URL).
+    - `close()` (shutdown/atexit) ghi hết hàng đợi trước khi thoát.
+    """
+
+    def __init__(self, max_queue: int = 1024, workers: int = 2, batch_size: int = 32, enabled: bool = True):
+        self.max_queue = max(1, int(max_queue))
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.enabled = enabled
+        self._q: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=self.max_queue)
+        self._pending: Dict[str, PendingWrite] = {}
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+        self.written = 0
+        self.failed = 0
+
+    # ----- public API -----
+    def write_many(self, writes: List[PendingWrite], durable: bool = False) -> List[dict]:
+        """Ghi 1 nhóm file; trả meta theo thứ tự `writes`."""
+        if not self.enabled or self._closed or durable:
+            return _write_all(writes)
+
+        fut: Future = Future()
+        self._start()
+        with self._lock:
+            for w in writes:
+                self._pending[w.rel_path] = w
+        try:
+            self._q.put_nowait((writes, fut))
+        except queue.Full:
+            persist_sync_fallback.add(1)
+            try:
+                return _write_all(writes)
+            finally:
+                self._forget(writes)
+        persist_depth.add(1)
+        return [result_location(w.rel_path) for w in writes]
+
+    def write(self, rel_path: str, data: Union[bytes, dict], content_type: str, durable: bool = False) -> dict:
+        return self.write_many([PendingWrite(rel_path, data, content_type)], durable)[0]
+
+    def read(self, rel_path: str) -> Optional[bytes]:
+        """Đọc kết quả, kể cả khi còn nằm trong hàng đợi chưa ghi."""
+        rel_path = rel_path.lstrip("/")
+        with self._lock:
+            pending = self._pending.get(rel_path)
+        if pending is not None:
+            return pending.to_bytes()
+        return load_result_bytes(rel_path)
+
+    def qsize(self) -> int:
+        return self._q.qsize()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Chờ hàng đợi rỗng; True nếu xong trước `timeout`."""
+        if not self._threads:
+            return True
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._q.all_tasks_done:
+            while self._q.unfinished_tasks:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._q.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = 30.0) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if not self._threads:
+            return
+        done = self.flush(timeout)
+        for _ in self._threads:
+            self._q.put(None)
+        for t in self._threads:
+            t.join(timeout=1.0)
+        if not done:
+            logger.warning(f"Persistence: shutdown with {self._q.qsize()} batches still queued")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "queued": self._q.qsize(),
+            "pending_files": len(self._pending),
+            "max_queue": self.max_queue,
+            "workers": self.workers,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+    # ----- internals -----
+    def _start(self) -> None:
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"persist-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _forget(self, writes: List[PendingWrite]) -> None:
+        with self._lock:
+            for w in writes:
+                if self._pending.get(w.rel_path) is w:
+                    del self._pending[w.rel_path]
+
+    def _worker(self) -> None:
+        while True:
+            job = self._q.get()
+            if job is None:
+                self._q.task_done()
+                return
+            jobs = [job]
+            # Rút thêm job đang chờ để ghi 1 lượt
+            while len(jobs) < self.batch_size:
+                try:
+                    nxt = self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._q.put(None)  # trả sentinel cho lần lặp sau
+                    self._q.task_done()
+                    break
+                jobs.append(nxt)
+
+            start = monotonic()
+            # Cả batch 1 lượt (GCS upload song song); lỗi thì ghi lại từng job để cô lập job hỏng
+            try:
+                flat = _write_all([w for writes, _ in jobs for w in writes])
+            except Exception:
+                flat = None
+            offset = 0
+            for writes, fut in jobs:
+                try:
+                    if flat is not None:
+                        metas = flat[offset : offset + len(writes)]
+                        offset += len(writes)
+                    else:
+                        metas = _write_all(writes)
+                    fut.set_result(metas)
+                    with self._lock:
+                        self.written += len(writes)
+                except Exception as e:
+                    with self._lock:
+                        self.failed += len(writes)
+                    persist_failures.add(len(writes))
+                    logger.error(f"Persistence: failed to write {[w.rel_path for w in writes]}: {e}")
+                    fut.set_exception(e)
+                finally:
+                    self._forget(writes)
+                    persist_depth.add(-1)
+                    self._q.task_done()
+            persist_batch_hist.record(monotonic() - start)
+
+
+persist_queue = PersistenceQueue(
+    max_queue=PERSIST_QUEUE_SIZE,
+    workers=PERSIST_WORKERS,
+    batch_size=PERSIST_BATCH_SIZE,
+    enabled=PERSIST_MODE == "async",
+)
+atexit.register(persist_queue.close)
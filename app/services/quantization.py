@@ -0,0 +1,280 @@
+"""
+Tạo bản INT8 (ONNX Runtime) cho model trong MODELS_DIR + đo mAP/latency so với bản gốc.
+
+  .pt --(OnnxBackend.export, cache cạnh weights)--> .onnx FP32 --(quantize)--> MODELS_DIR/<model>-int8.onnx
+  static : calibrate activation trên ảnh thật (QDQ, weight per-channel) -> nhanh + chính xác hơn cho CNN
+  dynamic: chỉ lượng tử hoá weights, không cần ảnh calibrate
+File INT8 được model_registry nhận như model thường (`<model>-int8`, backend onnx), chọn qua ?model= / /model/select.
+
+CLI:
+  python -m app.services.quantization --models yolo12m --data dataset/data.yaml --split test
+  python -m app.services.quantization --mode dynamic              # mọi model .pt, chỉ đo latency (không có --data)
+Kết quả ghi vào QUANT_REPORT_CSV (mặc định train_progress/evaluation/model_comparison_int8.csv, cùng cột với
+model_comparison_yolo.csv + Backend/Size_MB).
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import re
+import statistics
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+from app.config import (
+    IMG_SIZE,
+    INT8_SUFFIX,
+    MODELS_DIR,
+    QUANT_CALIB_IMAGES,
+    QUANT_EXCLUDE_HEAD,
+    QUANT_MODE,
+    QUANT_REPORT_CSV,
+)
+from app.services.backends import BACKENDS, _file_lock, _yolo
+from app.services.registry import model_registry
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+REPORT_COLUMNS = ["Model", "Backend", "Size_MB", "mAP50", "mAP50-95", "Precision", "Recall", "Inference_ms_per_img"]
+
+
+def int8_name(name: str) -> str:
+    return f"{name}{INT8_SUFFIX}"
+
+
+def int8_path(name: str, models_dir: Path = MODELS_DIR) -> Path:
+    return models_dir / f"{int8_name(name)}.onnx"
+
+
+# ===== Calibration =====
+def calibration_images(source: Path, limit: int = QUANT_CALIB_IMAGES) -> List[Path]:
+    """Ảnh calibrate: thư mục ảnh, hoặc data.yaml (lấy split val, không có thì train)."""
+    source = Path(source)
+    if source.suffix.lower() in (".yaml", ".yml"):
+        from ultralytics.data.utils import check_det_dataset
+
+        data = check_det_dataset(str(source))
+        source = Path(data.get("val") or data["train"])
+    files = sorted(p for p in source.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+    if not files:
+        raise ValueError(f"No calibration images under {source}")
+    step = max(1, len(files) // max(1, limit))  # rải đều trên toàn bộ tập
+    return files[::step][:limit]
+
+
+def preprocess(path: Path, imgsz: int = IMG_SIZE) -> np.ndarray:
+    """Giống tiền xử lý lúc predict của ultralytics: letterbox vuông, BGR->RGB, /255, NCHW float32."""
+    import cv2
+    from ultralytics.data.augment import LetterBox
+
+    im = cv2.imread(str(path))
+    if im is None:
+        raise ValueError(f"Cannot read image {path}")
+    im = LetterBox((imgsz, imgsz), auto=False)(image=im)
+    return np.ascontiguousarray(im[..., ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255.0
+
+
+class _CalibrationReader:
+    """CalibrationDataReader của onnxruntime: mỗi lần get_next() 1 ảnh."""
+
+    def __init__(self, input_name: str, images: Sequence[Path], imgsz: int = IMG_SIZE):
+        self._it: Iterator[dict] = ({input_name: preprocess(p, imgsz)} for p in images)
+
+    def get_next(self) -> Optional[dict]:
+        return next(self._it, None)
+
+
+def _decode_nodes(onnx_path: Path) -> List[str]:
+    """
+    Node giải mã output của Detect head (DFL softmax, sigmoid, cộng/nhân toạ độ, concat): đi ngược từ output
+    của graph tới Conv gần nhất. Giữ các node này FP32 vì toạ độ box nhạy với sai số INT8; Conv vẫn lượng tử hoá.
+    Không dựa vào tên node (exporter mới đặt tên kiểu node_Conv_285).
+    """
+    import onnx
+
+    graph = onnx.load(str(onnx_path), load_external_data=False).graph
+    producer = {out: node for node in graph.node for out in node.output}
+    keep, stack, seen = [], [o.name for o in graph.output], set()
+    while stack:
+        node = producer.get(stack.pop())
+        if node is None or node.name in seen or node.op_type == "Conv":
+            continue
+        seen.add(node.name)
+        keep.append(node.name)
+        stack.extend(node.input)
+    return keep
+
+
+# ===== Quantize =====
+def quantize(
+    name: str,
+    mode: str = QUANT_MODE,
+    calib_source: Optional[Path] = None,
+    calib_images: int = QUANT_CALIB_IMAGES,
+    exclude_head: bool = QUANT_EXCLUDE_HEAD,
+    imgsz: int = IMG_SIZE,
+) -> Path:
+    """Tạo MODELS_DIR/<name>-int8.onnx từ model `name` (.pt trong registry), trả đường dẫn file."""
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if mode not in ("static", "dynamic"):
+        raise ValueError(f"Unknown quantization mode '{mode}' (static | dynamic)")
+    if mode == "static" and calib_source is None:
+        raise ValueError("Static quantization needs calibration images (--calib or --data)")
+
+    weights = model_registry.path(name)
+    fp32 = BACKENDS["onnx"].export(weights)
+    out = int8_path(name, weights.parent)
+    exclude = _decode_nodes(fp32) if exclude_head else []
+
+    with _file_lock(out.with_suffix(".lock")):
+        prep = out.with_name(f".{out.stem}.prep.onnx")
+        tmp = out.with_name(f".{out.stem}.tmp.onnx")
+        try:
+            try:
+                quant_pre_process(str(fp32), str(prep), skip_symbolic_shape=True)
+                src = prep
+            except Exception as e:  # pre-process chỉ giúp gộp node/shape, không bắt buộc
+                logger.warning(f"ONNX pre-process failed, quantizing raw export: {e}")
+                src = fp32
+
+            start = perf_counter()
+            if mode == "dynamic":
+                quantize_dynamic(str(src), str(tmp), weight_type=QuantType.QUInt8, nodes_to_exclude=exclude)
+            else:
+                import onnxruntime as ort
+
+                input_name = ort.InferenceSession(str(src), providers=["CPUExecutionProvider"]).get_inputs()[0].name
+                images = calibration_images(calib_source, calib_images)
+                logger.info(f"Calibrating {name} on {len(images)} images")
+                quantize_static(
+                    str(src),
+                    str(tmp),
+                    _CalibrationReader(input_name, images, imgsz),
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=True,
+                    nodes_to_exclude=exclude,
+                )
+            os.replace(tmp, out)  # registry chỉ thấy file hoàn chỉnh
+        finally:
+            for p in (prep, tmp):
+                p.unlink(missing_ok=True)
+
+    logger.info(
+        f"Quantized {name} ({mode}) -> {out.name}: {fp32.stat().st_size / 2**20:.1f} MB -> "
+        f"{out.stat().st_size / 2**20:.1f} MB in {perf_counter() - start:.1f}s, {len(exclude)} decode nodes kept FP32"
+    )
+    return out
+
+
+# ===== Evaluate =====
+def evaluate(path: Path, data: Path, split: str = "test", imgsz: int = IMG_SIZE) -> dict:
+    """mAP/precision/recall + ms/ảnh trên tập có nhãn (ultralytics val, CPU, batch 1 để latency so được)."""
+    metrics = _yolo(str(path), task="detect").val(
+        data=str(data), split=split, imgsz=imgsz, batch=1, device="cpu", plots=False, verbose=False
+    )
+    return {
+        "mAP50": round(float(metrics.box.map50), 3),
+        "mAP50-95": round(float(metrics.box.map), 3),
+        "Precision": round(float(metrics.box.mp), 3),
+        "Recall": round(float(metrics.box.mr), 3),
+        "Inference_ms_per_img": round(float(metrics.speed["inference"]), 1),
+    }
+
+
+def measure_latency(path: Path, imgsz: int = IMG_SIZE, runs: int = 20) -> dict:
+    """Không có tập nhãn: chỉ đo ms/ảnh (median, batch 1) trên ảnh đen."""
+    model = _yolo(str(path), task="detect")
+    image = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    for _ in range(3):
+        model.predict(image, imgsz=imgsz, device="cpu", verbose=False)
+    times = []
+    for _ in range(max(1, runs)):
+        start = perf_counter()
+        model.predict(image, imgsz=imgsz, device="cpu", verbose=False)
+        times.append(perf_counter() - start)
+    return {"Inference_ms_per_img": round(statistics.median(times) * 1000, 1)}
+
+
+def write_report(rows: List[dict], path: Path = QUANT_REPORT_CSV) -> Path:
+    """Ghi/cập nhật CSV so sánh: dòng cùng (Model, Backend) được thay bằng kết quả mới."""
+    path = Path(path)
+    existing: Dict[tuple, dict] = {}
+    if path.exists():
+        with open(path, newline="") as fh:
+            existing = {(r["Model"], r["Backend"]): r for r in csv.DictReader(fh)}
+    for row in rows:
+        existing[(row["Model"], row["Backend"])] = {k: row.get(k, "") for k in REPORT_COLUMNS}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(existing.values())
+    return path
+
+
+def compare(name: str, int8: Path, data: Optional[Path], split: str, imgsz: int = IMG_SIZE) -> List[dict]:
+    """Bản gốc (.pt, torch) vs FP32 ONNX vs INT8 ONNX, cùng tập/cùng cách đo."""
+    weights = model_registry.path(name)
+    variants = [
+        (name, "torch", weights),
+        (name, "onnx", BACKENDS["onnx"].artifact_path(weights)),
+        (int8_name(name), "onnx-int8", int8),
+    ]
+    rows = []
+    for model, backend, path in variants:
+        row = {"Model": model, "Backend": backend, "Size_MB": round(path.stat().st_size / 2**20, 1)}
+        row.update(evaluate(path, data, split, imgsz) if data else measure_latency(path, imgsz))
+        logger.info(f"{model} [{backend}]: {row}")
+        rows.append(row)
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Create INT8 ONNX variants of models and compare accuracy/latency")
+    parser.add_argument("--models", nargs="*", default=None, help="default: every .pt model in MODELS_DIR")
+    parser.add_argument("--mode", choices=["static", "dynamic"], default=QUANT_MODE)
+    parser.add_argument("--data", type=Path, default=None, help="data.yaml of a labeled set (mAP + calibration)")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--calib", type=Path, default=None, help="calibration image dir (default: --data val split)")
+    parser.add_argument("--calib-images", type=int, default=QUANT_CALIB_IMAGES)
+    parser.add_argument("--imgsz", type=int, default=IMG_SIZE)
+    parser.add_argument("--keep-head-int8", action="store_true", help="also quantize the Detect head")
+    parser.add_argument("--csv", type=Path, default=QUANT_REPORT_CSV)
+    parser.add_argument("--no-eval", action="store_true", help="only write the INT8 files")
+    args = parser.parse_args(argv)
+
+    names = args.models or [n for n in model_registry.names() if model_registry.path(n).suffix == ".pt"]
+    rows: List[dict] = []
+    for name in names:
+        out = quantize(
+            name,
+            mode=args.mode,
+            calib_source=args.calib or args.data,
+            calib_images=args.calib_images,
+            exclude_head=QUANT_EXCLUDE_HEAD and not args.keep_head_int8,
+            imgsz=args.imgsz,
+        )
+        if not args.no_eval:
+            rows += compare(name, out, args.data, args.split, args.imgsz)
+
+    if rows:
+        print(f"{'model':<20} {'backend':<10} {'MB':>6} {'mAP50':>6} {'mAP50-95':>8} {'ms/img':>7}")
+        for r in rows:
+            print(
+                f"{r['Model']:<20} {r['Backend']:<10} {r['Size_MB']:>6} {r.get('mAP50', '-'):>6} "
+                f"{r.get('mAP50-95', '-'):>8} {r['Inference_ms_per_img']:>7}"
+            )
+        logger.info(f"Report written to {write_report(rows, args.csv)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
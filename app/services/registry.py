@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+from opentelemetry import metrics
+
+from app.config import AVAILABLE_MODELS, INT8_GLOB, MODEL_SUFFIXES, MODEL_WATCH_INTERVAL, MODELS_DIR
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+registry_changes = meter.create_counter(
+    name="model_registry_changes_total",
+    description="Weights added/changed/removed in MODELS_DIR",
+)
+swap_counter = meter.create_counter(
+    name="model_swaps_total",
+    description="Hot-reload attempts of a resident model, by outcome",
+)
+
+
+@dataclass
+class ModelVersion:
+    """1 file weights cụ thể trên đĩa. `version` = sha256 nội dung (12 ký tự), tính 1 lần khi cần."""
+
+    name: str
+    path: Path
+    mtime_ns: int
+    size: int
+    discovered_at: float = field(default_factory=time)
+    _digest: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def version(self) -> str:
+        if self._digest is None:
+            h = hashlib.sha256()
+            try:
+                with open(self.path, "rb") as fh:
+                    for chunk in iter(lambda: fh.read(1 << 20), b""):
+                        h.update(chunk)
+                self._digest = h.hexdigest()[:12]
+            except OSError:
+                return f"{self.mtime_ns:x}-{self.size:x}"  # file vừa bị xoá/thay, không cache
+        return self._digest
+
+    def to_dict(self) -> dict:
+        return {
+            "path": str(self.path),
+            "version": self.version,
+            "size_bytes": self.size,
+            "mtime": self.mtime_ns / 1e9,
+            "discovered_at": self.discovered_at,
+        }
+
+
+Change = Tuple[str, str]  # (added | changed | removed, tên model)
+
+
+class ModelRegistry:
+    """
+    Danh sách model theo MODELS_DIR, cập nhật lúc chạy. `scan()` so stat file với lần trước và trả các thay đổi;
+    file mới/sửa chỉ được nhận khi (mtime, size) đứng yên qua 2 lần quét (tránh đọc file đang copy dở).
+    """
+
+    def __init__(
+        self,
+        models_dir: Path = MODELS_DIR,
+        suffixes: Sequence[str] = MODEL_SUFFIXES,
+        initial: Optional[Dict[str, Path]] = None,
+    ):
+        self.models_dir = Path(models_dir)
+        self.suffixes = tuple(s.lower() for s in suffixes)
+        self._models: Dict[str, ModelVersion] = {}
+        self._pending: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self.swaps: Dict[str, dict] = {}  # lần hot-reload gần nhất theo model
+        self.last_swap: Optional[dict] = None
+        self.last_scan: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        for name, path in (initial if initial is not None else self._stat_dir()).items():
+            st = Path(path).stat()
+            self._models[name] = ModelVersion(name, Path(path), st.st_mtime_ns, st.st_size)
+
+    # ----- lookup -----
+    def __contains__(self, name: object) -> bool:
+        return name in self._models
+
+    def names(self) -> List[str]:
+        return sorted(self._models)
+
+    def get(self, name: str) -> Optional[ModelVersion]:
+        return self._models.get(name)
+
+    def path(self, name: str) -> Path:
+        return self._models[name].path
+
+    def version(self, name: str) -> Optional[str]:
+        rec = self._models.get(name)
+        return rec.version if rec else None
+
+    # ----- scan -----
+    def _stat_dir(self) -> Dict[str, Path]:
+        return {
+            p.stem: p.resolve()
+            for p in self.models_dir.glob("*.*")
+            if p.is_file() and (p.suffix.lower() in self.suffixes or p.match(INT8_GLOB))
+        }
+
+    def scan(self) -> List[Change]:
+        seen: Dict[str, Tuple[Path, int, int]] = {}
+        for name, path in self._stat_dir().items():
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            seen[name] = (path, st.st_mtime_ns, st.st_size)
+
+        changes: List[Change] = []
+        with self._lock:
+            for name, (path, mtime, size) in seen.items():
+                cur = self._models.get(name)
+                if cur is not None and (cur.path, cur.mtime_ns, cur.size) == (path, mtime, size):
+                    self._pending.pop(name, None)
+                    continue
+                if self._pending.get(name) != (mtime, size):
+                    self._pending[name] = (mtime, size)  # thấy lần đầu: chờ lần quét sau cho chắc đã ghi xong
+                    continue
+                del self._pending[name]
+                self._models[name] = ModelVersion(name, path, mtime, size)
+                changes.append(("changed" if cur is not None else "added", name))
+            for name in [n for n in self._models if n not in seen]:
+                del self._models[name]
+                self._pending.pop(name, None)
+                changes.append(("removed", name))
+            self.last_scan = time()
+
+        for event, name in changes:
+            registry_changes.add(1, {"event": event})
+            logger.info(f"Model registry: {event} '{name}'")
+        return changes
+
+    # ----- swap history -----
+    def record_swap(self, name: str, old: Optional[str], new: Optional[str], seconds: float, error: Optional[str] = None):
+        info = {
+            "model": name,
+            "from_version": old,
+            "to_version": new,
+            "load_seconds": round(seconds, 3),
+            "at": time(),
+            "ok": error is None,
+            "error": error,
+        }
+        with self._lock:
+            self.swaps[name] = info
+            if error is None:
+                self.last_swap = info
+        swap_counter.add(1, {"model": name, "ok": str(error is None).lower()})
+
+    def info(self) -> dict:
+        with self._lock:
+            models = dict(self._models)
+            swaps = dict(self.swaps)
+        return {
+            "models_dir": str(self.models_dir),
+            "watch_interval": MODEL_WATCH_INTERVAL,
+            "watching": bool(self._thread and self._thread.is_alive()),
+            "last_scan": self.last_scan,
+            "last_swap": self.last_swap,
+            "models": {
+                name: {**rec.to_dict(), "last_swap": swaps.get(name)} for name, rec in sorted(models.items())
+            },
+        }
+
+    # ----- watcher -----
+    def watch(self, handler: Callable[[str, str], None], interval: float = MODEL_WATCH_INTERVAL):
+        """Thread nền: quét mỗi `interval` giây, gọi `handler(event, name)` cho từng thay đổi (tuần tự)."""
+        if interval <= 0 or self._thread is not None:
+            return self._thread
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    changes = self.scan()
+                except Exception:
+                    logger.exception("Model registry scan failed")
+                    continue
+                for event, name in changes:
+                    try:
+                        handler(event, name)
+                    except Exception:
+                        logger.exception(f"Model registry handler failed for {event} '{name}'")
+
+        self._thread = threading.Thread(target=loop, name="model-watcher", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+model_registry = ModelRegistry(initial=AVAILABLE_MODELS)
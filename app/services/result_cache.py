@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from loguru import logger
+from opentelemetry import metrics
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+cache_hits = meter.create_counter(
+    name="result_cache_hits_total",
+    description="Predictions served from the result cache",
+)
+cache_misses = meter.create_counter(
+    name="result_cache_misses_total",
+    description="Predictions that had to run the model",
+)
+cache_saved_seconds = meter.create_counter(
+    name="result_cache_saved_inference_seconds_total",
+    description="Inference time saved by result cache hits",
+    unit="s",
+)
+
+
+def content_digest(data: bytes) -> str:
+    """Hash nội dung ảnh (bytes gốc, chưa decode)."""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache kết quả predict theo (hash ảnh, model, tham số infer).
+    - Tier 1: LRU trong RAM (`max_entries`, 0 = tắt).
+    - Tier 2 (tuỳ chọn): file JSON dưới `disk_dir`, giới hạn `disk_max_entries`.
+    - Request trùng đang chạy thì chờ chung 1 lần infer (coalescing).
+    Giá trị cache: {"width", "height", "elapsed", "detections"}.
+    """
+
+    def __init__(self, max_entries: int = 1024, disk_dir: Optional[Path] = None, disk_max_entries: int = 10000):
+        self.max_entries = max(0, int(max_entries))
+        self.disk_dir = disk_dir
+        self.disk_max_entries = max(0, int(disk_max_entries))
+        self._mem: "OrderedDict[str, dict]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self.disk_dir is not None
+
+    @staticmethod
+    def make_key(digest: str, model: str, **params) -> str:
+        parts = [digest, model] + [f"{k}={params[k]}" for k in sorted(params)]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+    # ----- lookup / store -----
+    def lookup(self, key: str) -> Optional[dict]:
+        with self._lock:
+            value = self._mem.get(key)
+            if value is not None:
+                self._mem.move_to_end(key)
+        tier = "memory"
+        if value is None:
+            value = self._disk_get(key)
+            tier = "disk"
+            if value is not None:
+                self._mem_put(key, value)
+        if value is not None:
+            self._record_hit(value, tier)
+        return value
+
+    def store(self, key: str, value: dict) -> None:
+        self._mem_put(key, value)
+        self._disk_put(key, value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], dict]) -> Tuple[dict, bool]:
+        """Trả (value, hit). Chỉ 1 caller chạy `compute` cho mỗi key tại 1 thời điểm."""
+        value = self.lookup(key)
+        if value is not None:
+            return value, True
+
+        with self._lock:
+            # Leader trước có thể vừa store + rời _inflight ngay sau lookup() ở trên -> kiểm tra lại cùng lock
+            value = self._mem.get(key)
+            if value is not None:
+                self._mem.move_to_end(key)
+            else:
+                fut = self._inflight.get(key)
+                leader = fut is None
+                if leader:
+                    fut = self._inflight[key] = Future()
+        if value is not None:
+            self._record_hit(value, "memory")
+            return value, True
+        if not leader:
+            value = fut.result()
+            with self._lock:
+                self.coalesced += 1
+            self._record_hit(value, "coalesced")
+            return value, True
+
+        try:
+            # Tier RAM tắt/đã evict: leader trước có thể chỉ còn để lại bản trên disk
+            value = self._disk_get(key)
+            if value is not None:
+                self._mem_put(key, value)
+                self._record_hit(value, "disk")
+                fut.set_result(value)
+                return value, True
+            value = compute()
+            self.record_miss()
+            self.store(key, value)
+            fut.set_result(value)
+            return value, False
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def record_miss(self, n: int = 1) -> None:
+        with self._lock:
+            self.misses += n
+        cache_misses.add(n)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._mem),
+            "max_entries": self.max_entries,
+            "disk_dir": str(self.disk_dir) if self.disk_dir else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
+
+    # ----- internals -----
+    def _record_hit(self, value: dict, tier: str) -> None:
+        saved = float(value.get("elapsed") or 0.0)
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += saved
+        cache_hits.add(1, {"tier": tier})
+        cache_saved_seconds.add(saved)
+
+    def _mem_put(self, key: str, value: dict) -> None:
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _disk_get(self, key: str) -> Optional[dict]:
+        if self.disk_dir is None:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Result cache: unreadable disk entry {key}: {e}")
+            return None
+
+    def _disk_put(self, key: str, value: dict) -> None:
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f"Result cache: disk write failed for {key}: {e}")
+            return
+        with self._lock:
+            self._disk_writes += 1
+            prune = self.disk_max_entries and self._disk_writes % 256 == 0
+        if prune:
+            self._disk_prune()
+
+    def _disk_prune(self) -> None:
+        """Xoá entry cũ nhất (theo mtime) khi tier disk vượt giới hạn."""
+        files = list(self.disk_dir.glob("*/*.json"))
+        excess = len(files) - self.disk_max_entries
+        if excess <= 0:
+            return
+
+        def _mtime(p: Path) -> float:
+            try:
+                return p.stat().st_mtime
+            except FileNotFoundError:
+                return 0.0
+
+        files.sort(key=_mtime)
+        for p in files[:excess]:
+            p.unlink(missing_ok=True)
+        logger.info(f"Result cache: pruned {excess} disk entries")
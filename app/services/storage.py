@@ -1,10 +1,10 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 
 from app.config import RESULTS_DIR, STORAGE_BACKEND, RESULTS_PREFIX, SIGNED_URL_EXP_HOURS
-from app.utils import upload_bytes  # giữ utils của bạn
+from app.utils import GCS_BUCKET_NAME, download_bytes, list_blob_names, upload_many  # giữ utils của bạn
 from loguru import logger
 
 
@@ -13,34 +13,90 @@ def save_result_bytes(rel_path: str, data: bytes, content_type: str) -> Dict[str
     Lưu byte theo backend.
     Trả: {"web_path": Optional[str], "gcs": Optional[dict]}
     """
-    rel_path = rel_path.lstrip("/")
-    web_path = None
-    gcs_meta = None
+    return save_results_many([(rel_path, data, content_type)])[0]
+
+
+def save_results_many(items: Sequence[Tuple[str, bytes, str]]) -> List[Dict[str, Optional[dict | str]]]:
+    """
+    Lưu nhiều (rel_path, data, content_type) 1 lượt: ghi local tuần tự, upload GCS song song.
+    Trả list meta cùng thứ tự, mỗi phần tử giống `save_result_bytes`.
+    """
+    items = [(rel.lstrip("/"), data, ctype) for rel, data, ctype in items]
+    metas: List[Dict[str, Optional[dict | str]]] = [{"web_path": None, "gcs": None} for _ in items]
 
     if STORAGE_BACKEND in ("local", "both"):
-        save_path = (RESULTS_DIR / rel_path).resolve()
-        save_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(save_path, "wb") as f:
-            f.write(data)
-        fixed = rel_path.replace("\\", "/")
-        web_path = f"/results/{fixed}"
+        for meta, (rel_path, data, _) in zip(metas, items):
+            save_path = (RESULTS_DIR / rel_path).resolve()
+            save_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(save_path, "wb") as f:
+                f.write(data)
+            fixed = rel_path.replace("\\", "/")
+            meta["web_path"] = f"/results/{fixed}"
 
     if STORAGE_BACKEND in ("gcs", "both"):
-        gcs_path = f"{RESULTS_PREFIX}/{rel_path}"
-        try:
-            gcs_meta = upload_bytes(
-                data,
-                gcs_path,
-                content_type=content_type,
-                signed_url_hours=SIGNED_URL_EXP_HOURS,
-            )
-        except Exception as e:
-            logger.error(f"GCS upload failed for {gcs_path}: {e}")
-            gcs_meta = None
+        uploads = [(data, f"{RESULTS_PREFIX}/{rel_path}", ctype) for rel_path, data, ctype in items]
+        results = upload_many(uploads, signed_url_hours=SIGNED_URL_EXP_HOURS)
+        for meta, (_, gcs_path, _), res in zip(metas, uploads, results):
+            if isinstance(res, Exception):
+                logger.error(f"GCS upload failed for {gcs_path}: {res}")
+                continue
+            meta["gcs"] = res
 
-    return {"web_path": web_path, "gcs": gcs_meta}
+    return metas
 
 
 def make_item_dir(model_name: str | None, stem: str, ts_ms: int) -> str:
     """Folder kết quả cho từng input."""
     return f"{(model_name or 'model')}/{stem}_{ts_ms}"
+
+
+def local_result_path(rel_path: str) -> Optional[Path]:
+    """Path local của 1 file kết quả nếu tồn tại (chặn path ra ngoài RESULTS_DIR)."""
+    if STORAGE_BACKEND not in ("local", "both"):
+        return None
+    path = (RESULTS_DIR / rel_path.lstrip("/")).resolve()
+    if not path.is_relative_to(RESULTS_DIR) or not path.is_file():
+        return None
+    return path
+
+
+def delete_local_result(rel_path: str) -> None:
+    """Xoá bản local của 1 file kết quả (nếu có)."""
+    path = local_result_path(rel_path)
+    if path is not None:
+        path.unlink(missing_ok=True)
+
+
+def load_result_bytes(rel_path: str) -> Optional[bytes]:
+    """Đọc lại file kết quả: local trước, không có thì GCS."""
+    rel_path = rel_path.lstrip("/")
+    path = local_result_path(rel_path)
+    if path is not None:
+        return path.read_bytes()
+
+    if STORAGE_BACKEND in ("gcs", "both"):
+        gcs_path = f"{RESULTS_PREFIX}/{rel_path}"
+        try:
+            return download_bytes(GCS_BUCKET_NAME, gcs_path)
+        except Exception as e:
+            logger.debug(f"GCS read failed for {gcs_path}: {e}")
+    return None
+
+
+def list_result_files(rel_prefix: str, filename: str = "result.json") -> Set[str]:
+    """rel_path (tính từ gốc results) của mọi `filename` dưới `rel_prefix`, ở local lẫn GCS."""
+    rel_prefix = rel_prefix.strip("/")
+    found: Set[str] = set()
+    if STORAGE_BACKEND in ("local", "both"):
+        base = RESULTS_DIR / rel_prefix
+        if base.is_dir():
+            found.update(p.relative_to(RESULTS_DIR).as_posix() for p in base.rglob(filename))
+    if STORAGE_BACKEND in ("gcs", "both"):
+        gcs_prefix = f"{RESULTS_PREFIX}/{rel_prefix}/"
+        try:
+            names = list_blob_names(GCS_BUCKET_NAME, gcs_prefix)
+        except Exception as e:
+            logger.warning(f"GCS list failed for {gcs_prefix}: {e}")
+            names = []
+        found.update(n[len(RESULTS_PREFIX) + 1 :] for n in names if n.endswith("/" + filename))
+    return found
@@ -0,0 +1,166 @@
+"""
+Chọn số thread torch theo CPU thật của container thay vì số core của host.
+
+torch mặc định lấy intra-op = số core máy host, pod giới hạn 2 CPU chạy nhiều worker uvicorn sẽ tranh nhau CPU
+(oversubscription) -> latency thất thường. Lúc start mỗi worker:
+  1. budget = CPU quota (cgroup v2/v1, affinity) / số worker / số model chạy song song
+  2. inter-op cố định (TORCH_INTEROP_THREADS, torch chỉ cho set 1 lần trước khi chạy song song)
+  3. TORCH_THREADS=auto: thử vài giá trị intra-op <= budget bằng predict thật, chọn throughput tốt nhất
+     trong các cấu hình có latency batch 1 không tệ hơn 10% so với tốt nhất
+"""
+from __future__ import annotations
+
+import math
+import os
+import statistics
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, List, Optional
+
+from loguru import logger
+
+from app.config import (
+    BATCH_MAX_SIZE,
+    MODEL_POOL_MAX_MODELS,
+    PRELOAD_MODELS,
+    TORCH_AUTOTUNE_RUNS,
+    TORCH_INTEROP_THREADS,
+    TORCH_THREADS,
+    WEB_WORKERS,
+)
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+LATENCY_SLACK = 1.10  # chấp nhận latency batch 1 chậm hơn tốt nhất tối đa 10% để lấy throughput
+
+
+def cpu_quota(root: Path = CGROUP_ROOT) -> float:
+    """Số CPU container được dùng: min(cgroup quota, CPU affinity)."""
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except AttributeError:  # không phải Linux
+        cpus = float(os.cpu_count() or 1)
+
+    quota = None
+    try:
+        v2 = root / "cpu.max"
+        if v2.is_file():
+            q, period = v2.read_text().split()[:2]
+            if q != "max":
+                quota = int(q) / int(period)
+        else:
+            q = int((root / "cpu" / "cpu.cfs_quota_us").read_text())
+            period = int((root / "cpu" / "cpu.cfs_period_us").read_text())
+            if q > 0 and period > 0:
+                quota = q / period
+    except (OSError, ValueError) as e:
+        logger.debug(f"Cannot read cgroup CPU quota: {e}")
+
+    return min(cpus, quota) if quota else cpus
+
+
+def thread_budget(quota: float, workers: int = WEB_WORKERS, streams: int = 1) -> int:
+    """Số thread intra-op tối đa cho 1 predict: quota chia đều cho worker và số model predict song song."""
+    return max(1, math.floor(quota / max(1, workers) / max(1, streams)))
+
+
+def candidates(budget: int) -> List[int]:
+    """Giá trị intra-op thử: 1, 2, 4, ... và chính budget."""
+    out, n = [], 1
+    while n < budget:
+        out.append(n)
+        n *= 2
+    out.append(budget)
+    return out
+
+
+class ThreadTuner:
+    def __init__(self):
+        self.quota: Optional[float] = None
+        self.workers = max(1, WEB_WORKERS)
+        self.streams = max(1, min(len(PRELOAD_MODELS), MODEL_POOL_MAX_MODELS))
+        self.budget: Optional[int] = None
+        self.intra_op: Optional[int] = None
+        self.inter_op: Optional[int] = None
+        self.mode = TORCH_THREADS
+        self.trials: List[dict] = []
+        self.error: Optional[str] = None
+
+    def info(self) -> dict:
+        return {
+            "mode": self.mode,
+            "cpu_quota": self.quota,
+            "workers": self.workers,
+            "concurrent_models": self.streams,
+            "budget": self.budget,
+            "intra_op_threads": self.intra_op,
+            "inter_op_threads": self.inter_op,
+            "trials": self.trials,
+            "error": self.error,
+            "pid": os.getpid(),
+        }
+
+    def apply_budget(self) -> None:
+        """Trước khi load model: giới hạn thread theo quota (OMP/MKL qua env nếu torch chưa import)."""
+        if self.mode == "off":
+            return
+        self.quota = cpu_quota()
+        self.budget = thread_budget(self.quota, self.workers, self.streams)
+        threads = self.budget if self.mode == "auto" else max(1, int(self.mode))
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.setdefault(var, str(threads))
+
+        import torch
+
+        try:
+            torch.set_num_interop_threads(max(1, TORCH_INTEROP_THREADS))
+        except RuntimeError as e:  # torch đã chạy song song rồi, giữ nguyên
+            logger.debug(f"Cannot set inter-op threads: {e}")
+        torch.set_num_threads(threads)
+        self.intra_op, self.inter_op = torch.get_num_threads(), torch.get_num_interop_threads()
+        logger.info(
+            f"Torch threads: intra-op={self.intra_op}, inter-op={self.inter_op} "
+            f"(cpu quota {self.quota:g}, {self.workers} worker(s), {self.streams} model(s))"
+        )
+
+    def autotune(self, run: Callable[[int], None], runs: int = TORCH_AUTOTUNE_RUNS) -> Optional[int]:
+        """
+        `run(batch_size)` = 1 lần predict thật. Đo batch 1 (latency) và batch BATCH_MAX_SIZE (throughput)
+        ở từng giá trị intra-op, set giá trị chọn được và trả về nó.
+        """
+        if self.mode != "auto" or self.budget is None:
+            return self.intra_op
+        import torch
+
+        batch = max(1, BATCH_MAX_SIZE)
+        self.trials = []
+        try:
+            for n in candidates(self.budget):
+                torch.set_num_threads(n)
+                run(1)  # làm nóng lại sau khi đổi số thread
+                lat = statistics.median(_timed(run, 1) for _ in range(max(1, runs)))
+                thr = batch / statistics.median(_timed(run, batch) for _ in range(max(1, runs)))
+                self.trials.append(
+                    {"intra_op": n, "latency_ms": round(lat * 1000, 2), "images_per_second": round(thr, 2)}
+                )
+        except Exception as e:
+            logger.warning(f"Thread autotune failed, keeping {self.intra_op} threads: {e}")
+            self.error = str(e)
+            torch.set_num_threads(self.intra_op or self.budget)
+            return self.intra_op
+
+        best_lat = min(t["latency_ms"] for t in self.trials)
+        ok = [t for t in self.trials if t["latency_ms"] <= best_lat * LATENCY_SLACK]
+        chosen = max(ok, key=lambda t: (t["images_per_second"], -t["intra_op"]))
+        torch.set_num_threads(chosen["intra_op"])
+        self.intra_op = torch.get_num_threads()
+        logger.info(f"Thread autotune picked intra-op={self.intra_op}: {self.trials}")
+        return self.intra_op
+
+
+def _timed(run: Callable[[int], None], batch: int) -> float:
+    start = perf_counter()
+    run(batch)
+    return perf_counter() - start
+
+
+thread_tuner = ThreadTuner()
@@ -1,17 +1,16 @@
 from __future__ import annotations
 
 import atexit
+import concurrent.futures as cf
 import socket
-from typing import Optional
 
 from loguru import logger
-from opentelemetry import trace
-from opentelemetry.exporter.jaeger.thrift import JaegerExporter
-from opentelemetry.sdk.resources import Resource, SERVICE_NAME
-from opentelemetry.sdk.trace import TracerProvider as SDKTracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry import metrics, trace
 
-from app.config import SERVICE_NAME_STR, JAEGER_HOST, JAEGER_PORT, TRACING_MODE
+from app.config import SERVICE_NAME_STR, JAEGER_HOST, JAEGER_PORT, TRACING_MODE, TRACING_RESOLVE_TIMEOUT
+
+# SDK/exporter (nặng) chỉ import trong các hàm setup_*, gọi ở startup hook của app.
+# Tracer/meter lấy qua API trước đó là proxy, tự gắn vào provider thật khi setup xong.
 
 
 def _should_enable_tracing() -> bool:
@@ -19,15 +18,23 @@ def _should_enable_tracing() -> bool:
         return False
     if TRACING_MODE == "on":
         return True
+    # auto: chỉ bật nếu resolve được Jaeger, chờ tối đa TRACING_RESOLVE_TIMEOUT để không chậm startup.
+    # Không dùng `with`: thoát `with` sẽ shutdown(wait=True) và vẫn chờ getaddrinfo chạy xong.
+    ex = cf.ThreadPoolExecutor(max_workers=1, thread_name_prefix="jaeger-resolve")
     try:
-        socket.getaddrinfo(JAEGER_HOST, JAEGER_PORT)
+        ex.submit(socket.getaddrinfo, JAEGER_HOST, JAEGER_PORT).result(timeout=TRACING_RESOLVE_TIMEOUT)
         return True
-    except socket.gaierror:
+    except (socket.gaierror, cf.TimeoutError):
         return False
+    finally:
+        ex.shutdown(wait=False)
 
 
 def setup_tracing() -> trace.Tracer:
     """Setup Jaeger tracer if resolvable/enabled."""
+    from opentelemetry.sdk.resources import Resource, SERVICE_NAME
+    from opentelemetry.sdk.trace import TracerProvider as SDKTracerProvider
+
     resource = Resource.create({SERVICE_NAME: SERVICE_NAME_STR})
     provider = trace.get_tracer_provider()
     if not isinstance(provider, SDKTracerProvider):
@@ -36,6 +43,9 @@ def setup_tracing() -> trace.Tracer:
 
     if _should_enable_tracing():
         try:
+            from opentelemetry.exporter.jaeger.thrift import JaegerExporter
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
             exporter = JaegerExporter(agent_host_name=JAEGER_HOST, agent_port=JAEGER_PORT)
             span_processor = BatchSpanProcessor(exporter)
             provider.add_span_processor(span_processor)
@@ -47,3 +57,21 @@ def setup_tracing() -> trace.Tracer:
         logger.info("Tracing disabled (TRACING=off or host not resolvable).")
 
     return trace.get_tracer_provider().get_tracer("inference", "0.1.0")
+
+
+def setup_metrics() -> None:
+    """MeterProvider SDK + Prometheus reader (1 lần / process)."""
+    from opentelemetry.exporter.prometheus import PrometheusMetricReader
+    from opentelemetry.sdk.metrics import MeterProvider as SDKMeterProvider
+    from opentelemetry.sdk.resources import Resource, SERVICE_NAME
+
+    if isinstance(metrics.get_meter_provider(), SDKMeterProvider):
+        return
+    resource = Resource(attributes={SERVICE_NAME: SERVICE_NAME_STR})
+    metrics.set_meter_provider(SDKMeterProvider(resource=resource, metric_readers=[PrometheusMetricReader()]))
+
+
+def setup_telemetry() -> None:
+    """Startup hook: bật metrics + tracing (trước đây chạy lúc import app.services.inference)."""
+    setup_metrics()
+    setup_tracing()
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from opentelemetry import metrics
+
+from app.config import (
+    TRACK_CONF_DECAY,
+    TRACK_IOU_MATCH,
+    TRACK_KEYFRAME_INTERVAL,
+    TRACK_MIN_CONF,
+    TRACK_SCENE_THRESHOLD,
+)
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+keyframe_counter = meter.create_counter(
+    name="tracker_keyframes_total",
+    description="Frames where the detector ran in keyframe+tracker mode",
+)
+saved_counter = meter.create_counter(
+    name="tracker_invocations_saved_total",
+    description="Detector invocations avoided by propagating tracks",
+)
+
+# Kalman vận tốc không đổi trên [cx, cy, w, h, vx, vy, vw, vh], bước = 1 frame đã lấy mẫu
+_F = np.eye(8)
+_F[:4, 4:] = np.eye(4)
+_H = np.eye(4, 8)
+_Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.5, 0.5, 0.5, 0.5])
+_R = np.diag([4.0, 4.0, 8.0, 8.0])
+
+
+def _xyxy_to_z(b) -> np.ndarray:
+    x1, y1, x2, y2 = b
+    return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=float)
+
+
+def _z_to_xyxy(z: np.ndarray) -> List[float]:
+    cx, cy, w, h = z[:4]
+    w, h = max(w, 1.0), max(h, 1.0)
+    return [float(cx - w / 2), float(cy - h / 2), float(cx + w / 2), float(cy + h / 2)]
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU giữa 2 tập box xyxy (N,4) x (M,4)."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+@dataclass
+class Track:
+    track_id: int
+    class_id: int
+    class_name: str
+    confidence: float
+    x: np.ndarray  # state 8 chiều
+    P: np.ndarray = field(default_factory=lambda: np.diag([10.0] * 4 + [100.0] * 4))
+
+    def predict(self) -> None:
+        self.x = _F @ self.x
+        self.P = _F @ self.P @ _F.T + _Q
+
+    def correct(self, box) -> None:
+        y = _xyxy_to_z(box) - _H @ self.x
+        S = _H @ self.P @ _H.T + _R
+        K = self.P @ _H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(8) - K @ _H) @ self.P
+
+    def box(self) -> List[float]:
+        return _z_to_xyxy(self.x)
+
+
+class KeyframeTracker:
+    """
+    Chỉ chạy detector ở keyframe, các frame giữa 2 keyframe thì dự đoán box bằng Kalman.
+    Keyframe khi: frame đầu, đủ `interval` frame, đổi cảnh (thumbnail khác nhiều), hoặc độ tin cậy track đã giảm
+    dưới `min_conf` (mỗi frame propagate nhân `decay`). Ở keyframe, detection mới được ghép với track cũ theo IoU
+    (cùng class) để giữ track_id và vận tốc; track không ghép được bị bỏ (detector là chuẩn).
+    """
+
+    def __init__(
+        self,
+        interval: int = TRACK_KEYFRAME_INTERVAL,
+        scene_threshold: float = TRACK_SCENE_THRESHOLD,
+        min_conf: float = TRACK_MIN_CONF,
+        decay: float = TRACK_CONF_DECAY,
+        iou_match: float = TRACK_IOU_MATCH,
+    ):
+        self.interval = max(1, int(interval))
+        self.scene_threshold = scene_threshold
+        self.min_conf = min_conf
+        self.decay = decay
+        self.iou_match = iou_match
+        self.tracks: List[Track] = []
+        self._next_id = 1
+        self._since_key: Optional[int] = None
+        self._key_thumb: Optional[np.ndarray] = None
+        self.frames = 0
+        self.keyframes = 0
+
+    @property
+    def saved(self) -> int:
+        return self.frames - self.keyframes
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "model_invocations": self.keyframes,
+            "invocations_saved": self.saved,
+        }
+
+    # ----- quyết định keyframe -----
+    @staticmethod
+    def _thumb(im_bgr: np.ndarray) -> np.ndarray:
+        small = cv2.resize(im_bgr, (32, 32), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+    def _scene_changed(self, thumb: np.ndarray) -> bool:
+        if self._key_thumb is None or not self.scene_threshold:
+            return False
+        return float(np.abs(thumb - self._key_thumb).mean()) / 255.0 > self.scene_threshold
+
+    def _decayed(self) -> bool:
+        if not self.tracks:
+            return False
+        return float(np.mean([t.confidence for t in self.tracks])) < self.min_conf
+
+    def needs_detection(self, thumb: np.ndarray) -> bool:
+        return (
+            self._since_key is None
+            or self._since_key >= self.interval
+            or self._scene_changed(thumb)
+            or self._decayed()
+        )
+
+    # ----- xử lý 1 frame -----
+    def step(self, im_bgr: np.ndarray, detect: Callable[[], List[dict]]) -> Tuple[List[dict], bool]:
+        """Trả (dets, is_keyframe). `detect()` chỉ được gọi ở keyframe."""
+        self.frames += 1
+        thumb = self._thumb(im_bgr)
+        for t in self.tracks:
+            t.predict()
+
+        if self.needs_detection(thumb):
+            self.keyframes += 1
+            keyframe_counter.add(1)
+            dets = detect()
+            ids = self._associate(dets)
+            self._since_key = 1
+            self._key_thumb = thumb
+            return [{**d, "track_id": tid} for d, tid in zip(dets, ids)], True
+
+        saved_counter.add(1)
+        self._since_key += 1
+        for t in self.tracks:
+            t.confidence *= self.decay
+        return self._propagated(), False
+
+    def _associate(self, dets: List[dict]) -> List[int]:
+        """Cập nhật track theo detection của keyframe, trả track_id theo thứ tự `dets`."""
+        old = self.tracks
+        boxes_old = np.array([t.box() for t in old]).reshape(-1, 4)
+        boxes_new = np.array([d["bbox_xyxy"] for d in dets], dtype=float).reshape(-1, 4)
+        ious = iou_matrix(boxes_old, boxes_new)
+        for i, t in enumerate(old):
+            ious[i, [j for j, d in enumerate(dets) if d["class_id"] != t.class_id]] = 0.0
+
+        matched = {}
+        # Ghép tham lam theo IoU giảm dần
+        for flat in np.argsort(-ious, axis=None):
+            i, j = divmod(int(flat), ious.shape[1])
+            if ious[i, j] < self.iou_match:
+                break
+            if i in matched or j in matched.values():
+                continue
+            matched[i] = j
+
+        new_tracks: List[Track] = []
+        by_det = {j: i for i, j in matched.items()}
+        for j, d in enumerate(dets):
+            if j in by_det:
+                t = old[by_det[j]]
+                t.correct(d["bbox_xyxy"])
+                t.confidence = float(d["confidence"])
+                t.class_name = d["class_name"]
+            else:
+                t = Track(
+                    track_id=self._next_id,
+                    class_id=int(d["class_id"]),
+                    class_name=d["class_name"],
+                    confidence=float(d["confidence"]),
+                    x=np.concatenate([_xyxy_to_z(d["bbox_xyxy"]), np.zeros(4)]),
+                )
+                self._next_id += 1
+            new_tracks.append(t)
+        self.tracks = new_tracks
+        return [t.track_id for t in new_tracks]
+
+    def _propagated(self) -> List[dict]:
+        return [
+            {
+                "class_id": t.class_id,
+                "class_name": t.class_name,
+                "confidence": round(t.confidence, 4),
+                "bbox_xyxy": t.box(),
+                "track_id": t.track_id,
+            }
+            for t in self.tracks
+        ]
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass
+from time import monotonic
+from typing import BinaryIO, List, Optional
+
+import cv2
+from fastapi import HTTPException
+from opentelemetry import metrics
+
+from app.config import ALLOWED_VIDEO_EXT
+from app.services.intake import DecodedImage
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+video_frames = meter.create_counter(
+    name="video_frames_inferred_total",
+    description="Video frames run through the model",
+)
+video_fps_hist = meter.create_histogram(
+    name="video_job_frames_per_second",
+    description="End-to-end inferred frames per second of a video job",
+)
+
+
+def check_video_ext(filename: Optional[str]) -> str:
+    ext = (os.path.splitext(filename or "")[1] or "").lstrip(".").lower()
+    if ext not in ALLOWED_VIDEO_EXT:
+        raise HTTPException(status_code=400, detail=f"Unsupported video type '{ext}'. Allowed: {sorted(ALLOWED_VIDEO_EXT)}")
+    return ext
+
+
+def spool_to_tempfile(src: BinaryIO, ext: str) -> str:
+    """Copy stream upload ra file tạm (OpenCV cần path), theo chunk nên không giữ cả video trong RAM."""
+    fd, path = tempfile.mkstemp(suffix=f".{ext}", prefix="video_")
+    with os.fdopen(fd, "wb") as dst:
+        shutil.copyfileobj(src, dst, length=1 << 20)
+    return path
+
+
+@dataclass
+class Frame:
+    index: int  # số thứ tự frame trong video gốc
+    time_seconds: float
+    image: DecodedImage
+
+
+class FrameReader:
+    """
+    Đọc frame tuần tự từ video, lấy 1 frame mỗi `stride` frame.
+    Frame bị bỏ qua chỉ `grab()` (không decode màu), frame lấy thì `retrieve()` thành mảng BGR dùng thẳng cho model.
+    Chỉ giữ tối đa 1 batch trong RAM -> bộ nhớ không phụ thuộc độ dài video.
+    """
+
+    def __init__(self, path: str, stride: int = 1, max_frames: int = 0):
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise HTTPException(status_code=400, detail="Cannot decode video.")
+        self.stride = max(1, int(stride))
+        self.max_frames = max(0, int(max_frames))
+        self.fps = float(self.cap.get(cv2.CAP_PROP_FPS) or 0.0)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0)
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0)
+        self.position = 0  # frame kế tiếp sẽ grab
+        self.emitted = 0
+        self.decode_seconds = 0.0
+        self._eof = False
+        self._lock = threading.Lock()
+
+    def meta(self) -> dict:
+        return {
+            "fps": self.fps,
+            "frame_count": self.frame_count,
+            "width": self.width,
+            "height": self.height,
+            "stride": self.stride,
+        }
+
+    def read_batch(self, size: int) -> List[Frame]:
+        out: List[Frame] = []
+        with self._lock:
+            start = monotonic()
+            while len(out) < size and not self._eof:
+                if self.max_frames and self.emitted >= self.max_frames:
+                    self._eof = True
+                    break
+                if not self.cap.grab():
+                    self._eof = True
+                    break
+                idx = self.position
+                self.position += 1
+                if idx % self.stride:
+                    continue
+                ok, frame = self.cap.retrieve()
+                if not ok:
+                    self._eof = True
+                    break
+                h, w = frame.shape[:2]
+                t = idx / self.fps if self.fps else 0.0
+                out.append(Frame(idx, t, DecodedImage(frame, w, h)))
+                self.emitted += 1
+            self.decode_seconds += monotonic() - start
+        return out
+
+    def close(self) -> None:
+        with self._lock:
+            self.cap.release()
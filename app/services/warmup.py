@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import threading
+from time import monotonic
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+from opentelemetry import metrics
+
+from app.config import (
+    IMG_SIZE,
+    MODEL_POOL_MAX_MODELS,
+    PRELOAD_MODELS,
+    PRELOAD_ON_STARTUP,
+    WARMUP_BATCH_SIZES,
+    WARMUP_RUNS,
+    WARMUP_SHAPES,
+)
+from app.services.inference import infer_batch, input_shape, load_model, model_pool, run_model
+from app.services.intake import DecodedImage
+from app.services.registry import model_registry
+from app.services.threads import thread_tuner
+
+# ===== Metrics (OTel) =====
+meter = metrics.get_meter("inference", "0.1.0")
+warmup_hist = meter.create_histogram(
+    name="model_warmup_seconds",
+    description="Time to load and warm up a model at startup",
+    unit="s",
+)
+
+
+class Readiness:
+    """
+    Trạng thái sẵn sàng phục vụ của process: starting -> loading -> ready | failed.
+    Chỉ `ready` sau khi mọi model preload đã load + chạy warmup (lần predict đầu không còn trả giá khởi tạo).
+    """
+
+    def __init__(self):
+        self.status = "starting"
+        self.error: Optional[str] = None
+        self.models: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {"status": self.status, "error": self.error, "models": {k: dict(v) for k, v in self.models.items()}}
+
+    def _set_model(self, name: str, **info) -> None:
+        with self._lock:
+            self.models.setdefault(name, {}).update(info)
+
+
+readiness = Readiness()
+
+
+def warmup_model(
+    name: str,
+    shapes: Optional[Sequence[Tuple[int, int]]] = None,
+    batch_sizes: Optional[Sequence[int]] = None,
+    runs: Optional[int] = None,
+) -> str:
+    """Load model vào pool rồi predict ảnh đen ở từng shape/batch size (bỏ qua cache + batch scheduler)."""
+    shapes = WARMUP_SHAPES if shapes is None else shapes
+    batch_sizes = WARMUP_BATCH_SIZES if batch_sizes is None else batch_sizes
+    runs = WARMUP_RUNS if runs is None else runs
+    name = load_model(name)
+    for h, w in shapes:
+        image = DecodedImage(np.zeros((h, w, 3), dtype=np.uint8), w, h)
+        for bs in batch_sizes:
+            for _ in range(max(1, runs)):
+                infer_batch([image] * max(1, bs), name)
+    return name
+
+
+def _runner(name: str):
+    """`run(batch_size)` cho autotune thread: predict ảnh đen shape warmup đầu tiên."""
+    h, w = WARMUP_SHAPES[0] if WARMUP_SHAPES else (IMG_SIZE, IMG_SIZE)
+    image = DecodedImage(np.zeros((h, w, 3), dtype=np.uint8), w, h)
+    return lambda batch: infer_batch([image] * batch, name)
+
+
+def preload_and_warmup(
+    models: Optional[List[str]] = None, state: Readiness = readiness, tune_threads: bool = True
+) -> bool:
+    """
+    Chạy 1 lần lúc start (thread nền, hoặc ở master trước khi fork với tune_threads=False).
+    Trả True nếu mọi model đã sẵn sàng.
+    """
+    models = list(models if models is not None else PRELOAD_MODELS)
+    if len(models) > MODEL_POOL_MAX_MODELS:
+        logger.warning(
+            f"PRELOAD_MODELS has {len(models)} models but MODEL_POOL_MAX_MODELS={MODEL_POOL_MAX_MODELS}; "
+            f"only the first {MODEL_POOL_MAX_MODELS} stay resident"
+        )
+        models = models[:MODEL_POOL_MAX_MODELS]
+
+    state.status = "loading"
+    if tune_threads:
+        thread_tuner.apply_budget()
+    for i, name in enumerate(models):
+        state._set_model(name, status="loading")
+        start = monotonic()
+        try:
+            warmup_model(name)
+            if i == 0 and tune_threads:
+                thread_tuner.autotune(_runner(name))
+        except Exception as e:
+            logger.exception(f"Warmup failed for model '{name}'")
+            state._set_model(name, status="failed", error=str(e))
+            state.error = f"{name}: {e}"
+            state.status = "failed"
+            return False
+        seconds = monotonic() - start
+        warmup_hist.record(seconds, {"model": name})
+        state._set_model(name, status="ready", warmup_seconds=round(seconds, 3))
+        logger.info(f"Model '{name}' loaded and warmed up in {seconds:.2f}s")
+
+    state.status = "ready"
+    return True
+
+
+def start_warmup() -> Optional[threading.Thread]:
+    """Hook startup: preload + warmup ở thread nền để /healthz (liveness) vẫn trả lời trong lúc load."""
+    if readiness.ready or not PRELOAD_ON_STARTUP:
+        # đã preload ở master (app.serve) hoặc load lazy ở request đầu như trước: chỉ giới hạn thread theo CPU quota
+        thread_tuner.apply_budget()
+        readiness.status = "ready"
+        return None
+    t = threading.Thread(target=preload_and_warmup, name="model-warmup", daemon=True)
+    t.start()
+    return t
+
+
+# ===== Hot-reload (model_registry theo dõi MODELS_DIR) =====
+def warm_instance(model) -> None:
+    """Warmup 1 model object chưa nằm trong pool (bản mới trước khi swap), cùng shape/batch như lúc start."""
+    for h, w in WARMUP_SHAPES or [(IMG_SIZE, IMG_SIZE)]:
+        image = DecodedImage(np.zeros((h, w, 3), dtype=np.uint8), w, h)
+        for bs in WARMUP_BATCH_SIZES:
+            for _ in range(max(1, WARMUP_RUNS)):
+                run_model(model, [image.array] * max(1, bs), input_shape(image))
+
+
+def hot_reload(event: str, name: str) -> None:
+    """
+    Handler của watcher: file sửa + model đang resident -> load + warmup bản mới ở nền rồi swap;
+    chưa resident thì lần load sau tự đọc file mới. Xoá -> bỏ khỏi pool khi rảnh.
+    """
+    if event == "removed":
+        model_pool.evict(name)
+        return
+    if event != "changed" or not model_pool.is_resident(name):
+        return
+    old = next((m["version"] for m in model_pool.stats()["models"] if m["name"] == name), None)
+    new = model_registry.version(name)
+    if new == old:
+        return  # chỉ đổi mtime (touch/copy lại cùng file), nội dung y hệt
+    start = monotonic()
+    try:
+        model_pool.reload(name, prepare=warm_instance)
+    except Exception as e:
+        logger.exception(f"Hot-reload of '{name}' failed, keeping version {old}")
+        model_registry.record_swap(name, old, new, monotonic() - start, error=str(e))
+        return
+    model_registry.record_swap(name, old, new, monotonic() - start)
+
+
+def start_model_watcher() -> Optional[threading.Thread]:
+    """Hook startup: theo dõi MODELS_DIR (MODEL_WATCH_INTERVAL giây/lần, 0 = tắt)."""
+    return model_registry.watch(hot_reload)
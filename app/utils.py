@@ -2,17 +2,79 @@
 import datetime
 import mimetypes
 import os
-from typing import Optional, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from google.cloud import storage
 from google.auth import default as gauth_default
+from opentelemetry import metrics
+from requests.adapters import HTTPAdapter
 
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "")
+GCS_POOL_SIZE = int(os.getenv("GCS_POOL_SIZE", "32"))  # số connection HTTP giữ sẵn tới GCS
+GCS_MAX_WORKERS = int(os.getenv("GCS_MAX_WORKERS", "16"))  # số upload/download song song của *_many
+
+meter = metrics.get_meter("inference", "0.1.0")
+gcs_op_hist = meter.create_histogram(
+    name="gcs_operation_seconds",
+    description="Latency of individual GCS operations",
+    unit="s",
+)
+
+_client: Optional[storage.Client] = None
+_buckets: Dict[str, storage.Bucket] = {}
+_client_lock = threading.Lock()
+_io_pool: Optional[ThreadPoolExecutor] = None
+
 
 def get_storage_client() -> storage.Client:
-    # Dùng ADC (Application Default Credentials)
-    # Cần mount service account key qua GOOGLE_APPLICATION_CREDENTIALS khi chạy k8s/docker (nếu bucket private)
-    return storage.Client()
+    """
+    Client dùng chung cả process (credential discovery 1 lần, giữ connection keep-alive).
+    Dùng ADC (Application Default Credentials)
+    Cần mount service account key qua GOOGLE_APPLICATION_CREDENTIALS khi chạy k8s/docker (nếu bucket private)
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = storage.Client()
+                # Mặc định requests chỉ giữ 10 connection/host, không đủ cho upload song song
+                adapter = HTTPAdapter(pool_connections=GCS_POOL_SIZE, pool_maxsize=GCS_POOL_SIZE)
+                client._http.mount("https://", adapter)
+                _client = client
+    return _client
+
+
+def get_bucket(bucket_name: str) -> storage.Bucket:
+    bucket = _buckets.get(bucket_name)
+    if bucket is None:
+        bucket = _buckets.setdefault(bucket_name, get_storage_client().bucket(bucket_name))
+    return bucket
+
+
+def _get_io_pool() -> ThreadPoolExecutor:
+    global _io_pool
+    if _io_pool is None:
+        with _client_lock:
+            if _io_pool is None:
+                _io_pool = ThreadPoolExecutor(max_workers=max(1, GCS_MAX_WORKERS), thread_name_prefix="gcs")
+    return _io_pool
+
+
+@contextmanager
+def _timed(op: str):
+    start = monotonic()
+    ok = "true"
+    try:
+        yield
+    except BaseException:
+        ok = "false"
+        raise
+    finally:
+        gcs_op_hist.record(monotonic() - start, {"op": op, "ok": ok})
 
 def parse_gcs_input(s: str) -> Tuple[str, str]:
     """
@@ -46,10 +108,25 @@ def parse_gcs_input(s: str) -> Tuple[str, str]:
     return (GCS_BUCKET_NAME, s.lstrip("/"))
 
 def download_bytes(bucket_name: str, blob_path: str) -> bytes:
-    client = get_storage_client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(blob_path)
-    return blob.download_as_bytes()
+    blob = get_bucket(bucket_name).blob(blob_path)
+    with _timed("download"):
+        return blob.download_as_bytes()
+
+def download_to_file(bucket_name: str, blob_path: str, dest_path: str) -> None:
+    """Download object lớn (video) thẳng ra file, không giữ trong RAM."""
+    blob = get_bucket(bucket_name).blob(blob_path)
+    with _timed("download"):
+        blob.download_to_filename(dest_path)
+
+
+def list_blob_names(bucket_name: str, prefix: str = "", suffixes: Optional[Tuple[str, ...]] = None) -> List[str]:
+    """Liệt kê tên object dưới prefix (lọc theo đuôi file nếu có)."""
+    with _timed("list"):
+        names = [b.name for b in get_storage_client().list_blobs(bucket_name, prefix=prefix or None)]
+    if suffixes:
+        names = [n for n in names if n.lower().endswith(suffixes)]
+    return names
+
 
 def upload_bytes(
     data: bytes,
@@ -65,12 +142,11 @@ def upload_bytes(
         "public_url": "https://storage.googleapis.com/bucket/path",  # nếu bucket public
         "signed_url": "...",  # nếu có thể ký
     }"""
-    client = get_storage_client()
-    bucket = client.bucket(GCS_BUCKET_NAME)
-    blob = bucket.blob(blob_path)
+    blob = get_bucket(GCS_BUCKET_NAME).blob(blob_path)
     if not content_type:
         content_type = mimetypes.guess_type(blob_path)[0] or "application/octet-stream"
-    blob.upload_from_string(data, content_type=content_type)
+    with _timed("upload"):
+        blob.upload_from_string(data, content_type=content_type)
 
     out = {
         "bucket": GCS_BUCKET_NAME,
@@ -80,13 +156,45 @@ def upload_bytes(
         "signed_url": None,
     }
     try:
-        out["signed_url"] = blob.generate_signed_url(
-            version="v4",
-            expiration=datetime.timedelta(hours=signed_url_hours),
-            method="GET",
-            response_disposition=f'inline; filename="{os.path.basename(blob_path)}"',
-        )
+        with _timed("sign"):
+            out["signed_url"] = blob.generate_signed_url(
+                version="v4",
+                expiration=datetime.timedelta(hours=signed_url_hours),
+                method="GET",
+                response_disposition=f'inline; filename="{os.path.basename(blob_path)}"',
+            )
     except Exception:
         # Không có quyền ký hoặc ADC không phải key file => bỏ qua
         pass
     return out
+
+
+def upload_many(
+    items: Sequence[Tuple[bytes, str, Optional[str]]],
+    signed_url_hours: int = 24,
+) -> List[object]:
+    """
+    Upload song song nhiều (data, blob_path, content_type) qua pool dùng chung.
+    Trả list cùng thứ tự: meta như `upload_bytes`, hoặc Exception của item lỗi.
+    """
+    if len(items) <= 1:
+        return [_capture(upload_bytes, d, p, c, signed_url_hours) for d, p, c in items]
+    pool = _get_io_pool()
+    futs = [pool.submit(_capture, upload_bytes, d, p, c, signed_url_hours) for d, p, c in items]
+    return [f.result() for f in futs]
+
+
+def download_many(refs: Sequence[Tuple[str, str]]) -> List[object]:
+    """Download song song nhiều (bucket, blob_path); trả bytes hoặc Exception theo thứ tự."""
+    if len(refs) <= 1:
+        return [_capture(download_bytes, b, p) for b, p in refs]
+    pool = _get_io_pool()
+    futs = [pool.submit(_capture, download_bytes, b, p) for b, p in refs]
+    return [f.result() for f in futs]
+
+
+def _capture(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        return e
@@ -0,0 +1,77 @@
+"""
+Đo thời gian import (cold, mỗi lần 1 interpreter mới) của các module chính và kiểm tra
+không module nặng nào (torch, ultralytics, OTel SDK/exporter) bị kéo vào lúc import.
+
+  python -m benchmarks.import_time                       # bảng median/max cho app.config, app.services.inference, app.main
+  python -m benchmarks.import_time app.main --runs 10 --budget 1.5   # exit 1 nếu vượt budget hoặc có module nặng
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_MODULES = ["app.config", "app.services.inference", "app.main"]
+# Chỉ được load khi cần thật (load model / startup hook), không phải lúc import
+HEAVY_MODULES = [
+    "torch",
+    "ultralytics",
+    "onnxruntime",
+    "opentelemetry.sdk",
+    "opentelemetry.exporter.jaeger",
+    "opentelemetry.exporter.prometheus",
+]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def import_report(module: str) -> dict:
+    """Import `module` trong 1 interpreter mới, trả {"seconds", "heavy"}."""
+    env = {**os.environ, "YOLO_CONFIG_DIR": os.environ.get("YOLO_CONFIG_DIR", "/tmp")}
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Cold import time + heavy-import guard")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=0.0, help="max median seconds per module, 0 = no budget")
+    args = parser.parse_args(argv)
+
+    failed = False
+    print("module | median_s | max_s | heavy imports")
+    print("--- | --- | --- | ---")
+    for module in args.modules:
+        reports = [import_report(module) for _ in range(max(1, args.runs))]
+        times = [r["seconds"] for r in reports]
+        heavy = sorted({m for r in reports for m in r["heavy"]})
+        median = statistics.median(times)
+        print(f"{module} | {median:.3f} | {max(times):.3f} | {', '.join(heavy) or '-'}")
+        if heavy or (args.budget and median > args.budget):
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,111 @@
+"""
+So sánh load model kiểu cũ (torch: YOLO(.pt), copy toàn bộ weights vào RAM riêng của process) với
+mmap (MMAP_DIR/<stem>.pt đã convert sẵn, torch.load(mmap=True)).
+
+Mỗi backend chạy --procs process song song (interpreter mới). Mỗi process đo:
+  - load_s: thời gian load model (đã import torch/ultralytics trước, không tính)
+  - anon_mb: bộ nhớ anonymous (Private_Dirty) tăng thêm sau load + 1 lần predict -> phần không chia sẻ được
+  - rss_mb / pss_mb: tăng thêm sau load + predict; pss chia trang file-backed (page cache) cho các process đang map
+
+  python -m benchmarks.mmap_loading --model yolov8n --procs 3
+  python -m benchmarks.mmap_loading --model yolo12m --procs 2 --csv mmap.csv
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from app.services.memory import smaps_rollup
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_PROBE = """
+import json, sys, time
+from pathlib import Path
+import numpy as np
+import ultralytics, torch
+from app.services.backends import BACKENDS
+from app.services.memory import smaps_rollup
+
+backend = BACKENDS[{backend!r}]
+weights = Path({weights!r})
+if hasattr(backend, "export"):
+    backend.export(weights)  # convert/export không tính vào thời gian load
+before = smaps_rollup()
+start = time.perf_counter()
+model = backend.load(weights)
+load_s = time.perf_counter() - start
+model.predict(np.zeros(({imgsz}, {imgsz}, 3), dtype=np.uint8), verbose=False)
+print("RESULT " + json.dumps({{"load_s": load_s, "before": before}}), flush=True)
+sys.stdin.read()  # giữ process sống tới khi driver đo xong tất cả
+"""
+
+
+def _result(proc: subprocess.Popen) -> dict:
+    for line in proc.stdout:  # ultralytics có thể in log ra stdout
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"Probe process {proc.pid} exited without result")
+
+
+def run(backend: str, weights: Path, procs: int, imgsz: int) -> dict:
+    code = _PROBE.format(backend=backend, weights=str(weights), imgsz=imgsz)
+    children = [
+        subprocess.Popen([sys.executable, "-c", code], cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(procs)
+    ]
+    try:
+        results = [_result(p) for p in children]
+        after = [smaps_rollup(p.pid) for p in children]  # đo khi mọi process còn map weights
+    finally:
+        for p in children:
+            p.stdin.close()
+            p.wait()
+
+    def delta(key: str) -> float:
+        return statistics.median((a[key] - r["before"][key]) / 2**20 for a, r in zip(after, results))
+
+    return {
+        "backend": backend,
+        "procs": procs,
+        "load_s": round(statistics.median(r["load_s"] for r in results), 3),
+        "anon_mb": round(delta("Private_Dirty"), 1),
+        "rss_mb": round(delta("Rss"), 1),
+        "pss_mb": round(delta("Pss"), 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from app.config import AVAILABLE_MODELS, DEFAULT_MODEL_NAME, IMG_SIZE
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME, choices=sorted(AVAILABLE_MODELS))
+    parser.add_argument("--procs", type=int, default=2)
+    parser.add_argument("--imgsz", type=int, default=IMG_SIZE)
+    parser.add_argument("--csv", type=Path, default=None)
+    args = parser.parse_args(argv)
+
+    weights = AVAILABLE_MODELS[args.model]
+    rows = [run(b, weights, max(1, args.procs), args.imgsz) for b in ("torch", "mmap")]
+
+    print(f"{args.model} ({weights.stat().st_size / 2**20:.1f} MB .pt), {args.procs} process(es), median per process:")
+    print(f"{'backend':<8} {'load s':>8} {'anon MB':>8} {'rss MB':>8} {'pss MB':>8}")
+    for r in rows:
+        print(f"{r['backend']:<8} {r['load_s']:>8.3f} {r['anon_mb']:>8.1f} {r['rss_mb']:>8.1f} {r['pss_mb']:>8.1f}")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
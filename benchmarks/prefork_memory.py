@@ -0,0 +1,105 @@
+"""
+So sánh RAM thật (tổng Pss) khi chạy N worker:
+  - uvicorn --workers N : mỗi worker tự import + load + warmup model
+  - python -m app.serve : master load 1 lần, fork N worker dùng chung weights (copy-on-write)
+
+  python -m benchmarks.prefork_memory --workers 3
+  python -m benchmarks.prefork_memory --workers 2 4 --csv prefork.csv
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import List, Optional
+
+from app.services.memory import children, memory_report
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _wait_ready(port: int, workers: int, timeout: float) -> None:
+    """Chờ /readyz 200 liên tiếp đủ số worker (mỗi request có thể rơi vào worker khác nhau)."""
+    deadline = time.monotonic() + timeout
+    ok = 0
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=2) as r:
+                ok = ok + 1 if r.status == 200 else 0
+        except OSError:
+            ok = 0
+        if ok >= workers * 3:
+            return
+        time.sleep(0.5)
+    raise TimeoutError(f"Server on :{port} not ready after {timeout}s")
+
+
+def _tree(pid: int) -> List[int]:
+    out = [pid]
+    for child in children(pid):
+        out += _tree(child)
+    return out
+
+
+def measure(mode: str, workers: int, port: int, timeout: float) -> dict:
+    if mode == "prefork":
+        cmd = [sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(port), "--metrics-port", "0"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers)]
+    env = {**os.environ, "PRELOAD_ON_STARTUP": "true", "PREFORK_REPORT_AFTER": "0", "WEB_CONCURRENCY": str(workers)}
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_ready(port, workers, timeout)
+        time.sleep(1.0)
+        report = memory_report({str(pid): pid for pid in _tree(proc.pid)})
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return {
+        "mode": mode,
+        "workers": workers,
+        "processes": len(report["processes"]),
+        "sum_rss_mb": round(report["sum_rss_bytes"] / 2**20, 1),
+        "sum_pss_mb": round(report["sum_pss_bytes"] / 2**20, 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2])
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--timeout", type=float, default=180.0)
+    parser.add_argument("--csv", type=Path, default=None)
+    args = parser.parse_args(argv)
+
+    rows = []
+    for n in args.workers:
+        for mode in ("uvicorn", "prefork"):
+            rows.append(measure(mode, n, args.port, args.timeout))
+            print(rows[-1], flush=True)
+
+    print(f"\n{'workers':>7} {'uvicorn pss MB':>15} {'prefork pss MB':>15} {'saved':>7}")
+    for n in args.workers:
+        base, fork = (next(r for r in rows if r["workers"] == n and r["mode"] == m) for m in ("uvicorn", "prefork"))
+        saved = 1 - fork["sum_pss_mb"] / base["sum_pss_mb"] if base["sum_pss_mb"] else 0.0
+        print(f"{n:>7} {base['sum_pss_mb']:>15.1f} {fork['sum_pss_mb']:>15.1f} {saved:>6.0%}")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
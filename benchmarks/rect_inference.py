@@ -0,0 +1,135 @@
+"""
+So sánh letterbox vuông (IMG_SIZE x IMG_SIZE) với input chữ nhật theo tỉ lệ ảnh (INFER_RECT=true).
+
+Đo trên cùng model/ảnh: số pixel đưa vào model mỗi ảnh, phần trăm padding, latency mỗi batch và số detection.
+Mặc định resize ảnh test về 1622x626 (kích thước frame gốc trong train_progress/data/generate_tfrecord.py).
+
+  python -m benchmarks.rect_inference --model app/models/yolov8n.pt --batch 1 8 --runs 20
+  python -m benchmarks.rect_inference tests/test_image.jpeg --resize none --csv results/rect.csv
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import statistics
+import sys
+from pathlib import Path
+from time import perf_counter
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+from app.config import AVAILABLE_MODELS, CONF, DEFAULT_MODEL_NAME, IMG_SIZE, IOU, MODEL_STRIDE, get_device
+from app.services.inference import rect_shape
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_IMAGES = [str(ROOT / "tests" / "test_image.jpeg")]
+
+
+def load_images(patterns: List[str], resize: Optional[Tuple[int, int]]) -> List[np.ndarray]:
+    paths = sorted({p for pat in patterns for p in glob.glob(pat)})
+    images = []
+    for p in paths:
+        im = cv2.imread(p)
+        if im is None:
+            print(f"skip unreadable {p}", file=sys.stderr)
+            continue
+        if resize:
+            im = cv2.resize(im, resize, interpolation=cv2.INTER_LINEAR)
+        images.append(im)
+    if not images:
+        raise SystemExit(f"No images matched {patterns}")
+    return images
+
+
+def shape_for(mode: str, im: np.ndarray) -> Tuple[int, int]:
+    if mode == "square":
+        return IMG_SIZE, IMG_SIZE
+    h, w = im.shape[:2]
+    return rect_shape(w, h, IMG_SIZE, MODEL_STRIDE)
+
+
+def predict(model: YOLO, batch: List[np.ndarray], mode: str):
+    if mode == "square":
+        # rect=False: tắt auto-letterbox tối thiểu của ultralytics -> đúng letterbox vuông
+        return model.predict(batch, imgsz=IMG_SIZE, rect=False, conf=CONF, iou=IOU, device=get_device(), verbose=False)
+    return model.predict(batch, imgsz=list(shape_for(mode, batch[0])), conf=CONF, iou=IOU, device=get_device(), verbose=False)
+
+
+def bench(model: YOLO, images: List[np.ndarray], mode: str, batch_size: int, runs: int, warmup: int) -> dict:
+    # Mỗi batch lặp ảnh cho đủ batch_size, ảnh cùng kích thước (giống batch đã gom theo shape)
+    batches = [[images[(i + j) % len(images)] for j in range(batch_size)] for i in range(len(images))]
+    for b in batches[:1] * warmup:
+        predict(model, b, mode)
+
+    latencies, dets = [], 0
+    for r in range(runs):
+        b = batches[r % len(batches)]
+        start = perf_counter()
+        results = predict(model, b, mode)
+        latencies.append(perf_counter() - start)
+        dets += sum(len(res.boxes) for res in results)
+
+    shapes = [shape_for(mode, im) for im in images]
+    pixels = statistics.mean(h * w for h, w in shapes)
+    content = statistics.mean(
+        (im.shape[0] * im.shape[1]) * (min(sh[0] / im.shape[0], sh[1] / im.shape[1]) ** 2) for im, sh in zip(images, shapes)
+    )
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    return {
+        "mode": mode,
+        "batch": batch_size,
+        "input_shape": "/".join(sorted({f"{h}x{w}" for h, w in shapes})),
+        "pixels_per_image": int(pixels),
+        "padding_pct": round(100 * (1 - content / pixels), 1),
+        "latency_ms_p50": round(p50 * 1000, 2),
+        "latency_ms_p95": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000, 2),
+        "images_per_second": round(batch_size / p50, 2),
+        "detections_per_image": round(dets / (runs * batch_size), 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Square letterbox vs rectangular inference benchmark")
+    parser.add_argument("images", nargs="*", default=DEFAULT_IMAGES, help="image paths or globs")
+    parser.add_argument("--model", default=None, help="weights path (default: DEFAULT_MODEL in app/models)")
+    parser.add_argument("--resize", default="1622x626", help="WxH to resize inputs to, or 'none'")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--csv", default=None, help="write rows to this CSV file")
+    args = parser.parse_args(argv)
+
+    resize = None if args.resize == "none" else tuple(int(v) for v in args.resize.lower().split("x"))
+    images = load_images(args.images, resize)
+    model = YOLO(args.model or str(AVAILABLE_MODELS[DEFAULT_MODEL_NAME]))
+
+    rows = [bench(model, images, mode, bs, args.runs, args.warmup) for bs in args.batch for mode in ("square", "rect")]
+
+    cols = list(rows[0])
+    print(" | ".join(cols))
+    print(" | ".join("---" for _ in cols))
+    for row in rows:
+        print(" | ".join(str(row[c]) for c in cols))
+    for bs in args.batch:
+        sq, rc = (next(r for r in rows if r["batch"] == bs and r["mode"] == m) for m in ("square", "rect"))
+        print(
+            f"batch {bs}: rect uses {rc['pixels_per_image'] / sq['pixels_per_image']:.0%} of the pixels, "
+            f"p50 latency x{sq['latency_ms_p50'] / rc['latency_ms_p50']:.2f} faster"
+        )
+
+    if args.csv:
+        Path(args.csv).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=cols)
+            writer.writeheader()
+            writer.writerows(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
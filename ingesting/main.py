@@ -21,6 +21,7 @@ from ingesting.config import (
 from ingesting.services.tracing import setup_tracing
 from ingesting.routers.health import router as health_router
 from ingesting.routers.images import router as images_router
+from ingesting.services.uploader import get_bucket
 
 # OpenTelemetry metrics (OTel SDK)
 from opentelemetry import metrics
@@ -48,6 +49,18 @@ app = FastAPI(
 app.include_router(health_router)
 app.include_router(images_router)
 
+
+
+def _connect_gcs():
+    """Startup hook: mở kết nối GCS sớm (trước đây chạy lúc import uploader), lỗi thì để request đầu thử lại."""
+    try:
+        get_bucket()
+    except Exception as e:
+        logger.warning(f"GCS bucket init failed at startup, will retry on first upload: {e}")
+
+
+app.add_event_handler("startup", _connect_gcs)
+
 # Tracing (nhanh, có timeout 200ms)
 tracer = setup_tracing(SERVICE_NAME, JAEGER_HOST, JAEGER_PORT, ENABLE_TRACING)
 
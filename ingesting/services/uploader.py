@@ -1,5 +1,6 @@
 from __future__ import annotations
 import datetime
+import threading
 import uuid
 from io import BytesIO
 from time import time
@@ -19,9 +20,19 @@ from ingesting.config import (
 )
 from ingesting.utils import get_storage_client  # giữ util của bạn
 
-# GCS bucket (init 1 lần)
-_storage_client = get_storage_client()
-_bucket = _storage_client.get_bucket(GCS_BUCKET_NAME)
+# GCS bucket: init 1 lần ở lần upload đầu (hoặc startup hook), không kết nối GCS lúc import
+_bucket = None
+_bucket_lock = threading.Lock()
+
+
+def get_bucket():
+    global _bucket
+    if _bucket is None:
+        with _bucket_lock:
+            if _bucket is None:
+                _bucket = get_storage_client().get_bucket(GCS_BUCKET_NAME)
+    return _bucket
+
 
 def _validate_image(filename: str, image_bytes: bytes) -> Tuple[str, None]:
     ext = (filename or "").split(".")[-1].lower()
@@ -55,8 +66,8 @@ def upload_single_image(
         gs_uri = f"gs://{GCS_BUCKET_NAME}/{gcs_path}"
 
         with tracer.start_as_current_span("upload-to-gcs", links=[Link(push_span.get_span_context())]):
-            blob = _bucket.blob(gcs_path)
             try:
+                blob = get_bucket().blob(gcs_path)
                 blob.upload_from_string(image_bytes, content_type=content_type or f"image/{ext}")
                 logger.info(f"Uploaded image to GCS: {gcs_path}")
             except Exception as e:
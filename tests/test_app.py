@@ -2,6 +2,9 @@
 import io
 import base64
 from typing import Tuple
+
+import httpx
+import pytest
 from fastapi.testclient import TestClient
 from PIL import Image
 import numpy as np
@@ -19,6 +22,14 @@ def make_png_bytes(w=320, h=240, color=(200, 200, 200)) -> bytes:
     return buf.getvalue()
 
 
+def mock_url_transport(monkeypatch, handler):
+    """Thay transport của url_fetcher (httpx) để không gọi mạng thật."""
+    from app.services.fetcher import url_fetcher
+
+    monkeypatch.setattr(url_fetcher, "_transport", httpx.MockTransport(handler))
+    monkeypatch.setattr(url_fetcher, "_client", None)
+
+
 def stub_infer_pil_return() -> Tuple[int, int, float, list, object]:
     """
     Giá trị giả lập cho infer_pil:
@@ -33,15 +44,16 @@ def test_predict_image_ok(monkeypatch):
     # Patch đúng module nơi endpoint gọi các hàm (giả sử router ở app.routers.predict)
     monkeypatch.setattr("app.routers.predict.resolve_requested_model", lambda req: "mock-model", raising=False)
     monkeypatch.setattr("app.routers.predict.load_model", lambda name: None, raising=False)
-    monkeypatch.setattr("app.routers.predict.current_model_path", lambda: "/models/mock.pt", raising=False)
-    monkeypatch.setattr("app.routers.predict.infer_pil", lambda pil: (320, 240, 0.01, [], object()), raising=False)
+    monkeypatch.setattr("app.routers.predict.current_model_path", lambda name=None: "/models/mock.pt", raising=False)
+    monkeypatch.setattr("app.routers.predict.infer_pil", lambda pil, *a: (320, 240, 0.01, [], object()), raising=False)
     monkeypatch.setattr("app.routers.predict.annotate_image", lambda res0: b"\x89PNG\r\n", raising=False)
     monkeypatch.setattr("app.routers.predict.record_metrics", lambda *a, **k: None, raising=False)
+    monkeypatch.setattr("app.routers.predict.ANNOTATION_MODE", "eager", raising=False)
 
     # Trả về đường dẫn cố định để assertion exact, tránh phụ thuộc timestamp
     monkeypatch.setattr(
         "app.routers.predict.save_prediction_payload",
-        lambda stem, ts, resp, png: (
+        lambda stem, ts, resp, png, model_name=None, **k: (
             {"web_path": f"/static/{stem}.json"},
             {"web_path": f"/static/{stem}.png", "gcs": {"bucket": "bkt", "path": "p.png"}},
             None,
@@ -106,11 +118,8 @@ def test_predict_images_batch(monkeypatch):
 # ---------- /predict/url ----------
 def test_predict_url_ok(monkeypatch):
     # Giả lập tải ảnh từ URL thành công
-    class Resp:
-        status_code = 200
-        content = make_png_bytes()
-
-    monkeypatch.setattr("requests.get", lambda url, timeout=20: Resp())
+    png = make_png_bytes()
+    mock_url_transport(monkeypatch, lambda req: httpx.Response(200, content=png, headers={"content-type": "image/png"}))
     monkeypatch.setattr("app.services.inference.resolve_requested_model", lambda req: "mock-model")
     monkeypatch.setattr("app.services.inference.load_model", lambda name: None)
     monkeypatch.setattr("app.services.inference.infer_pil", lambda pil: stub_infer_pil_return())
@@ -134,11 +143,7 @@ def test_predict_url_ok(monkeypatch):
 
 
 def test_predict_url_download_fail(monkeypatch):
-    class Resp:
-        status_code = 404
-        content = b""
-
-    monkeypatch.setattr("requests.get", lambda url, timeout=20: Resp())
+    mock_url_transport(monkeypatch, lambda req: httpx.Response(404, content=b""))
     monkeypatch.setattr("app.services.inference.resolve_requested_model", lambda req: "mock-model")
     monkeypatch.setattr("app.services.inference.load_model", lambda name: None)
 
@@ -147,3 +152,1032 @@ def test_predict_url_download_fail(monkeypatch):
     assert r.status_code == 400, r.text
 
 
+
+
+# ---------- batching scheduler ----------
+def test_batch_scheduler_groups_concurrent_requests():
+    import threading
+    from app.services.batching import BatchScheduler
+
+    calls = []
+    gate = threading.Event()
+
+    def run_batch(items):
+        gate.wait(1)
+        calls.append(list(items))
+        return [x * 10 for x in items]
+
+    sched = BatchScheduler(run_batch, max_batch_size=4, max_wait_ms=50)
+    futures = [sched.submit(i) for i in range(6)]
+    gate.set()
+    assert [f.result(timeout=5) for f in futures] == [0, 10, 20, 30, 40, 50]
+    assert [len(c) for c in calls] == [4, 2]
+    sched.close(timeout=5)
+
+
+# ---------- inference executor admission ----------
+def test_predict_image_rejected_when_queue_full(monkeypatch):
+    from app.services.executor import inference_executor
+
+    monkeypatch.setattr("app.routers.predict.resolve_requested_model", lambda req: "mock-model", raising=False)
+    monkeypatch.setattr(inference_executor, "_inflight", inference_executor.capacity)
+
+    files = {"file": ("a.png", make_png_bytes(), "image/png")}
+    r = client.post("/predict/image", files=files)
+    assert r.status_code == 503, r.text
+    assert r.headers.get("retry-after") == "1"
+
+
+# ---------- model pool ----------
+def test_model_pool_lru_keeps_models_in_use():
+    from app.services.model_pool import ModelPool
+
+    loads = []
+
+    def loader(name):
+        loads.append(name)
+        return object()
+
+    pool = ModelPool(loader, max_models=2, sizeof=lambda m: 1)
+    pool.get("a")
+    pool.get("b")
+    pool.get("a")  # hit, "a" thành mới dùng nhất
+    with pool.acquire("b"):  # hit
+        pool.get("c")  # vượt giới hạn: evict "a" (LRU rảnh), "b" đang dùng nên giữ
+        assert set(pool.resident()) == {"b", "c"}
+    assert loads == ["a", "b", "c"]
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (2, 3, 1)
+
+
+def test_model_pool_budget_counts_onnx_models_by_artifact_size(tmp_path):
+    from types import SimpleNamespace
+    from app.services.backends import model_bytes
+    from app.services.model_pool import ModelPool
+
+    # YOLO load từ .onnx: model.model là path, không có tensor torch -> tính theo file .onnx + .onnx.data
+    for name in ("a", "b"):
+        (tmp_path / f"{name}.onnx").write_bytes(b"x" * 300)
+        (tmp_path / f"{name}.onnx.data").write_bytes(b"x" * 400)
+    pool = ModelPool(
+        lambda name: SimpleNamespace(model=str(tmp_path / f"{name}.onnx")),
+        max_models=4,
+        mem_budget_bytes=1000,
+        sizeof=model_bytes,
+    )
+    assert pool.get("a").size_bytes == 700
+    pool.get("b")  # 1400 > 1000: evict "a"
+    assert pool.resident() == ["b"]
+    assert pool.stats()["evictions"] == 1
+
+    from app.services.inference import model_pool
+
+    assert model_pool._sizeof is model_bytes  # pool thật dùng sizeof theo backend
+
+
+# ---------- result cache ----------
+def test_result_cache_coalesces_identical_requests(tmp_path):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from app.services.result_cache import ResultCache
+
+    cache = ResultCache(max_entries=2, disk_dir=tmp_path)
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.wait(1)
+        return {"width": 1, "height": 1, "elapsed": 0.5, "detections": []}
+
+    with ThreadPoolExecutor(4) as ex:
+        futs = [ex.submit(cache.get_or_compute, "k", compute) for _ in range(4)]
+        started.set()
+        outs = [f.result(timeout=5) for f in futs]
+
+    assert len(calls) == 1
+    assert sorted(hit for _, hit in outs) == [False, True, True, True]
+
+    # Tier disk vẫn trả được sau khi RAM bị evict
+    cache.store("a", {"elapsed": 0})
+    cache.store("b", {"elapsed": 0})
+    assert cache.lookup("k")["width"] == 1
+
+    # Caller miss lookup() ngay trước khi leader store, vào lock sau khi leader đã rời _inflight: không infer lại
+    for racy in (ResultCache(max_entries=2), ResultCache(max_entries=0, disk_dir=tmp_path / "disk")):
+        calls.clear()
+        racy.get_or_compute("k", compute)
+        racy.lookup = lambda key: None
+        assert racy.get_or_compute("k", compute)[1] is True and len(calls) == 1
+
+
+def test_result_cache_disk_tier_not_served_as_static():
+    from app.config import RESULT_CACHE_DIR, RESULTS_DIR
+
+    entry = RESULT_CACHE_DIR / "ab" / "abcd.json"
+    public = RESULTS_DIR / "_static_probe.json"
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    entry.write_text("{}")
+    public.write_text("{}")
+    try:
+        assert client.get("/results/_cache/ab/abcd.json").status_code == 404
+        assert client.get("/results/x/../_cache/ab/abcd.json").status_code == 404
+        assert client.get("/results/_static_probe.json").status_code == 200
+    finally:
+        entry.unlink()
+        public.unlink()
+
+
+# ---------- columnar detections ----------
+def test_predict_image_columnar_format(monkeypatch):
+    dets = [
+        {"class_id": 2, "class_name": "stop", "confidence": 0.9, "bbox_xyxy": [1.0, 2.0, 3.0, 4.0]},
+        {"class_id": 0, "class_name": "car", "confidence": 0.5, "bbox_xyxy": [5.0, 6.0, 7.0, 8.0]},
+    ]
+    monkeypatch.setattr("app.routers.predict.resolve_requested_model", lambda req: "mock-model", raising=False)
+    monkeypatch.setattr("app.routers.predict.load_model", lambda name: name, raising=False)
+    monkeypatch.setattr("app.routers.predict.current_model_path", lambda name=None: "/models/mock.pt", raising=False)
+    monkeypatch.setattr("app.routers.predict.infer_pil", lambda pil, *a: (320, 240, 0.01, dets, object()), raising=False)
+    monkeypatch.setattr("app.routers.predict.record_metrics", lambda *a, **k: None, raising=False)
+    monkeypatch.setattr(
+        "app.routers.predict.save_prediction_payload",
+        lambda stem, ts, resp, png, model_name=None, **k: ({"web_path": f"/static/{stem}.json"}, None, None),
+        raising=False,
+    )
+
+    files = {"file": ("a.png", make_png_bytes(), "image/png")}
+    r = client.post("/predict/image", files=files, params={"annotated": "false", "format": "columnar"})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["detections"] == {
+        "boxes": [[1.0, 2.0, 3.0, 4.0], [5.0, 6.0, 7.0, 8.0]],
+        "scores": [0.9, 0.5],
+        "class_ids": [2, 0],
+        "class_names": ["stop", "car"],
+    }
+    assert body["inference"]["detections"] == 2
+
+
+# ---------- lazy annotation ----------
+def test_predict_image_lazy_annotation(monkeypatch):
+    dets = [{"class_id": 0, "class_name": "car", "confidence": 0.8, "bbox_xyxy": [10.0, 20.0, 110.0, 120.0]}]
+    monkeypatch.setattr("app.routers.predict.resolve_requested_model", lambda req: "mock-model", raising=False)
+    monkeypatch.setattr("app.routers.predict.load_model", lambda name: name, raising=False)
+    monkeypatch.setattr("app.routers.predict.current_model_path", lambda name=None: "/models/mock.pt", raising=False)
+    monkeypatch.setattr("app.routers.predict.infer_pil", lambda pil, *a: (320, 240, 0.01, dets, object()), raising=False)
+    monkeypatch.setattr("app.routers.predict.record_metrics", lambda *a, **k: None, raising=False)
+    monkeypatch.setattr("app.routers.predict.ANNOTATION_MODE", "lazy", raising=False)
+
+    def _no_eager(res0):
+        raise AssertionError("lazy mode must not annotate inside the request")
+
+    monkeypatch.setattr("app.routers.predict.annotate_image", _no_eager, raising=False)
+
+    files = {"file": ("lazy.png", make_png_bytes(), "image/png")}
+    r = client.post("/predict/image", files=files, params={"annotation_format": "jpeg", "annotation_max_size": 160})
+    assert r.status_code == 200, r.text
+    url = r.json()["web_path"]
+    assert url.startswith("/predict/annotated/") and "fmt=jpeg" in url
+
+    img = client.get(url)
+    assert img.status_code == 200, img.text
+    assert img.headers["content-type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(img.content)).size == (160, 120)
+    assert client.get(url).content == img.content  # lần 2 lấy từ cache
+
+    svg = client.get(url.split("?")[0], params={"fmt": "svg"})
+    assert svg.status_code == 200
+    assert 'width="320"' in svg.text and "car 0.80" in svg.text
+
+
+# ---------- intake ----------
+def test_intake_drafts_large_jpeg_and_maps_boxes_back(monkeypatch):
+    import torch
+    from fastapi import HTTPException
+    from app.services import intake
+    from app.services.inference import parse_result
+
+    buf = io.BytesIO()
+    Image.new("RGB", (2560, 1920), (10, 20, 30)).save(buf, format="JPEG")
+    img = intake.decode_image(buf.getvalue(), target=640)
+
+    assert img.size == (2560, 1920)
+    assert img.array.shape == (480, 640, 3)  # JPEG decode ở scale 1/4
+    assert img.array.flags["C_CONTIGUOUS"]
+    assert img.array[0, 0].tolist() == [30, 20, 10]  # BGR
+
+    class _Boxes:
+        data = torch.tensor([[10.0, 20.0, 30.0, 40.0, 0.9, 0.0]])
+
+        def __len__(self):
+            return 1
+
+    class _Res:
+        boxes = _Boxes()
+        names = {0: "car"}
+
+    sx, sy = img.scale
+    assert parse_result(_Res(), img.scale)[0]["bbox_xyxy"] == [10.0 * sx, 20.0 * sy, 30.0 * sx, 40.0 * sy]
+
+    monkeypatch.setattr(intake, "INTAKE_MAX_PIXELS", 1000)
+    try:
+        intake.decode_image(buf.getvalue())
+        raise AssertionError("expected 413")
+    except HTTPException as e:
+        assert e.status_code == 413
+
+
+# ---------- write-behind persistence ----------
+def test_persistence_queue_returns_location_then_flushes(monkeypatch):
+    import threading
+    from app.services import persistence
+
+    written = {}
+    gate = threading.Event()
+
+    def slow_save(items):
+        gate.wait(5)
+        written.update({rel_path: data for rel_path, data, _ in items})
+        return [{"web_path": f"/results/{rel_path}", "gcs": None} for rel_path, _, _ in items]
+
+    monkeypatch.setattr(persistence, "save_results_many", slow_save)
+    monkeypatch.setattr(persistence, "STORAGE_BACKEND", "local")
+    q = persistence.PersistenceQueue(max_queue=4, workers=1)
+
+    meta = q.write("m/a_1/result.json", {"ok": True}, "application/json")
+    assert meta == {"web_path": "/results/m/a_1/result.json", "gcs": None}
+    assert written == {}
+    assert b'"ok": true' in q.read("m/a_1/result.json")  # đọc được khi còn trong hàng đợi
+
+    # durable: ghi ngay, trả meta thật
+    gate.set()
+    assert q.write("m/b_1/result.json", {"ok": 1}, "application/json", durable=True)["web_path"]
+    q.close(timeout=5)
+    assert set(written) == {"m/a_1/result.json", "m/b_1/result.json"}
+    assert q.stats()["written"] == 1 and q.stats()["pending_files"] == 0
+
+
+# ---------- GCS client pool ----------
+def test_gcs_client_is_shared_and_upload_many_keeps_order(monkeypatch):
+    import requests as _requests
+    from app import utils
+
+    created = []
+
+    class FakeBlob:
+        def __init__(self, path):
+            self.name = path
+            self.public_url = f"https://storage.googleapis.com/bkt/{path}"
+
+        def upload_from_string(self, data, content_type=None):
+            if data == b"boom":
+                raise RuntimeError("upload failed")
+
+        def generate_signed_url(self, **kw):
+            raise RuntimeError("cannot sign")
+
+        def download_as_bytes(self):
+            return self.name.encode()
+
+    class FakeBucket:
+        def blob(self, path):
+            return FakeBlob(path)
+
+    class FakeClient:
+        def __init__(self):
+            created.append(self)
+            self._http = _requests.Session()
+
+        def bucket(self, name):
+            return FakeBucket()
+
+    monkeypatch.setattr(utils.storage, "Client", FakeClient)
+    monkeypatch.setattr(utils, "_client", None)
+    monkeypatch.setattr(utils, "_buckets", {})
+    monkeypatch.setattr(utils, "GCS_BUCKET_NAME", "bkt")
+
+    out = utils.upload_many([(b"{}", "r/a.json", None), (b"boom", "r/a.png", "image/png"), (b"x", "r/b.json", None)])
+    assert [o["path"] if isinstance(o, dict) else "err" for o in out] == ["r/a.json", "err", "r/b.json"]
+    assert utils.download_many([("bkt", "p1"), ("bkt", "p2")]) == [b"p1", b"p2"]
+    assert len(created) == 1
+
+
+# ---------- /predict/urls ----------
+def test_predict_urls_fetches_concurrently_and_rejects_bad_bodies(monkeypatch):
+    from app.services.fetcher import url_fetcher
+
+    png = make_png_bytes()
+
+    def handler(req):
+        if req.url.path == "/ok.png":
+            return httpx.Response(200, content=png, headers={"content-type": "image/png"})
+        if req.url.path == "/page":
+            return httpx.Response(200, content=b"<html>", headers={"content-type": "text/html"})
+        if req.url.path == "/big.jpg":
+            return httpx.Response(200, content=b"x" * (len(png) + 1), headers={"content-type": "image/jpeg"})
+        return httpx.Response(404)
+
+    mock_url_transport(monkeypatch, handler)
+    monkeypatch.setattr(url_fetcher, "max_bytes", len(png))
+    monkeypatch.setattr("app.routers.predict.resolve_requested_model", lambda req: "mock-model", raising=False)
+    monkeypatch.setattr("app.routers.predict.load_model", lambda name: name, raising=False)
+    monkeypatch.setattr(
+        "app.routers.predict.infer_batch", lambda imgs, *a: [stub_infer_pil_return() for _ in imgs], raising=False
+    )
+    monkeypatch.setattr("app.routers.predict.record_metrics", lambda *a, **k: None, raising=False)
+    monkeypatch.setattr(
+        "app.routers.predict.save_prediction_payload",
+        lambda stem, ts, resp, png, model_name=None, **k: ({"web_path": f"/static/{stem}.json"}, None, None),
+        raising=False,
+    )
+
+    urls = ["https://a.example/ok.png", "https://a.example/missing.png", "https://b.example/page", "https://b.example/big.jpg"]
+    r = client.post("/predict/urls", json={"urls": urls})
+    assert r.status_code == 200, r.text
+    results = r.json()["results"]
+    assert [x["source"] for x in results] == urls
+    assert results[0]["ok"] and results[0]["result_json"] == {"web_path": "/static/ok.json"}
+    assert results[1]["error"] == "Download failed: HTTP 404"
+    assert "not an image" in results[2]["error"]
+    assert "exceeds" in results[3]["error"]
+
+
+def test_url_fetch_overall_deadline_and_idle_hosts_dropped():
+    import asyncio
+    from fastapi import HTTPException
+    from app.services.fetcher import UrlFetcher
+
+    async def drip():
+        for _ in range(20):  # mỗi chunk nhanh hơn timeout từng lần đọc, tổng thì vượt xa
+            await asyncio.sleep(0.05)
+            yield b"x"
+
+    def handler(req):
+        if req.url.path == "/slow.png":
+            return httpx.Response(200, content=drip(), headers={"content-type": "image/png"})
+        return httpx.Response(200, content=make_png_bytes(), headers={"content-type": "image/png"})
+
+    fetcher = UrlFetcher(timeout=0.3, transport=httpx.MockTransport(handler))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        with pytest.raises(HTTPException) as exc:
+            await fetcher.fetch("https://slow.example/slow.png")
+        assert exc.value.detail == "Download failed: timed out" and loop.time() - start < 0.8
+        await asyncio.gather(*(fetcher.fetch(f"https://h{i}.example/ok.png") for i in range(5)))
+        assert fetcher._hosts == {}  # semaphore theo host bỏ khi không còn request
+        await fetcher.aclose()
+
+    asyncio.run(run())
+
+
+# ---------- bulk GCS prefix ----------
+def test_bulk_job_pipeline_resumes_from_existing_results(monkeypatch):
+    from app.services import bulk
+
+    objects = [f"images/api/{i}.png" for i in range(7)] + ["images/api/notes.txt"]
+    png = make_png_bytes()
+    saved = {}
+
+    monkeypatch.setattr(bulk, "load_model", lambda name: "mock-model")
+    monkeypatch.setattr(bulk, "current_model_path", lambda name=None: "/models/mock.pt")
+    monkeypatch.setattr(bulk, "record_metrics", lambda *a, **k: None)
+    monkeypatch.setattr(
+        bulk, "list_blob_names", lambda b, p, suffixes: [o for o in objects if o.startswith(p) and o.endswith(suffixes)]
+    )
+    monkeypatch.setattr(bulk, "download_bytes", lambda b, p: b"broken" if p.endswith("3.png") else png)
+    monkeypatch.setattr(bulk, "infer_batch", lambda imgs, *a: [stub_infer_pil_return() for _ in imgs])
+    monkeypatch.setattr(
+        bulk, "save_results_many", lambda items: saved.update({r: d for r, d, _ in items}) or [{} for _ in items]
+    )
+    monkeypatch.setattr(bulk, "list_result_files", lambda prefix: set(saved))
+
+    job = bulk.BulkJob("bkt", "images/api/", download_workers=3, decode_workers=2, upload_workers=2, batch_size=4)
+    st = job.run()
+    assert st["status"] == "done" and st["listed"] == 7 and st["total"] == 7
+    assert st["completed"] == 6 and st["failed"] == 1
+    assert st["errors"][0]["object"] == "images/api/3.png" and st["errors"][0]["stage"] == "decode"
+    assert "mock-model/bulk/bkt/images/api/0.png/result.json" in saved
+
+    # Chạy lại: chỉ còn object lỗi
+    st = bulk.BulkJob("bkt", "images/api/").run()
+    assert st["skipped"] == 6 and st["total"] == 1
+
+
+def test_bulk_gcs_upload_failure_is_reported_and_finished_jobs_pruned(monkeypatch):
+    from app.services import bulk
+
+    # STORAGE_BACKEND=both: GCS lỗi -> object tính là lỗi, result.json local bị xoá để lần sau chạy lại
+    monkeypatch.setattr(bulk, "STORAGE_BACKEND", "both")
+    monkeypatch.setattr(bulk, "BULK_UPLOAD_RETRIES", 1)
+    monkeypatch.setattr(bulk, "load_model", lambda name: "mock-model")
+    monkeypatch.setattr(bulk, "current_model_path", lambda name=None: "/models/mock.pt")
+    monkeypatch.setattr(bulk, "record_metrics", lambda *a, **k: None)
+    monkeypatch.setattr(bulk, "list_blob_names", lambda b, p, suffixes: ["x/0.png", "x/1.png"])
+    monkeypatch.setattr(bulk, "download_bytes", lambda b, p: make_png_bytes())
+    monkeypatch.setattr(bulk, "infer_batch", lambda imgs, *a: [stub_infer_pil_return() for _ in imgs])
+    monkeypatch.setattr(bulk, "list_result_files", lambda prefix: set())
+    attempts, deleted = [], []
+    monkeypatch.setattr(
+        bulk,
+        "save_results_many",
+        lambda items: attempts.append(items[0][0])
+        or [{"web_path": r, "gcs": None if "/0.png/" in r else {"uri": r}} for r, _, _ in items],
+    )
+    monkeypatch.setattr(bulk, "delete_local_result", deleted.append)
+
+    events = []
+    job = bulk.BulkJob("bkt", "x/", upload_workers=1)
+    job.subscribe(events.append)
+    st = job.run()
+    assert st["completed"] == 1 and st["failed"] == 1
+    assert st["errors"][0]["object"] == "x/0.png" and st["errors"][0]["stage"] == "upload"
+    assert sum("/0.png/" in r for r in attempts) == 2 and deleted == ["mock-model/bulk/bkt/x/0.png/result.json"]
+    assert {e["object"]: e["ok"] for e in events if e["type"] == "item"} == {"x/0.png": False, "x/1.png": True}
+
+    # Registry: job đã kết thúc bị bỏ sau TTL hoặc khi vượt số tối đa, job đang chạy giữ nguyên
+    monkeypatch.setattr(bulk, "bulk_jobs", {})
+    monkeypatch.setattr(bulk, "BULK_JOB_TTL", 60)
+    monkeypatch.setattr(bulk, "BULK_MAX_FINISHED_JOBS", 2)
+    now = bulk.time()
+    jobs = [bulk.BulkJob("bkt", f"p{i}/") for i in range(5)]
+    for job, ended in zip(jobs, [now - 120, now - 30, now - 20, now - 10, None]):
+        job.finished_at, job.status = ended, "running" if ended is None else "done"
+        bulk.bulk_jobs[job.id] = job
+    assert bulk.active_bulk_jobs() == [jobs[4]]
+    assert set(bulk.bulk_jobs) == {jobs[2].id, jobs[3].id, jobs[4].id}
+
+
+def test_bulk_inference_goes_through_executor_admission(monkeypatch):
+    import threading
+    from app.services import bulk
+    from app.services.executor import InferenceExecutor
+
+    executor = InferenceExecutor(max_workers=1, max_queue=0)
+    monkeypatch.setattr(bulk, "inference_executor", executor)
+    seen = []
+
+    def fake_infer_batch(imgs, *a):
+        seen.append((threading.current_thread().name, executor.inflight, executor.saturated()))
+        return [stub_infer_pil_return() for _ in imgs]
+
+    monkeypatch.setattr(bulk, "load_model", lambda name: "mock-model")
+    monkeypatch.setattr(bulk, "current_model_path", lambda name=None: "/models/mock.pt")
+    monkeypatch.setattr(bulk, "record_metrics", lambda *a, **k: None)
+    monkeypatch.setattr(bulk, "list_blob_names", lambda b, p, suffixes: ["x/0.png", "x/1.png"])
+    monkeypatch.setattr(bulk, "download_bytes", lambda b, p: make_png_bytes())
+    monkeypatch.setattr(bulk, "infer_batch", fake_infer_batch)
+    monkeypatch.setattr(bulk, "save_results_many", lambda items: [{"web_path": r} for r, _, _ in items])
+    monkeypatch.setattr(bulk, "list_result_files", lambda prefix: set())
+
+    # Executor đang kín (request HTTP giữ suất): bulk chờ, không infer chen vào
+    assert executor._try_acquire()
+    job = bulk.BulkJob("bkt", "x/", batch_size=2)
+    runner = threading.Thread(target=job.run)
+    runner.start()
+    runner.join(0.5)
+    assert runner.is_alive() and seen == []
+
+    executor._release()
+    runner.join(5)
+    assert job.status == "done" and job.stages["upload"].done == 2
+    # Chạy trên worker của executor, chiếm 1 suất nên /readyz + 429/503 thấy bận
+    assert seen and all(name.startswith("inference") and n == 1 and sat for name, n, sat in seen)
+    assert executor.inflight == 0
+    executor.shutdown()
+
+
+def test_streaming_results_emit_each_item_with_index(monkeypatch):
+    import json
+    from app.services import bulk
+
+    # /predict/images?stream=true: mỗi ảnh 1 dòng kèm index, ảnh lỗi không chặn ảnh khác
+    monkeypatch.setattr("app.routers.predict.resolve_requested_model", lambda req: "mock-model", raising=False)
+    monkeypatch.setattr("app.routers.predict.load_model", lambda name: name, raising=False)
+    monkeypatch.setattr("app.routers.predict.infer_batch", lambda imgs, *a: [stub_infer_pil_return() for _ in imgs])
+    monkeypatch.setattr("app.routers.predict.record_metrics", lambda *a, **k: None, raising=False)
+    monkeypatch.setattr(
+        "app.routers.predict.save_prediction_payload",
+        lambda stem, ts, resp, png, *a, **k: ({"web_path": f"/static/{stem}.json"}, None, None),
+        raising=False,
+    )
+    files = [
+        ("files", ("a.png", make_png_bytes(), "image/png")),
+        ("files", ("broken.png", b"not an image", "image/png")),
+        ("files", ("c.png", make_png_bytes(), "image/png")),
+    ]
+    r = client.post("/predict/images", files=files, params={"stream": "true", "annotated": "false"})
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(l) for l in r.text.splitlines()]
+    items = {l["index"]: l for l in lines if l["type"] == "item"}
+    assert sorted(items) == [0, 1, 2]
+    assert items[0]["filename"] == "a.png" and items[0]["ok"]
+    assert not items[1]["ok"] and items[2]["ok"]
+    assert lines[-1]["type"] == "summary" and lines[-1]["count"] == 3 and lines[-1]["failed"] == 1
+
+    # Bulk job: listener nhận từng object ngay khi xong, summary cuối cùng
+    monkeypatch.setattr(bulk, "load_model", lambda name: "mock-model")
+    monkeypatch.setattr(bulk, "current_model_path", lambda name=None: "/models/mock.pt")
+    monkeypatch.setattr(bulk, "record_metrics", lambda *a, **k: None)
+    monkeypatch.setattr(bulk, "list_blob_names", lambda b, p, suffixes: ["x/0.png", "x/1.png", "x/2.png"])
+    monkeypatch.setattr(bulk, "download_bytes", lambda b, p: b"broken" if p.endswith("1.png") else make_png_bytes())
+    monkeypatch.setattr(bulk, "infer_batch", lambda imgs, *a: [stub_infer_pil_return() for _ in imgs])
+    monkeypatch.setattr(bulk, "save_results_many", lambda items: [{"web_path": r} for r, _, _ in items])
+    monkeypatch.setattr(bulk, "list_result_files", lambda prefix: set())
+
+    job = bulk.BulkJob("bkt", "x/", download_workers=2, decode_workers=2, upload_workers=2, batch_size=2)
+    events = []
+    job.subscribe(events.append)
+    job.run()
+    assert job.finished.is_set()
+    assert sorted((e["index"], e["ok"]) for e in events if e["type"] == "item") == [(0, True), (1, False), (2, True)]
+    assert events[-1]["type"] == "summary" and events[-1]["completed"] == 2
+
+
+# ---------- /predict/video ----------
+def test_predict_video_streams_ndjson_with_stride(monkeypatch, tmp_path):
+    import json
+    import cv2
+
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10.0, (64, 48))
+    for i in range(10):
+        writer.write(np.full((48, 64, 3), i * 20, dtype=np.uint8))
+    writer.release()
+
+    batches = []
+
+    def fake_infer_batch(imgs, *a):
+        batches.append(len(imgs))
+        return [(64, 48, 0.01, [], object()) for _ in imgs]
+
+    monkeypatch.setattr("app.routers.predict.resolve_requested_model", lambda req: "mock-model", raising=False)
+    monkeypatch.setattr("app.routers.predict.load_model", lambda name: name, raising=False)
+    monkeypatch.setattr("app.routers.predict.infer_batch", fake_infer_batch, raising=False)
+    monkeypatch.setattr("app.routers.predict.VIDEO_BATCH_SIZE", 2, raising=False)
+
+    with open(path, "rb") as f:
+        r = client.post("/predict/video", files={"file": ("clip.avi", f, "video/x-msvideo")}, params={"stride": 3})
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(l) for l in r.text.splitlines()]
+    assert lines[0]["type"] == "meta" and lines[0]["stride"] == 3
+    assert [l["frame"] for l in lines if l["type"] == "frame"] == [0, 3, 6, 9]
+    assert batches == [2, 2]
+    summary = lines[-1]
+    assert summary["type"] == "summary" and summary["frames_inferred"] == 4 and summary["frames_read"] == 10
+
+    bad = client.post("/predict/video", files={"file": ("clip.txt", b"x", "text/plain")})
+    assert bad.status_code == 400
+
+
+def test_predict_video_track_mode_runs_detector_on_keyframes_only(monkeypatch, tmp_path):
+    import json
+    import cv2
+
+    path = str(tmp_path / "static.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10.0, (64, 48))
+    for _ in range(10):
+        writer.write(np.full((48, 64, 3), 120, dtype=np.uint8))
+    writer.release()
+
+    calls = []
+    det = {"class_id": 0, "class_name": "obj", "confidence": 0.9, "bbox_xyxy": [10.0, 10.0, 30.0, 30.0]}
+
+    def fake_infer_pil(img, *a, **k):
+        calls.append(img)
+        return 64, 48, 0.01, [dict(det)], object()
+
+    monkeypatch.setattr("app.routers.predict.resolve_requested_model", lambda req: "mock-model", raising=False)
+    monkeypatch.setattr("app.routers.predict.load_model", lambda name: name, raising=False)
+    monkeypatch.setattr("app.routers.predict.infer_pil", fake_infer_pil, raising=False)
+
+    with open(path, "rb") as f:
+        r = client.post(
+            "/predict/video",
+            files={"file": ("static.avi", f, "video/x-msvideo")},
+            params={"mode": "track", "keyframe_interval": 4},
+        )
+    assert r.status_code == 200, r.text
+    lines = [json.loads(l) for l in r.text.splitlines()]
+    assert lines[0]["mode"] == "track"
+    frames = [l for l in lines if l["type"] == "frame"]
+    assert [l["frame"] for l in frames if l["keyframe"]] == [0, 4, 8]
+    assert len(calls) == 3
+    # Track giữ id giữa các keyframe, frame propagate vẫn có box
+    assert {l["detections"][0]["track_id"] for l in frames} == {1}
+    summary = lines[-1]
+    assert summary["model_invocations"] == 3 and summary["invocations_saved"] == 7
+
+    # format=columnar giữ track_id thành cột track_ids
+    with open(path, "rb") as f:
+        r = client.post(
+            "/predict/video",
+            files={"file": ("static.avi", f, "video/x-msvideo")},
+            params={"mode": "track", "keyframe_interval": 4, "format": "columnar"},
+        )
+    frames = [json.loads(l) for l in r.text.splitlines() if json.loads(l)["type"] == "frame"]
+    assert frames and all(l["detections"]["track_ids"] == [1] for l in frames)
+
+
+# ---------- /predict/stream (WebSocket) ----------
+def test_camera_stream_drops_stale_frames(monkeypatch):
+    import threading
+
+    started, release = threading.Event(), threading.Event()
+    seen = []
+
+    def slow_infer(img, *a, **k):
+        seen.append(img)
+        started.set()
+        release.wait(5)
+        return stub_infer_pil_return()
+
+    monkeypatch.setattr("app.routers.stream.load_model", lambda name: "mock-model")
+    monkeypatch.setattr("app.routers.stream.infer_pil", slow_infer)
+    saved = []
+    monkeypatch.setattr("app.routers.stream.save_prediction_payload", lambda *a, **k: saved.append(a))
+
+    frame = make_png_bytes()
+    with client.websocket_connect("/predict/stream") as ws:
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_bytes(frame)  # seq 0: đang infer
+        assert started.wait(5)
+        for _ in range(3):  # seq 1, 2 bị seq 3 đè
+            ws.send_bytes(frame)
+        ws.send_text('{"type": "stats"}')
+        stats = ws.receive_json()
+        assert stats["type"] == "stats" and stats["received"] == 4 and stats["dropped"]["stale"] == 2
+        release.set()
+        first, second = ws.receive_json(), ws.receive_json()
+        assert (first["seq"], second["seq"]) == (0, 3)
+        assert second["type"] == "frame" and second["dropped"] == 2 and second["latency_ms"] >= 0
+    assert len(seen) == 2
+    assert saved == []  # mặc định không lưu từng frame
+
+    # persist=true: lưu từng frame nhưng ở thread khác, không chặn event loop
+    loop_thread = []
+    monkeypatch.setattr(
+        "app.routers.stream.resolve_requested_model", lambda ws: loop_thread.append(threading.current_thread())
+    )
+    monkeypatch.setattr(
+        "app.routers.stream.save_prediction_payload", lambda *a, **k: saved.append(threading.current_thread())
+    )
+    with client.websocket_connect("/predict/stream?persist=true") as ws:
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_bytes(frame)
+        assert ws.receive_json()["type"] == "frame"
+    assert len(saved) == 1 and saved[0] is not loop_thread[0]
+
+
+# ---------- rectangular inference ----------
+def test_rect_inference_groups_batches_by_input_shape(monkeypatch):
+    import contextlib
+    import threading
+    from types import SimpleNamespace
+    from app.services import inference
+    from app.services.intake import DecodedImage
+
+    assert inference.rect_shape(1622, 626, 640, 32) == (256, 640)
+    assert inference.rect_shape(626, 1622, 640, 32) == (640, 256)
+    assert inference.rect_shape(500, 500, 640, 32) == (640, 640)
+
+    calls = []
+
+    class _Model:
+        def predict(self, arrays, imgsz, **k):
+            calls.append((len(arrays), imgsz))
+            return [SimpleNamespace(boxes=None) for _ in arrays]
+
+    entry = SimpleNamespace(model=_Model(), lock=threading.Lock())
+    monkeypatch.setattr(inference, "model_pool", SimpleNamespace(acquire=lambda name: contextlib.nullcontext(entry)))
+    monkeypatch.setattr(inference, "resolve_model_name", lambda name=None: "mock-model")
+    monkeypatch.setattr(inference, "INFER_RECT", True)
+
+    wide = DecodedImage(np.zeros((247, 640, 3), np.uint8), 1622, 626)
+    tall = DecodedImage(np.zeros((640, 247, 3), np.uint8), 626, 1622)
+    out = inference._predict_batch([wide, tall, wide], "mock-model")
+    assert sorted(calls) == [(1, [640, 256]), (2, [256, 640])]
+    assert [o[:2] for o in out] == [(1622, 626), (626, 1622), (1622, 626)]
+
+    calls.clear()
+    monkeypatch.setattr(inference, "INFER_RECT", False)
+    inference._predict_batch([wide, tall], "mock-model")
+    assert calls == [(2, inference.IMG_SIZE)]
+
+
+# ---------- startup warmup + /readyz ----------
+def test_readyz_waits_for_warmup_and_reports_saturation(monkeypatch):
+    from app.services import warmup
+    from app.services.executor import inference_executor
+
+    state = warmup.Readiness()
+    monkeypatch.setattr("app.routers.health.readiness", state)
+    r = client.get("/readyz")
+    assert r.status_code == 503 and r.json()["status"] == "starting"
+    assert client.get("/healthz").status_code == 200  # liveness không phụ thuộc model
+
+    calls = []
+    monkeypatch.setattr(warmup, "load_model", lambda name: name)
+    monkeypatch.setattr(warmup, "infer_batch", lambda imgs, name: calls.append((name, len(imgs), imgs[0].array.shape)))
+    monkeypatch.setattr(warmup, "WARMUP_SHAPES", [(256, 640), (640, 640)])
+    monkeypatch.setattr(warmup, "WARMUP_BATCH_SIZES", [1, 4])
+    monkeypatch.setattr(warmup, "WARMUP_RUNS", 1)
+    monkeypatch.setattr(warmup.thread_tuner, "mode", "off")
+
+    assert warmup.preload_and_warmup(["mock-model"], state)
+    assert calls == [
+        ("mock-model", 1, (256, 640, 3)),
+        ("mock-model", 4, (256, 640, 3)),
+        ("mock-model", 1, (640, 640, 3)),
+        ("mock-model", 4, (640, 640, 3)),
+    ]
+    r = client.get("/readyz")
+    assert r.status_code == 200 and r.json()["models"]["mock-model"]["status"] == "ready"
+
+    monkeypatch.setattr(inference_executor, "_inflight", inference_executor.capacity)
+    r = client.get("/readyz")
+    assert r.status_code == 503 and r.json()["status"] == "saturated"
+
+    failed = warmup.Readiness()
+    monkeypatch.setattr(warmup, "load_model", lambda name: (_ for _ in ()).throw(RuntimeError("boom")))
+    assert not warmup.preload_and_warmup(["mock-model"], failed)
+    assert failed.status == "failed" and "boom" in failed.error
+
+
+# ---------- torch threads theo CPU quota ----------
+def test_thread_budget_from_cgroup_and_autotune(monkeypatch, tmp_path):
+    import torch
+    from app.services import threads
+
+    (tmp_path / "cpu.max").write_text("200000 100000\n")  # 2 CPU
+    monkeypatch.setattr(threads.os, "sched_getaffinity", lambda pid: set(range(16)))
+    assert threads.cpu_quota(tmp_path) == 2.0
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert threads.cpu_quota(tmp_path) == 16.0
+    assert threads.thread_budget(16.0, workers=4, streams=2) == 2
+    assert threads.thread_budget(2.0, workers=4) == 1
+    assert threads.candidates(6) == [1, 2, 4, 6]
+
+    # giả lập: 4 thread nhanh nhất nhưng batch 1 chậm hơn 2 thread quá 10% -> chọn 2
+    timings = {1: (0.100, 0.400), 2: (0.060, 0.200), 4: (0.070, 0.150)}
+    current = {}
+    monkeypatch.setattr(torch, "set_num_threads", lambda n: current.update(n=n))
+    monkeypatch.setattr(torch, "get_num_threads", lambda: current["n"])
+    monkeypatch.setattr(threads, "_timed", lambda run, batch: timings[current["n"]][0 if batch == 1 else 1])
+    monkeypatch.setattr(threads, "BATCH_MAX_SIZE", 4)
+
+    tuner = threads.ThreadTuner()
+    tuner.mode, tuner.budget, tuner.intra_op = "auto", 4, 4
+    assert tuner.autotune(lambda batch: None, runs=1) == 2
+    assert [t["intra_op"] for t in tuner.trials] == [1, 2, 4]
+
+    monkeypatch.setattr("app.routers.health.thread_tuner", tuner)
+    body = client.get("/info").json()["threads"]
+    assert body["intra_op_threads"] == 2 and len(body["trials"]) == 3
+
+
+# ---------- inference backends ----------
+def test_onnx_backend_selection_export_cache_and_parse_result(monkeypatch, tmp_path):
+    import os
+    from pathlib import Path
+    from types import SimpleNamespace
+    from app.services import backends
+    from app.services.inference import parse_result
+
+    # MODEL_BACKENDS (theo model) > INFERENCE_BACKEND (mặc định); tên lạ quay về torch
+    monkeypatch.setattr(backends, "INFERENCE_BACKEND", "onnx")
+    monkeypatch.setattr(backends, "MODEL_BACKENDS", {"best": "torch", "odd": "tensorrt"})
+    assert backends.backend_name_for("yolov8n") == "onnx"
+    assert backends.backend_name_for("best") == "torch" and backends.backend_name_for("odd") == "torch"
+    assert backends.get_backend("yolov8n") is backends.BACKENDS["onnx"]
+
+    data = np.array([[10.0, 20.0, 110.0, 220.0, 0.9, 0.0], [5.0, 6.0, 7.0, 8.0, 0.4, 1.0]], dtype=np.float32)
+
+    class FakeBoxes:
+        data = SimpleNamespace(cpu=lambda: SimpleNamespace(numpy=lambda: data))
+
+        def __len__(self):
+            return len(data)
+
+    def fake_result():
+        return SimpleNamespace(names={0: "person", 1: "car"}, boxes=FakeBoxes())
+
+    exports, loaded = [], []
+
+    class FakeYOLO:
+        def __init__(self, path, task=None):
+            self.path = path
+            loaded.append((path, task))
+
+        def export(self, format, **kwargs):
+            exports.append(format)
+            out = Path(self.path).with_suffix(".onnx")
+            out.write_bytes(b"onnx")
+            return str(out)
+
+        def predict(self, *a, **k):
+            return [fake_result()]
+
+    monkeypatch.setattr(backends, "_yolo", FakeYOLO)
+    weights = tmp_path / "m.pt"
+    weights.write_bytes(b"pt")
+    onnx = backends.BACKENDS["onnx"]
+    assert onnx.is_stale(weights)
+
+    model = onnx.load(weights)
+    assert exports == ["onnx"] and loaded[-1] == (str(tmp_path / "m.onnx"), "detect")
+    assert not onnx.is_stale(weights)
+    onnx.load(weights)  # .pt không đổi -> không export lại
+    assert exports == ["onnx"]
+
+    # touch: mtime đổi nhưng nội dung như cũ -> không export lại
+    st = weights.stat()
+    os.utime(weights, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert not onnx.is_stale(weights)
+
+    # rollback / cp -p: nội dung khác nhưng mtime cũ hơn .onnx -> vẫn export lại
+    weights.write_bytes(b"pt-old")
+    os.utime(weights, ns=(st.st_atime_ns, st.st_mtime_ns - 10**10))
+    assert onnx.is_stale(weights)
+    onnx.load(weights)
+    assert exports == ["onnx", "onnx"] and not onnx.is_stale(weights)
+
+    # Kết quả ONNX parse giống hệt kết quả torch (names dict, tensor về CPU)
+    dets = parse_result(model.predict(None)[0])
+    assert dets == parse_result(fake_result())
+    assert [d["class_name"] for d in dets] == ["person", "car"]
+    assert dets[0]["bbox_xyxy"] == [10.0, 20.0, 110.0, 220.0] and dets[0]["confidence"] == pytest.approx(0.9)
+
+
+# ---------- mmap weights ----------
+def test_mmap_backend_converts_once_and_maps_weights(monkeypatch, tmp_path):
+    from app.config import AVAILABLE_MODELS, DEFAULT_MODEL_NAME
+    from app.services import backends
+
+    monkeypatch.setattr(backends, "MMAP_DIR", tmp_path)
+    weights = AVAILABLE_MODELS[DEFAULT_MODEL_NAME]
+    backend = backends.BACKENDS["mmap"]
+    assert backend.is_stale(weights)
+
+    model = backend.load(weights)
+    artifact = tmp_path / weights.name
+    assert artifact.exists() and not backend.is_stale(weights)
+    assert model.model.is_fused()  # fuse sẵn lúc convert, predict không tạo lại tensor
+    assert str(artifact) in open("/proc/self/maps").read()  # weights đọc qua mmap, không copy
+
+    import torch.utils.serialization
+
+    assert torch.utils.serialization.config.load.mmap is False  # cờ global được trả lại sau load
+
+
+# ---------- hot-reload registry ----------
+def test_registry_hot_reload_swaps_after_warmup(monkeypatch, tmp_path):
+    import os
+    from types import SimpleNamespace
+
+    from app.services import warmup
+    from app.services.model_pool import ModelPool
+    from app.services.registry import ModelRegistry
+
+    (tmp_path / "a.pt").write_bytes(b"v1")
+    reg = ModelRegistry(tmp_path)
+    assert reg.names() == ["a"] and reg.scan() == []
+
+    (tmp_path / "b.pt").write_bytes(b"new")
+    assert reg.scan() == []  # chưa chắc đã ghi xong
+    assert reg.scan() == [("added", "b")]
+
+    pool = ModelPool(lambda n: SimpleNamespace(data=reg.path(n).read_bytes()), max_models=4, version_of=reg.version)
+    monkeypatch.setattr(warmup, "model_pool", pool)
+    monkeypatch.setattr(warmup, "model_registry", reg)
+    warmed = []
+    monkeypatch.setattr(warmup, "warm_instance", lambda model: warmed.append(model.data))
+    v1 = reg.version("a")
+
+    with pool.acquire("a") as inflight:
+        (tmp_path / "a.pt").write_bytes(b"v2-retrained")
+        os.utime(tmp_path / "a.pt", ns=(1, 10**18))
+        reg.scan()
+        changes = reg.scan()
+        assert changes == [("changed", "a")]
+        for event, name in changes:
+            warmup.hot_reload(event, name)
+        # request đang chạy vẫn giữ bản cũ, request mới nhận bản mới (đã warmup trước khi swap)
+        assert inflight.model.data == b"v1" and inflight.version == v1
+        with pool.acquire("a") as fresh:
+            assert fresh.model.data == b"v2-retrained" and fresh.version == reg.version("a") != v1
+    assert warmed == [b"v2-retrained"] and pool.swaps == 1
+    assert reg.last_swap["from_version"] == v1 and reg.last_swap["ok"]
+
+    (tmp_path / "b.pt").unlink()
+    assert reg.scan() == [("removed", "b")] and "b" not in reg
+
+    monkeypatch.setattr("app.routers.model.model_registry", reg)
+    monkeypatch.setattr("app.routers.model.model_pool", pool)
+    body = client.get("/model/registry").json()
+    assert body["models"]["a"]["serving_version"] == reg.version("a")
+    assert body["models"]["a"]["last_swap"]["to_version"] == reg.version("a")
+    assert client.post("/model/select", params={"name": "b"}).status_code == 404
+
+
+# ---------- INT8 variants ----------
+def test_int8_variant_registered_and_report_merged(tmp_path):
+    import csv
+
+    import onnx
+    from onnx import TensorProto, helper
+
+    from app.services import quantization
+    from app.services.backends import backend_name_for
+    from app.services.registry import ModelRegistry
+
+    # Conv -> Sigmoid -> Mul -> output: chỉ phần decode sau Conv cuối được giữ FP32
+    graph = helper.make_graph(
+        [
+            helper.make_node("Conv", ["images", "w"], ["c"], name="conv"),
+            helper.make_node("Sigmoid", ["c"], ["s"], name="sig"),
+            helper.make_node("Mul", ["s", "c"], ["out"], name="mul"),
+        ],
+        "g",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, [1, 3, 8, 8])],
+        [helper.make_tensor_value_info("out", TensorProto.FLOAT, None)],
+        [helper.make_tensor("w", TensorProto.FLOAT, [4, 3, 1, 1], [0.1] * 12)],
+    )
+    onnx.save(helper.make_model(graph), tmp_path / "m.onnx")
+    assert sorted(quantization._decode_nodes(tmp_path / "m.onnx")) == ["mul", "sig"]
+
+    (tmp_path / "best.pt").write_bytes(b"pt")
+    (tmp_path / "best.onnx").write_bytes(b"fp32 export cache")
+    reg = ModelRegistry(tmp_path)
+    (tmp_path / "best-int8.onnx").write_bytes(b"int8")
+    reg.scan()
+    assert reg.scan() == [("added", "best-int8")] and reg.names() == ["best", "best-int8"]
+    assert quantization.int8_path("best", tmp_path) == tmp_path / "best-int8.onnx"
+    assert backend_name_for("best-int8") == "onnx"
+
+    report = tmp_path / "cmp.csv"
+    quantization.write_report([{"Model": "best", "Backend": "torch", "Inference_ms_per_img": 12.0}], report)
+    quantization.write_report(
+        [
+            {"Model": "best", "Backend": "torch", "Inference_ms_per_img": 11.6},
+            {"Model": "best-int8", "Backend": "onnx-int8", "mAP50": 0.74, "Inference_ms_per_img": 5.1},
+        ],
+        report,
+    )
+    rows = list(csv.DictReader(open(report)))
+    assert [(r["Model"], r["Inference_ms_per_img"]) for r in rows] == [("best", "11.6"), ("best-int8", "5.1")]
+    assert list(rows[0]) == quantization.REPORT_COLUMNS
+
+
+# ---------- pre-fork: báo cáo bộ nhớ + worker không warmup lại ----------
+def test_prefork_memory_report_and_worker_startup(monkeypatch, tmp_path):
+    from app.services import memory, warmup
+
+    for pid, (rss, pss) in {"10": (800, 500), "11": (450, 160), "12": (450, 160)}.items():
+        (tmp_path / pid / "task" / pid).mkdir(parents=True)
+        (tmp_path / pid / "smaps_rollup").write_text(f"Rss: {rss} kB\nPss: {pss} kB\nShared_Dirty: 400 kB\n")
+    (tmp_path / "10" / "task" / "10" / "children").write_text("11 12")
+
+    assert memory.children(10, tmp_path) == [11, 12]
+    report = memory.memory_report({"master": 10, "worker-0": 11, "worker-1": 12}, tmp_path)
+    assert report["processes"]["worker-0"]["Pss"] == 160 * 1024
+    assert report["sum_rss_bytes"] == 1700 * 1024 and report["saved_bytes"] == (1700 - 820) * 1024
+
+    # worker được fork sau khi master đã preload: startup chỉ áp thread budget, không load/warmup lại
+    state = warmup.Readiness()
+    state.status = "ready"
+    applied = []
+    monkeypatch.setattr(warmup, "readiness", state)
+    monkeypatch.setattr(warmup, "PRELOAD_ON_STARTUP", True)
+    monkeypatch.setattr(warmup.thread_tuner, "apply_budget", lambda: applied.append(True))
+    monkeypatch.setattr(warmup, "preload_and_warmup", lambda *a, **k: pytest.fail("warmup again in worker"))
+    assert warmup.start_warmup() is None and applied == [True]
+
+
+# ---------- import-time guard ----------
+def test_app_import_does_not_pull_heavy_modules():
+    from benchmarks.import_time import import_report
+
+    # Interpreter mới: torch/ultralytics/OTel SDK chỉ được load khi load model hoặc ở startup hook
+    assert import_report("app.config")["heavy"] == []
+    assert import_report("app.main")["heavy"] == []
+
+
+def test_tracing_dns_lookup_bounded_by_timeout(monkeypatch):
+    import time
+
+    from app.services import tracing
+
+    def slow_resolve(*a, **k):
+        time.sleep(1.0)
+        return []
+
+    monkeypatch.setattr(tracing, "TRACING_MODE", "auto")
+    monkeypatch.setattr(tracing, "TRACING_RESOLVE_TIMEOUT", 0.1)
+    monkeypatch.setattr(tracing.socket, "getaddrinfo", slow_resolve)
+    start = time.monotonic()
+    assert tracing._should_enable_tracing() is False
+    assert time.monotonic() - start < 0.5  # không chờ DNS chậm chạy xong